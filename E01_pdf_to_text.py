@@ -6,246 +6,208 @@ import os  # Utilisé pour vérifier si le fichier existe
 import sys
 import time  # Juste pour l'exemple, pour voir la mise à jour
 import getopt
-import re
+import tempfile
+import importlib.metadata
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 # PDF loaders
 import pypdf
-from langchain_community.document_loaders import UnstructuredPDFLoader
 
 from config import load_config, bcolors, logger
+from page_cache import CachePages, empreinte_page
+from build import etape_a_jour, enregistrer_etape
+from nettoyage import MoteurMarkdown, MoteurNettoyage, charger_packs, nettoyer_fichier
+
+# options d'extraction pypdf prises en compte dans la clé du cache des pages
+OPTIONS_PYPDF = {'version': pypdf.__version__}
 
 # =============================================================================
 # format_text_to_markdown
 # =============================================================================
-def format_text_to_markdown(raw_text: str) -> str:
+def format_text_to_markdown(raw_text: str, moteur=None) -> str:
     """
     Nettoie le texte PDF, supprime le bruit et applique un formatage Markdown
     pour améliorer la structure pour les applications RAG.
+    Les règles sont appliquées par le moteur nettoyage.MoteurMarkdown.
     """
-
-    # 1. NETTOYAGE PRÉLIMINAIRE ET SUPPRESSION DU BRUIT CONNU
-
-    # Suppression des identifiants de source (spécifiques à votre input)
-    text = re.sub(r'\+\]', '', raw_text)
-
-    bruit_patterns = [
-        # Motifs de pied/en-tête de page liés à la mise en page
-        r'BOLT 3rd Edition Layouts Correx\.indd \d+\s*BOLT 3rd Edition Layouts Correx\.indd \d+',
-        r'\d{2}/\d{2}/\d{4} \d{2}:\d{2}( \d{2}/\d{2}/\d{4} \d{2}:\d{2})?',
-        r'\n\s*Bolt Action V3\s*\n',
-        r'\n\s*\d{1,3}\s*Bolt Action V3\s*\n',
-        r'\n\s*44mm if 2 lines\s*\n',
-
-        # Numéros de page isolés ou en marge
-        r'^\s*\d{1,3}\s*$',
-        r'\n\s*\d{1,3}\s*$',  # Numéro de page en fin de ligne après le nettoyage initial
-    ]
-
-    for pattern in bruit_patterns:
-        text = re.sub(pattern, '\n', text, flags=re.MULTILINE | re.IGNORECASE)
-
-    # 2. RECONSTRUCTION DE LA STRUCTURE EN MARKDOWN (Titres)
-
-    lines = text.split('\n')
-    markdown_lines = []
-
-    # Titres majeurs (Chapitres, Sections principales)
-    major_titles = [
-        "INTRODUCTION", "CONTENTS", "WARGAMES AND HISTORY", "BASIC SUPPLIES",
-        "CONVENTIONS OF WAR", "UNITS", "THE TURN", "ORDERS", "MOVEMENT",
-        "SHOOTING", "WEAPONS", "CLOSE QUARTERS", "HEADQUARTERS", "ARTILLERY",
-        "VEHICLES", "BUILDINGS", "ARRANGING A GAME OF BOLT ACTION", "FORCE SELECTION",
-        "ARMY LISTS", "OPTIONAL RULES", "COMMON TRANSPORT VEHICLES", "RULES SUMMARY",
-        "CREDITS", "INDEX",
-    ]
-
-    # Titres des Listes d'Armées
-    army_list_titles = [
-        "GERMANY", "UNITED STATES", "GREAT BRITAIN", "SOVIET UNION",
-        "IMPERIAL JAPAN",
-    ]
-
-    # Détection et conversion des lignes en titres Markdown
-    for line in lines:
-        stripped_line = line.strip()
-
-        if not stripped_line:
-            markdown_lines.append(line)
-            continue
-
-        # Titres de Niveau 1 ou 2 (Gros blocs)
-        if stripped_line in major_titles:
-            markdown_lines.append(f'\n## {stripped_line}\n')
-        elif stripped_line in army_list_titles:
-            markdown_lines.append(f'\n## ARMIES OF {stripped_line}\n')
-
-        # Titres de Niveau 3 (Sous-sections, souvent Capitales au début de l'extrait)
-        # Ex: FALL WEISS – THE INVASION OF POLAND, SEPTEMBER 1939
-        elif stripped_line.isupper() and len(stripped_line) < 70 and not stripped_line.isdigit():
-            # Vérifie si la ligne contient plus de 3 mots, sinon c'est potentiellement un bruit ou un titre très court
-            if len(stripped_line.split()) > 3:
-                markdown_lines.append(f'\n### {stripped_line}\n')
-            else:
-                # Si le titre est court et n'est pas un titre principal, le laisser en texte normal pour l'instant
-                markdown_lines.append(line)
-
-        # Lignes normales
-        else:
-            markdown_lines.append(line)
-
-    text = '\n'.join(markdown_lines)
-
-    # 3. NETTOYAGE FINAL (Espacement et cohérence)
-
-    # Remplacement des sauts de ligne multiples (après application des titres)
-    text = re.sub(r'\n{2,}', '\n\n', text).strip()
-
-    # Remplacement des espaces multiples par un seul
-    text = re.sub(r'[ \t]+', ' ', text)
-
-    # Remplacement des espaces multiples autour des titres (s'assure qu'ils sont bien centrés/isolés)
-    text = re.sub(r'\n\s*## ', '\n## ', text)
-    text = re.sub(r' ##\s*\n', ' ##\n', text)
-    text = re.sub(r'\n\s*### ', '\n### ', text)
-    text = re.sub(r' ###\s*\n', ' ###\n', text)
-
-    # Nettoyage des lignes vides inutiles
-    text = re.sub(r'\n\n\n+', '\n\n', text)
-
-    return text
+    if moteur is None:
+        moteur = MoteurMarkdown()
+    return moteur.formater(raw_text)
 
 
 # =============================================================================
 # nettoyage_raw_text
 # =============================================================================
-def nettoyage_raw_text(input_raw_txt_file, output_clean_txt_file=None):
+def nettoyage_raw_text(input_raw_txt_file, output_clean_txt_file=None, moteur=None):
+    """
+    Nettoie le fichier texte brut ; retourne True si le fichier propre a été écrit.
+    """
     try:
-        # Lecture du fichier texte brut
-        with open(input_raw_txt_file, 'r', encoding='utf-8') as f:
-            texte = f.read()
-
-        # --- ÉTAPE 1 : Nettoyages globaux avec Regex (sur tout le texte) ---
-
-        # Règle 1 : Supprime les lignes de métadonnées d'exportation (InDesign)
-        texte = re.sub(r'^BOLT 3rd Edition Layouts Correx\.indd.*$', '', texte, flags=re.MULTILINE)
-
-        # Règle 2 : Supprime les césures avec tiret pour recoller les mots
-        texte = re.sub(r'-\n', '', texte)
-
-        # --- ÉTAPE 2 : Traitement ligne par ligne pour la logique fine ---
-
-        lines = texte.split('\n')
-        repaired_lines = []
-
-        # Liste des ponctuations qui marquent une fin de phrase ou d'idée
-        end_of_line_punctuation = ('.', '!', '?', ':', ')', ']', '"')
-
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-
-            # Règle 3 : Supprime les bruits spécifiques restants sur chaque ligne
-            # Supprime les pieds de page simples comme "Bolt Action V3"
-            line = re.sub(r'^Bolt Action V3$', '', line)
-            # Supprime les en-têtes complexes comme "RULES SUMMARY 311" ou "312 RULES SUMMARY"
-            line = re.sub(r'^(RULES SUMMARY|BOLT ACTION)\s+\d+.*$', '', line)
-            line = re.sub(r'^\d+\s+(RULES SUMMARY|BOLT ACTION).*$', '', line)
-            # Supprime les légendes d'images (marquées par , , etc.)
-            line = re.sub(r'^[].*$', '', line)
-
-            # S'assure que la ligne n'est pas vide après nettoyage
-            line = line.strip()
-            if not line:
-                continue
-
-            # Règle 4 : Formate les titres en majuscules
-            # Si une ligne est en majuscules et courte, on la traite comme un titre
-            if line.isupper() and len(line.split()) < 7 and not any(char.isdigit() for char in line):
-                # Formatage en titre Markdown pour donner du sens à la structure
-                formatted_title = f"\n## {line.title()}\n"
-                repaired_lines.append(formatted_title)
-                continue  # On passe à la ligne suivante
-
-            # Règle 5 : Fusionne les lignes de paragraphes coupées (césures implicites)
-            # C'est la règle la plus importante pour la lisibilité
-            if (repaired_lines and
-                    not repaired_lines[-1].strip().endswith(end_of_line_punctuation) and
-                    not repaired_lines[-1].strip().endswith('##') and
-                    line and line[0].islower()):
-                # La ligne précédente ne se termine pas -> on fusionne
-                repaired_lines[-1] += ' ' + line
-            else:
-                # Sinon, c'est une nouvelle ligne
-                repaired_lines.append(line)
-
-        # Reconstitue le texte à partir des lignes réparées
-        final_texte = "\n".join(repaired_lines)
-
-        # Règle 6 : Normalise les sauts de ligne pour une meilleure lisibilité
-        final_texte = re.sub(r'\n\s*\n+', '\n\n', final_texte)
-
-        # --- SAUVEGARDE DU FICHIER PROPRE ---
-        with open(output_clean_txt_file, 'w', encoding='utf-8') as f:
-            f.write(final_texte)
+        # Lecture du fichier texte brut et nettoyage en flux, ligne par ligne
+        # (règles appliquées par le moteur nettoyage.MoteurNettoyage)
+        if moteur is None:
+            moteur = MoteurNettoyage()
+        nettoyer_fichier(moteur, input_raw_txt_file, output_clean_txt_file)
 
         print(
             f"✅ Nettoyage final terminé. Le fichier propre '{bcolors.OUTPUT}{output_clean_txt_file}{bcolors.ENDC}' a été créé.")
 
     except FileNotFoundError:
         print(f"Erreur : Le fichier d'entrée '{input_raw_txt_file}' n'a pas été trouvé.")
+        return False
     except Exception as e:
         print(f"Une erreur est survenue : {e}")
+        return False
+    return True
+
+
+# =============================================================================
+# _extraire_pages_pypdf
+# =============================================================================
+def _extraire_pages_pypdf(pdf_file_path, pages):
+    """
+    Extrait le texte des pages demandées (liste de numéros de page) du PDF.
+    Exécutée dans un processus du pool : chaque processus ouvre son propre lecteur,
+    les objets pypdf ne pouvant pas être transmis d'un processus à l'autre.
+    """
+    textes = []
+    with open(pdf_file_path, 'rb') as input_pdf_file:
+        reader = pypdf.PdfReader(input_pdf_file)
+        for page_num in pages:
+            textes.append(reader.pages[page_num].extract_text())
+    return textes
+
+
+# =============================================================================
+# _extraire_tranches_pypdf
+# =============================================================================
+def _extraire_tranches_pypdf(pdf_file_path, tranches, nb_workers):
+    """
+    Générateur (pages, textes) pour chaque tranche de pages, dans l'ordre des tranches.
+    Avec nb_workers > 1 les tranches sont extraites dans un pool de processus ; elles sont
+    rendues dans l'ordre dès qu'elles sont prêtes, et le nombre de tranches en cours est
+    borné pour ne pas garder tout le document en mémoire.
+    """
+    nb_workers = min(nb_workers, len(tranches))
+    if nb_workers <= 1:
+        for pages in tranches:
+            yield pages, _extraire_pages_pypdf(pdf_file_path, pages)
+        return
+
+    logger.info(f"Extraction parallèle sur {nb_workers} processus...")
+    with ProcessPoolExecutor(max_workers=nb_workers) as pool:
+        en_cours = deque()
+        a_soumettre = iter(tranches)
+        # on garde au plus 2 tâches d'avance par processus
+        for pages in islice(a_soumettre, 2 * nb_workers):
+            en_cours.append((pages, pool.submit(_extraire_pages_pypdf, pdf_file_path, pages)))
+        while en_cours:
+            pages, future = en_cours.popleft()
+            textes = future.result()
+            for pages_suivantes in islice(a_soumettre, 1):
+                en_cours.append((pages_suivantes, pool.submit(_extraire_pages_pypdf, pdf_file_path, pages_suivantes)))
+            yield pages, textes
+
+
+# =============================================================================
+# cles_cache_pages
+# =============================================================================
+def cles_cache_pages(pdf_file_path, cache, extracteur, options):
+    """
+    Calcule la clé de cache de chaque page du PDF.
+    """
+    with open(pdf_file_path, 'rb') as input_pdf_file:
+        reader = pypdf.PdfReader(input_pdf_file)
+        return [cache.cle(empreinte_page(page), extracteur, options) for page in reader.pages]
+
+
+# =============================================================================
+# pages_pypdf
+# =============================================================================
+def pages_pypdf(pdf_file_path, nb_workers=1, pages_par_tache=8, cache=None):
+    """
+    Générateur (numéro de page, nombre de pages, texte) dans l'ordre des pages.
+    Les pages présentes dans le cache sont lues depuis le disque, les autres sont
+    extraites par tranches (éventuellement en parallèle) puis ajoutées au cache.
+    """
+    if cache is not None:
+        cles = cles_cache_pages(pdf_file_path, cache, 'pypdf', OPTIONS_PYPDF)
+        num_pages = len(cles)
+        a_extraire = [page_num for page_num, cle in enumerate(cles) if not cache.contient(cle)]
+    else:
+        with open(pdf_file_path, 'rb') as input_pdf_file:
+            num_pages = len(pypdf.PdfReader(input_pdf_file).pages)
+        cles = None
+        a_extraire = list(range(num_pages))
+    logger.info(f"Le document contient {num_pages} pages, {len(a_extraire)} à extraire. Extraction en cours...")
+    if nb_workers is None or nb_workers <= 0:
+        nb_workers = os.cpu_count() or 1
+
+    tranches = [a_extraire[i:i + pages_par_tache] for i in range(0, len(a_extraire), pages_par_tache)]
+    extraites = _extraire_tranches_pypdf(pdf_file_path, tranches, nb_workers)
+    a_extraire = set(a_extraire)
+    tranche_courante = {}
+    for page_num in range(num_pages):
+        if page_num not in a_extraire:
+            yield page_num, num_pages, cache.lire(cles[page_num])
+            continue
+        if page_num not in tranche_courante:
+            pages, textes = next(extraites)
+            tranche_courante = dict(zip(pages, textes))
+            if cache is not None:
+                for page_extraite, texte in tranche_courante.items():
+                    cache.ecrire(cles[page_extraite], texte)
+        yield page_num, num_pages, tranche_courante[page_num]
+    if cache is not None:
+        cache.log_stats()
 
 
 # =============================================================================
 # extraction_pypdf
 # =============================================================================
-def extraction_pypdf(pdf_file_path, output_raw_txt_file, output_clean_txt_file):
+def extraction_pypdf(pdf_file_path, output_raw_txt_file, output_clean_txt_file, nb_workers=1, pages_par_tache=8,
+                     cache=None, regles=None):
+    """
+    Extrait le texte brut du PDF puis le nettoie ; retourne True si les deux fichiers ont été écrits.
+    """
     try:
         logger.info(f"Ouverture du fichier PDF '{pdf_file_path}'...")
         #
-        # Ouvre le fichier PDF en mode lecture binaire ('rb')
-        with open(pdf_file_path, 'rb') as input_pdf_file:
-            # Crée un objet lecteur pour le PDF
-            reader = pypdf.PdfReader(input_pdf_file)
-            #
-            # Initialise une chaîne de caractères vide pour stocker tout le texte
-            full_text = ""
-            num_pages = len(reader.pages)
-            logger.info(f"Le document contient {num_pages} pages. Extraction en cours...")
-            #
-            # Boucle sur chaque page du document
-            for page_num, page in enumerate(reader.pages):
-                # Extrait le texte de la page actuelle
-                texte = page.extract_text()
+        # Le texte de chaque page est écrit dans le fichier .txt au fil de l'extraction,
+        # dans l'ordre des pages, sans reconstituer tout le document en mémoire
+        logger.info(f"Extraction et sauvegarde du texte dans '{output_raw_txt_file}'...")
+        with open(output_raw_txt_file, 'w', encoding='utf-8') as output_file:
+            for page_num, num_pages, texte in pages_pypdf(pdf_file_path, nb_workers, pages_par_tache, cache):
                 if texte:
-                    # Ajoute le texte de la page au texte complet
-                    full_text += texte + "\n"  # Ajoute un saut de ligne entre les pages
+                    output_file.write(texte + "\n")  # Ajoute un saut de ligne entre les pages
 
                 # Affiche la progression
                 print(f"\r  - Extraction en cours... Page {page_num + 1}/{num_pages}", end="")
-        #
-        # Sauvegarde du texte extrait dans un fichier .txt
-        logger.info(f"\nSauvegarde du texte extrait dans '{output_raw_txt_file}'...")
-        with open(output_raw_txt_file, 'w', encoding='utf-8') as output_file:
-            output_file.write(full_text)
 
         logger.info("\n✅ Succès ! Le texte des règles a été extrait et sauvegardé.")
         logger.info(f"Le fichier '{output_raw_txt_file}' est prêt pour le nettoyage.")
     except Exception as e:
         logger.error(f"\n❌ Une erreur est survenue : {e}")
+        # texte brut partiel : pas de nettoyage
+        return False
     logger.info("\n" + "-" * 80)
     #
     # nettoyage du texte brut
-    nettoyage_raw_text(output_raw_txt_file, output_clean_txt_file)
+    return nettoyage_raw_text(output_raw_txt_file, output_clean_txt_file, MoteurNettoyage(regles))
 
 
 # =============================================================================
-# extraction_unstructured
+# _charger_unstructured
 # =============================================================================
-def extraction_unstructured(pdf_file_path, output_raw_txt_file, output_clean_txt_file):
+def _charger_unstructured(pdf_file_path):
+    """
+    Charge le PDF avec UnstructuredPDFLoader en mode "paged" et retourne {numéro de page (base 1): texte}.
+    """
+    # import local : unstructured est lourd à charger, et les processus d'extraction pypdf n'en ont pas besoin
+    from langchain_community.document_loaders import UnstructuredPDFLoader
 
-        # --- 1. Initialiser le Loader ---
+    # --- 1. Initialiser le Loader ---
     # Nous utilisons le mode par défaut (partitioning) pour une extraction de texte structurée.
     # 'strategy="auto"' permet à Unstructured de choisir la meilleure méthode (rapide ou plus détaillée)
     loader = UnstructuredPDFLoader(
@@ -256,9 +218,100 @@ def extraction_unstructured(pdf_file_path, output_raw_txt_file, output_clean_txt
     # --- 2. Charger et Extraire les Documents ---
     # La méthode .load() exécute l'extraction et retourne une liste d'objets 'Document'.
     # Chaque objet Document contient le texte extrait (page_content) et des metadata.
+    documents = loader.load()
+    textes = {}
+    for nr_doc, doc in enumerate(documents):
+        textes[doc.metadata.get('page_number', nr_doc + 1)] = doc.page_content
+    return textes
+
+
+# =============================================================================
+# _extraire_pages_unstructured
+# =============================================================================
+def _extraire_pages_unstructured(pdf_file_path, pages):
+    """
+    Extrait avec unstructured le texte des pages demandées (liste de numéros de page) : elles sont copiées
+    dans un PDF temporaire. Retourne la liste des textes ('' pour une page sans contenu).
+    """
+    writer = pypdf.PdfWriter()
+    with open(pdf_file_path, 'rb') as input_pdf_file:
+        reader = pypdf.PdfReader(input_pdf_file)
+        for page_num in pages:
+            writer.add_page(reader.pages[page_num])
+        fd, pdf_tmp = tempfile.mkstemp(suffix='.pdf')
+        with os.fdopen(fd, 'wb') as f:
+            writer.write(f)
+    try:
+        textes = _charger_unstructured(pdf_tmp)
+    finally:
+        os.remove(pdf_tmp)
+    return [textes.get(page_tmp, '') for page_tmp in range(1, len(pages) + 1)]
+
+
+# =============================================================================
+# pages_unstructured
+# =============================================================================
+def pages_unstructured(pdf_file_path, cache=None, pages_par_tache=8):
+    """
+    Générateur des textes de pages extraits par unstructured, dans l'ordre des pages (None pour une page
+    sans contenu). Les pages sont extraites par tranches de pages_par_tache pages : le texte d'une tranche
+    est rendu avant que la suivante ne soit extraite (pipeline.py vectorise pendant l'extraction).
+    Avec un cache, seules les pages absentes du cache sont extraites.
+    """
+    if cache is not None:
+        cles = cles_cache_pages(pdf_file_path, cache, 'unstructured', options_unstructured())
+        num_pages = len(cles)
+        a_extraire = [page_num for page_num, cle in enumerate(cles) if not cache.contient(cle)]
+    else:
+        with open(pdf_file_path, 'rb') as input_pdf_file:
+            num_pages = len(pypdf.PdfReader(input_pdf_file).pages)
+        cles = None
+        a_extraire = list(range(num_pages))
+    if a_extraire:
+        print(f"  - {len(a_extraire)}/{num_pages} pages à extraire avec unstructured...")
+    pages_par_tache = max(1, int(pages_par_tache))
+    tranches = iter([a_extraire[i:i + pages_par_tache] for i in range(0, len(a_extraire), pages_par_tache)])
+    a_extraire = set(a_extraire)
+    tranche_courante = {}
+    for page_num in range(num_pages):
+        if page_num not in a_extraire:
+            texte = cache.lire(cles[page_num])
+        else:
+            if page_num not in tranche_courante:
+                pages = next(tranches)
+                tranche_courante = dict(zip(pages, _extraire_pages_unstructured(pdf_file_path, pages)))
+                if cache is not None:
+                    for page_extraite, texte in tranche_courante.items():
+                        cache.ecrire(cles[page_extraite], texte)
+            texte = tranche_courante[page_num]
+        # une page sans contenu est stockée vide dans le cache, et ne produit pas de document
+        yield texte or None
+    if cache is not None:
+        cache.log_stats()
+
+
+# =============================================================================
+# options_unstructured
+# =============================================================================
+def options_unstructured():
+    try:
+        version = importlib.metadata.version('unstructured')
+    except importlib.metadata.PackageNotFoundError:
+        version = None
+    return {'mode': 'paged', 'version': version}
+
+
+# =============================================================================
+# extraction_unstructured
+# =============================================================================
+def extraction_unstructured(pdf_file_path, output_raw_txt_file, output_clean_txt_file, cache=None, regles=None,
+                            pages_par_tache=8):
+    """
+    Extrait le texte du PDF avec unstructured puis le met en forme ; retourne True si du texte a été extrait.
+    """
     try:
         print(f"Chargement du fichier '{bcolors.INPUT}{pdf_file_path}{bcolors.ENDC}' ...")
-        documents = loader.load()
+        documents = [texte for texte in pages_unstructured(pdf_file_path, cache, pages_par_tache) if texte is not None]
     except FileNotFoundError:
         print(f"Erreur : Le fichier {pdf_file_path} n'a pas été trouvé.")
         documents = []
@@ -268,9 +321,9 @@ def extraction_unstructured(pdf_file_path, output_raw_txt_file, output_clean_txt
     full_text = ""
     if documents:
         nr_doc = 0
-        for doc in documents:
+        for page_content in documents:
             # Ajoute le contenu de la page/chunk, suivi d'une double ligne pour la séparation
-            full_text += doc.page_content + "\n\n"
+            full_text += page_content + "\n\n"
             # Affiche la progression
             nr_doc = nr_doc + 1
             print(f"\r  - Extraction en cours... Doc {nr_doc}/{len(documents)}", end="")
@@ -289,11 +342,9 @@ def extraction_unstructured(pdf_file_path, output_raw_txt_file, output_clean_txt
     #
     # nettoyage du texte brut
     # nettoyage_raw_text(output_raw_txt_file, output_clean_txt_file)
-    with open(output_raw_txt_file, 'r', encoding='utf-8') as f:
-        raw_texte = f.read()
-    clean_texte = format_text_to_markdown(raw_texte)
-    with open(output_clean_txt_file, 'w', encoding='utf-8') as output_file:
-        output_file.write(clean_texte)
+    nettoyer_fichier(MoteurMarkdown(regles), output_raw_txt_file, output_clean_txt_file)
+    return bool(documents)
+
 
 # =============================================================================
 # usage
@@ -309,6 +360,8 @@ def usage():
           "    (--cfg=<filename>)\n"
           "    (--lf=<log file>)\n"
           "    (--ll=<log level:CRITICAL|ERROR|WARNING|INFO|DEBUG>)\n"
+          "    (--force : relancer l'étape même si elle est à jour dans le manifeste de build)\n"
+          "    (--no-cache : ré-extraire toutes les pages sans utiliser le cache des pages)\n"
           "    (-h : this help)\n")
 
 
@@ -318,10 +371,12 @@ def usage():
 if __name__ == '__main__':
     language = None
     cfg_filename = None
+    use_page_cache = True
+    force = False
     try:
         opts, args = getopt.getopt(sys.argv[1:], "h",
                                    ["cfg=", "ll=", "lf=", "lc=", "in=",
-                                    "id=", "if=", "od=", "of=", "rf=", "out=", "sep="])
+                                    "id=", "if=", "od=", "of=", "rf=", "out=", "sep=", "no-cache", "force"])
     except getopt.GetoptError as err:
         logger.error(err)
         usage()
@@ -337,6 +392,10 @@ if __name__ == '__main__':
                 log_level = arg
         elif opt in "--lf":
             log_file = arg
+        elif opt == "--force":
+            force = True
+        elif opt == "--no-cache":
+            use_page_cache = False
 
     # --- CONFIGURATION ---
     app_config = load_config(cfg_filename=cfg_filename)
@@ -348,6 +407,12 @@ if __name__ == '__main__':
     # Le nom du fichier texte extrait du PDF (brut et final)
     o_raw_txt_file = os.path.join(data_dir, rules_file.replace('.pdf', '_raw.txt'))
     o_clean_txt_file = os.path.join(data_dir, rules_file.replace('.pdf', '.txt'))
+    # Le cache des pages déjà extraites
+    page_cache = None
+    if use_page_cache and app_config.get('page_cache', True):
+        page_cache = CachePages(os.path.join(data_dir, 'page_cache'))
+    # Les packs de règles de nettoyage du livre (bruit de mise en page, titres)
+    regles = charger_packs(app_config.get('rule_packs_' + language))
     # --- check visuel
     logger.info(f"data_dir={bcolors.INPUT}{data_dir}{bcolors.ENDC}")
     logger.info(f"language={bcolors.INPUT}{language}{bcolors.ENDC}")
@@ -355,6 +420,11 @@ if __name__ == '__main__':
     logger.info(f"pdf_file_path={bcolors.INPUT}{i_pdf_file}{bcolors.ENDC}")
     logger.info(f"output_raw_txt_path={bcolors.OUTPUT}{o_raw_txt_file}{bcolors.ENDC}")
     logger.info(f"output_txt_path={bcolors.OUTPUT}{o_clean_txt_file}{bcolors.ENDC}")
+    logger.info(f"rule_packs={bcolors.INPUT}{', '.join(regles.noms)}{bcolors.ENDC}")
+
+    # --- GESTION INCRÉMENTALE : rien à faire si les entrées et les paramètres n'ont pas changé
+    if not force and etape_a_jour(app_config, 'extraction'):
+        sys.exit(0)
 
     # --- SCRIPT D'EXTRACTION ---
 
@@ -362,9 +432,22 @@ if __name__ == '__main__':
     if not os.path.exists(i_pdf_file):
         logger.info(f"Erreur : Le fichier '{i_pdf_file}' n'a pas été trouvé.")
         logger.info("Veuillez vous assurer que le fichier PDF des règles se trouve dans le même dossier que ce script.")
+        sys.exit(1)
     else:
         print(f"Lancement du nettoyage final du fichier {bcolors.INPUT}'{i_pdf_file}'{bcolors.ENDC}...")
+        succes = False
         if app_config['pdf_reader'] == 'pypdf':
-            extraction_pypdf(i_pdf_file, o_raw_txt_file, o_clean_txt_file)
+            succes = extraction_pypdf(i_pdf_file, o_raw_txt_file, o_clean_txt_file,
+                             nb_workers=app_config.get('pdf_workers', 1),
+                             pages_par_tache=app_config.get('pdf_pages_per_task', 8),
+                             cache=page_cache, regles=regles)
         elif app_config['pdf_reader'] == 'unstructured':
-            extraction_unstructured(i_pdf_file, o_raw_txt_file, o_clean_txt_file)
\ No newline at end of file
+            succes = extraction_unstructured(i_pdf_file, o_raw_txt_file, o_clean_txt_file, cache=page_cache,
+                                             regles=regles,
+                                             pages_par_tache=app_config.get('pdf_pages_per_task', 8))
+        else:
+            logger.error(f"pdf_reader inconnu : '{app_config['pdf_reader']}'")
+        # une extraction en échec ou partielle n'est pas enregistrée dans le manifeste
+        if not succes or not enregistrer_etape(app_config, 'extraction'):
+            logger.error("❌ L'extraction a échoué.")
+            sys.exit(1)
\ No newline at end of file
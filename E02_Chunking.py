@@ -7,11 +7,40 @@ import sys
 import getopt
 
 from config import load_config, bcolors, logger
+from build import etape_a_jour, enregistrer_etape
+from chunk_store import ecrire_chunk_store
+from bm25_index import construire_bm25
 
-import pickle  # On importe le module pickle
 
-# Importation du "Text Splitter" de LangChain
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+# =============================================================================
+# creer_text_splitter
+# =============================================================================
+def creer_text_splitter(app_config):
+    # Découpeur compatible avec le "Text Splitter" RecursiveCharacterTextSplitter de LangChain :
+    # mêmes morceaux, calculés sur des positions dans le texte (voir text_splitter.py)
+    # old : from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from text_splitter import DecoupeurTexte, DecoupeurSections
+
+    decoupeur = DecoupeurTexte(
+        # La taille de chaque morceau (chunk). 1000 est une bonne valeur de départ.
+        chunk_size=int(app_config.get('chunk_size', 1000)),
+
+        # Un chevauchement entre les morceaux pour ne pas perdre de contexte.
+        # Si un morceau se termine au milieu d'une phrase importante,
+        # le début de cette phrase sera dans le morceau précédent.
+        chunk_overlap=int(app_config.get('chunk_overlap', 150)),
+
+        # On conserve la notion de paragraphes, très utile pour le contexte.
+        separators=["\n\n", "\n", " ", ""],
+
+        # Plusieurs textes indépendants peuvent être découpés en parallèle
+        nb_workers=int(app_config.get('chunk_workers', 1))
+    )
+    # Découpage section par section selon les titres Markdown (## / ###) produits par E01 :
+    # chaque morceau porte le chemin de sa section dans ses métadonnées ('section')
+    if app_config.get('chunk_by_section', True):
+        return DecoupeurSections(decoupeur)
+    return decoupeur
 
 
 # =============================================================================
@@ -28,6 +57,7 @@ def usage():
           "    (--cfg=<filename>)\n"
           "    (--lf=<log file>)\n"
           "    (--ll=<log level:CRITICAL|ERROR|WARNING|INFO|DEBUG>)\n"
+          "    (--force : relancer l'étape même si elle est à jour dans le manifeste de build)\n"
           "    (-h : this help)\n")
 
 
@@ -37,9 +67,10 @@ def usage():
 if __name__ == '__main__':
     language = None
     cfg_filename = None
+    force = False
     try:
         opts, args = getopt.getopt(sys.argv[1:], "h",
-                                   ["cfg=", "ll=", "lf=", "l="])
+                                   ["cfg=", "ll=", "lf=", "l=", "force"])
     except getopt.GetoptError as err:
         logger.error(err)
         usage()
@@ -55,6 +86,8 @@ if __name__ == '__main__':
                 log_level = arg
         elif opt in "--lf":
             log_file = arg
+        elif opt == "--force":
+            force = True
 
     # --- CONFIGURATION ---
     app_config = load_config(cfg_filename=cfg_filename)
@@ -63,13 +96,17 @@ if __name__ == '__main__':
     rules_file = app_config['rules_' + language + '_file']
     # Le nom du fichier texte à morceler
     input_txt_path = os.path.join(data_dir, rules_file.replace('.pdf', '.txt'))
-    # Le fichier contenant nos morceaux de texte préparés
-    output_pickle_path = os.path.join(data_dir, rules_file.replace('.pdf', '_chunks.pkl'))
+    # Le chunk store contenant nos morceaux de texte préparés
+    output_chunks_path = os.path.join(data_dir, rules_file.replace('.pdf', '_chunks'))
     # --- check visuel
     logger.info(f"data_dir={bcolors.INPUT}{data_dir}{bcolors.ENDC}")
     logger.info(f"language={bcolors.INPUT}{language}{bcolors.ENDC}")
     logger.info(f"input_txt_path={bcolors.INPUT}{input_txt_path}{bcolors.ENDC}")
-    logger.info(f"output_pickle_path={bcolors.OUTPUT}{output_pickle_path}{bcolors.ENDC}")
+    logger.info(f"output_chunks_path={bcolors.OUTPUT}{output_chunks_path}{bcolors.ENDC}")
+
+    # --- GESTION INCRÉMENTALE : rien à faire si les entrées et les paramètres n'ont pas changé
+    if not force and etape_a_jour(app_config, 'decoupage'):
+        sys.exit(0)
 
     # --- SCRIPT DE DÉCOUPAGE ---
 
@@ -77,6 +114,7 @@ if __name__ == '__main__':
     if not os.path.exists(input_txt_path):
         logger.error(f"Erreur : Le fichier '{input_txt_path}' n'a pas été trouvé.")
         logger.error("Veuillez d'abord exécuter le script de l'étape 1 pour extraire le texte du PDF.")
+        sys.exit(1)
     else:
         try:
             logger.info(f"Lecture du fichier '{input_txt_path}'...")
@@ -87,18 +125,7 @@ if __name__ == '__main__':
 
             # 2. Création de l'instance du Text Splitter
             # C'est ici que la magie opère.
-            text_splitter = RecursiveCharacterTextSplitter(
-                # La taille de chaque morceau (chunk). 1000 est une bonne valeur de départ.
-                chunk_size=1000,
-
-                # Un chevauchement entre les morceaux pour ne pas perdre de contexte.
-                # Si un morceau se termine au milieu d'une phrase importante,
-                # le début de cette phrase sera dans le morceau précédent.
-                chunk_overlap=150,
-
-                # On conserve la notion de paragraphes, très utile pour le contexte.
-                separators=["\n\n", "\n", " ", ""]
-            )
+            text_splitter = creer_text_splitter(app_config)
 
             # 3. Découpage du document
             # La méthode create_documents prend une liste de textes.
@@ -123,14 +150,20 @@ if __name__ == '__main__':
                 logger.info(docs[1].page_content[:200] + "...")  # Affiche les 200 premiers caractères
                 logger.info("\n-------------------------------------------------")
 
-            # --- PARTIE 2 : SAUVEGARDE AVEC PICKLE ---
-            logger.info(f"\nSauvegarde des morceaux dans le fichier '{output_pickle_path}'...")
-
-            # On ouvre le fichier en mode "write binary" (wb)
-            with open(output_pickle_path, "wb") as f:
-                pickle.dump(docs, f)  # On "dumpe" (verse) notre variable docs dans le fichier
+            # --- PARTIE 2 : SAUVEGARDE DANS LE CHUNK STORE ---
+            # Les textes sont concaténés dans un seul fichier projeté en mémoire par les lecteurs :
+            # pas de pickle, et E04 ne lit que les morceaux retournés par la recherche.
+            logger.info(f"\nSauvegarde des morceaux dans le chunk store '{output_chunks_path}'...")
+            ecrire_chunk_store(output_chunks_path, docs)
+            # index inversé BM25 des morceaux (recherche hybride de E04), copié avec le chunk store par E03
+            if app_config.get('bm25_index', True):
+                construire_bm25(output_chunks_path, k1=float(app_config.get('bm25_k1', 1.2)),
+                                b=float(app_config.get('bm25_b', 0.75)))
 
             logger.info("✅ Sauvegarde terminée avec succès !")
+            if not enregistrer_etape(app_config, 'decoupage'):
+                sys.exit(1)
 
         except Exception as e:
             logger.error(f"\n❌ Une erreur est survenue : {e}")
+            sys.exit(1)
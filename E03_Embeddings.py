@@ -8,12 +8,11 @@ import os
 import sys
 import getopt
 
-import pickle
-# old : from langchain.embeddings import SentenceTransformerEmbeddings
-from langchain_huggingface import HuggingFaceEmbeddings
-# old : from langchain.vectorstores import FAISS
-from langchain_community.vectorstores import FAISS
 from config import load_config, bcolors, logger
+from build import etape_a_jour, enregistrer_etape
+from chunk_store import ChunkStore, ecrire_chunk_store
+from bm25_index import construire_bm25
+from near_duplicates import creer_dedoublonneur
 
 
 # =============================================================================
@@ -30,6 +29,8 @@ def usage():
           "    (--cfg=<filename>)\n"
           "    (--lf=<log file>)\n"
           "    (--ll=<log level:CRITICAL|ERROR|WARNING|INFO|DEBUG>)\n"
+          "    (--force : relancer l'étape même si elle est à jour dans le manifeste de build)\n"
+          "    (--no-cache : encoder tous les morceaux sans utiliser le cache des embeddings)\n"
           "    (-h : this help)\n")
 
 
@@ -39,10 +40,12 @@ def usage():
 if __name__ == '__main__':
     language = None
     cfg_filename = None
+    force = False
+    use_embedding_cache = True
     try:
         opts, args = getopt.getopt(sys.argv[1:], "h",
                                    ["cfg=", "ll=", "lf=", "lc=", "in=",
-                                    "id=", "if=", "od=", "of=", "rf=", "out=", "sep="])
+                                    "id=", "if=", "od=", "of=", "rf=", "out=", "sep=", "force", "no-cache"])
     except getopt.GetoptError as err:
         logger.error(err)
         usage()
@@ -58,6 +61,10 @@ if __name__ == '__main__':
                 log_level = arg
         elif opt in "--lf":
             log_file = arg
+        elif opt == "--force":
+            force = True
+        elif opt == "--no-cache":
+            use_embedding_cache = False
 
     # --- CONFIGURATION ---
     app_config = load_config(cfg_filename=cfg_filename)
@@ -65,29 +72,56 @@ if __name__ == '__main__':
     language = app_config['language']
     rules_file = app_config['rules_' + language + '_file']
     embeddings_model_name = app_config['embeddings_' + language + '_model_name']
-    # Le fichier contenant nos morceaux de texte préparés
-    input_pickle_path = os.path.join(data_dir, rules_file.replace('.pdf', '_chunks.pkl'))
+    # Le chunk store contenant nos morceaux de texte préparés
+    input_chunks_path = os.path.join(data_dir, rules_file.replace('.pdf', '_chunks'))
+    # Le chunk store sans les quasi-doublons (si dedup_chunks)
+    dedup_chunks_path = os.path.join(data_dir, rules_file.replace('.pdf', '_chunks_dedup'))
     # Le dossier où sera sauvegardée notre base de données vectorielle
     vector_store_path = os.path.join(data_dir, "faiss_index_" + language)
     # --- check visuel
     logger.info(f"data_dir={bcolors.INPUT}{data_dir}{bcolors.ENDC}")
     logger.info(f"language={bcolors.INPUT}{language}{bcolors.ENDC}")
-    logger.info(f"input_pickle_path={bcolors.INPUT}{input_pickle_path}{bcolors.ENDC}")
+    logger.info(f"input_chunks_path={bcolors.INPUT}{input_chunks_path}{bcolors.ENDC}")
     logger.info(f"embeddings_model_name={bcolors.INPUT}{embeddings_model_name}{bcolors.ENDC}")
     logger.info(f"vector_store_path={bcolors.OUTPUT}{vector_store_path}{bcolors.ENDC}")
 
+    # --- GESTION INCRÉMENTALE : rien à faire si les entrées et les paramètres n'ont pas changé
+    if not force and etape_a_jour(app_config, 'vectorisation'):
+        sys.exit(0)
+
     # --- SCRIPT DE VECTORISATION ET DE STOCKAGE ---
 
     # 1. Charger les morceaux de texte (docs)
-    if not os.path.exists(input_pickle_path):
-        logger.info(f"Erreur : Le fichier '{input_pickle_path}' n'a pas été trouvé.")
+    if not os.path.exists(input_chunks_path):
+        logger.info(f"Erreur : Le fichier '{input_chunks_path}' n'a pas été trouvé.")
         logger.info("Veuillez d'abord exécuter le script de l'étape 2 pour créer et sauvegarder les documents.")
+        sys.exit(1)
     else:
         try:
-            logger.info(f"Chargement des documents depuis '{input_pickle_path}'...")
-            with open(input_pickle_path, "rb") as f:
-                docs = pickle.load(f)
-            logger.info(f"✅ {len(docs)} documents chargés avec succès.")
+            # imports tardifs : torch et sentence-transformers ne sont chargés que si l'index doit être reconstruit
+            # old : from langchain.embeddings import SentenceTransformerEmbeddings
+            # old : from langchain_huggingface import HuggingFaceEmbeddings
+            from embedding_engine import creer_moteur_embeddings, verifier_backend
+            from vector_store import creer_index, sauvegarder_index
+            from embedding_cache import CacheEmbeddings, EmbeddingsEnCache
+
+            logger.info(f"Ouverture du chunk store '{input_chunks_path}'...")
+            store = ChunkStore(input_chunks_path)
+            logger.info(f"✅ {len(store)} morceaux disponibles.")
+
+            # 1 bis. Quasi-doublons : un seul morceau vectorisé par groupe de morceaux quasi identiques,
+            # les autres emplacements sont gardés comme alias ; l'index BM25 est reconstruit sur les morceaux gardés
+            chunks_path = input_chunks_path
+            dedoublonneur = creer_dedoublonneur(app_config)
+            if dedoublonneur is not None:
+                ecrire_chunk_store(dedup_chunks_path, dedoublonneur.filtrer(store.documents()))
+                store.close()
+                dedoublonneur.log_stats()
+                if app_config.get('bm25_index', True):
+                    construire_bm25(dedup_chunks_path, k1=float(app_config.get('bm25_k1', 1.2)),
+                                    b=float(app_config.get('bm25_b', 0.75)))
+                chunks_path = dedup_chunks_path
+                store = ChunkStore(chunks_path)
 
             # 2. Créer le modèle d'embedding
             # Nous utilisons un modèle open-source et performant de Sentence-Transformers.
@@ -95,22 +129,56 @@ if __name__ == '__main__':
             logger.info(f"\nInitialisation du modèle d'embedding : {bcolors.INPUT}{embeddings_model_name}{bcolors.ENDC} "
                         f"(cela peut prendre un moment au premier lancement)...")
             # old : embeddings = SentenceTransformerEmbeddings(model_name=embeddings_model_name)
-            embeddings = HuggingFaceEmbeddings(model_name=embeddings_model_name)
-            logger.info("✅ Modèle d'embedding chargé.")
+            # old : embeddings = HuggingFaceEmbeddings(model_name=embeddings_model_name)
+            # Moteur d'embeddings : lots triés par longueur, pool de processus optionnel (embedding_workers)
+            moteur = creer_moteur_embeddings(app_config, embeddings_model_name)
+            embedding_cache = None
+            if use_embedding_cache and app_config.get('embedding_cache', True):
+                # seuls les morceaux nouveaux ou modifiés sont encodés : le modèle n'est chargé qu'au besoin
+                embedding_cache = CacheEmbeddings(os.path.join(data_dir, 'embedding_cache'), moteur.identifiant)
+                embeddings = EmbeddingsEnCache(moteur, embedding_cache)
+                logger.info(f"✅ Cache des embeddings ouvert ({len(embedding_cache)} vecteurs).")
+            else:
+                embeddings = moteur
 
             # 3. Créer la base de données vectorielle (Vector Store)
             # Cette étape prend chaque document, calcule son embedding et le stocke dans FAISS.
             # C'est l'étape la plus longue du processus de préparation.
             logger.info("\nCréation de la base de données vectorielle FAISS. Veuillez patienter...")
-            db = FAISS.from_documents(docs, embeddings)
+            textes = list(store.textes())
+            vecteurs = embeddings.embed_array(textes)
+            moteur.fermer()
+            # Type d'index de la configuration (flat, hnsw, ivf, ivfpq), entraîné si besoin sur les vecteurs
+            index = creer_index(app_config, vecteurs.shape[1], vecteurs)
+            index.add(vecteurs)
             logger.info("✅ Base de données vectorielle créée en mémoire.")
+            moteur.log_stats()
+            if embedding_cache is not None:
+                embedding_cache.log_stats()
+
+            # 3 bis. Backend ONNX / int8 : la recherche doit rester proche de celle du modèle fp32
+            if moteur.backend != 'torch':
+                logger.info(f"\nComparaison du backend '{moteur.backend}' avec le modèle fp32...")
+                recouvrement, seuil, conforme = verifier_backend(
+                    app_config, moteur, textes, vecteurs,
+                    cache_dir=os.path.join(data_dir, 'embedding_cache') if embedding_cache is not None else None)
+                if not conforme:
+                    raise ValueError(f"backend '{moteur.backend}' : recouvrement des résultats {recouvrement:.1%} "
+                                     f"inférieur au seuil {seuil:.1%} (embedding_backend_min_overlap) ; "
+                                     f"utilisez embedding_backend: torch ou onnx")
+                logger.info(f"✅ Recouvrement des résultats avec le modèle fp32 : {recouvrement:.1%} (seuil {seuil:.1%})")
 
             # 4. Sauvegarder la base de données sur le disque
             # Cela nous permettra de la recharger directement dans notre application finale
-            # sans avoir à tout recalculer.
-            db.save_local(vector_store_path)
+            # sans avoir à tout recalculer. L'index est écrit avec faiss.write_index et les textes
+            # restent dans le chunk store (copié à côté de l'index) : aucun pickle.
+            sauvegarder_index(index, vector_store_path, chunks_path)
+            store.close()
             logger.info(f"\n✅ La base de données a été sauvegardée dans le dossier : '{vector_store_path}'")
             logger.info("\nVotre système est maintenant prêt pour l'étape finale : l'interrogation !")
+            if not enregistrer_etape(app_config, 'vectorisation'):
+                sys.exit(1)
 
         except Exception as e:
             logger.error(f"\n❌ Une erreur est survenue : {e}")
+            sys.exit(1)
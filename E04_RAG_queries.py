@@ -3,58 +3,184 @@
 # Installation des bibliothèques requises :
 # pip install langchain langchain-community faiss-cpu sentence-transformers
 
+import time
+# début du démarrage : le temps jusqu'à la première question est affiché quand le système est prêt
+DEBUT_DEMARRAGE = time.perf_counter()
+
 import os
+import re
 import sys
 import getopt
+from concurrent.futures import ThreadPoolExecutor
 from config import load_config, bcolors, logger
+from vector_store import (CHUNKS_DIR, charger_base, empreinte_index, regler_recherche, sections_index,
+                          RetrieverSections)
+from bm25_index import charger_bm25
+from text_splitter import SEPARATEUR_SECTION
 
 # La bibliothèque python-dotenv n'est plus nécessaire !
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import SentenceTransformerEmbeddings
+# old : from langchain_community.vectorstores import FAISS
+# old : from langchain_community.embeddings import SentenceTransformerEmbeddings
 # old : from langchain_community.chat_models import ChatOllama
-from langchain_ollama import ChatOllama
-from langchain.chains import RetrievalQA
+# Imports lourds différés (démarrage rapide) : langchain_ollama et langchain.chains sont importés
+# pendant le chargement de la base, torch par le moteur d'embeddings, deep_translator à la première traduction
+# old : from langchain_ollama import ChatOllama
+# old : from langchain.chains import RetrievalQA
 
-import pickle
 # old : from langchain.embeddings import SentenceTransformerEmbeddings
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain.vectorstores import FAISS
-from deep_translator import GoogleTranslator
+# old : from langchain_huggingface import HuggingFaceEmbeddings
+from embedding_engine import creer_moteur_embeddings
+# old : from langchain.vectorstores import FAISS
+# old : from deep_translator import GoogleTranslator
+# traduction : voir translation.py (backend google, offline ou stub, cache des segments traduits)
+
+from translation import BACKENDS as TRANSLATION_BACKENDS, creer_traducteur
+from answer_cache import CacheReponses, creer_cache_reponses
+from context_budget import budget_modele, creer_assembleur
+from query_pipeline import Latences, est_multilingue, messages_chaine, preparer_question
+from ollama_client import CachePresenceModeles, PRESENCE_FILE, assurer_modele, creer_chat_ollama
+
+# texte affiché à la place d'une traduction en échec (jamais enregistré dans le cache des réponses)
+TRADUCTION_IMPOSSIBLE = "[Traduction impossible.]"
 
-import subprocess
 
 # =============================================================================
 # lancer_LLM
 # =============================================================================
-def lancer_LLM(llm_name):
+def lancer_LLM(llm_name, app_config, refresh=False, absent=False):
+    """
+    S'assure que le modèle est installé dans Ollama : "ollama pull" seulement s'il est absent
+    ou si refresh est demandé (la présence est mémorisée pendant ollama_presence_ttl secondes).
+    absent : le modèle a été signalé absent par Ollama, sa présence mémorisée est effacée
+    et il est re-téléchargé.
+    """
+    # old : subprocess.run(["ollama", "pull", llm_name], capture_output=True, text=True, check=True)
+    cache = CachePresenceModeles(os.path.join(app_config['data_dir'], PRESENCE_FILE),
+                                 ttl=float(app_config.get('ollama_presence_ttl', 86400)))
+    if absent:
+        cache.oublier(llm_name)
+    return assurer_modele(llm_name, cache, refresh=refresh or absent,
+                          executable=app_config.get('ollama_executable', 'ollama'))
 
-    # La commande et ses arguments doivent être passés sous forme de liste
-    commande = ["ollama", "pull", llm_name]
 
-    try:
-        # Exécute la commande et capture la sortie
-        resultat = subprocess.run(
-            commande,
-            capture_output=True,  # Capture stdout et stderr
-            text=True,  # Décode la sortie en texte (str) au lieu de bytes
-            check=True  # Lève une exception si le code de retour n'est pas 0 (erreur)
-        )
+# =============================================================================
+# preparer_LLM
+# =============================================================================
+def preparer_LLM(llm, app_config, refresh=False):
+    """
+    Vérifie la présence du modèle puis le charge dans Ollama (ollama_warmup) avant la première question,
+    avec la fenêtre de contexte d'un prompt du budget de contexte du modèle (llm_context_budget).
+    """
+    if lancer_LLM(llm.model, app_config, refresh) and app_config.get('ollama_warmup', True):
+        try:
+            duree = llm.rechauffer(budget_modele(app_config, llm.model))
+            logger.info(f"-> Modèle '{llm.model}' chargé dans Ollama en {duree:.1f} s")
+        except Exception as e:
+            logger.warning(f"préchargement du modèle '{llm.model}' impossible : {e}")
+
+
+# =============================================================================
+# importer_chaine
+# =============================================================================
+def importer_chaine():
+    """
+    Import (long) des classes LangChain de la chaîne RAG, fait en parallèle des autres chargements.
+    """
+    # old : from langchain_community.chat_models import ChatOllama
+    # old : from langchain_ollama import ChatOllama
+    from langchain.chains import RetrievalQA
+    return RetrievalQA
+
+
+# =============================================================================
+# PhrasesEnFlux
+# =============================================================================
+class PhrasesEnFlux:
+    """
+    Découpe en phrases un texte reçu par morceaux (tokens du LLM) : une phrase est complète
+    dès que sa ponctuation finale est suivie d'un blanc.
+    """
+    FIN_PHRASE = re.compile(r'(?<=[.!?:])\s+')
+
+    def __init__(self):
+        self.reste = ''
+
+    def ajouter(self, texte):
+        """
+        Ajoute un morceau de texte ; retourne les phrases complétées.
+        """
+        morceaux = self.FIN_PHRASE.split(self.reste + texte)
+        self.reste = morceaux.pop()
+        return [phrase for phrase in morceaux if phrase.strip()]
+
+    def fin(self):
+        reste, self.reste = self.reste, ''
+        return [reste] if reste.strip() else []
+
+
+# =============================================================================
+# afficher_sources
+# =============================================================================
+def afficher_sources(documents):
+    print("--- Sources utilisées (en anglais) ---")
+    for i, source in enumerate(documents):
+        section = source.metadata.get('section')
+        # quasi-doublons retirés de l'index : autres emplacements du même texte
+        alias = sorted({a['section'] for a in source.metadata.get('alias', ()) if a.get('section')} - {section})
+        if alias:
+            section = f"{section or ''}, aussi dans : {' ; '.join(alias)}"
+        if section:
+            print(f"Source {i + 1} [{section}]:\n\"{source.page_content[:300]}...\"\n")
+        else:
+            print(f"Source {i + 1}:\n\"{source.page_content[:300]}...\"\n")
+    print("------------------------------------\n")
+
+
+# =============================================================================
+# afficher_reponse
+# =============================================================================
+def afficher_reponse(answer_en, answer_fr):
+    print("\n--- Réponse en Anglais / English Answer ---")
+    print(answer_en)
+    print("------------------------------------------\n")
 
-        # Affiche le résultat
-        print("--- Sortie Standard (stdout) ---")
-        print(resultat.stdout)
+    if answer_fr is not None:
+        print("--- Réponse en Français / French Answer ---")
+        print(answer_fr)
+        print("-----------------------------------------\n")
 
-        print("--- Code de retour ---")
-        print(resultat.returncode)
 
-    except subprocess.CalledProcessError as e:
-        # Gère le cas où la commande échoue (code de retour non nul)
-        print(f"La commande a échoué avec le code de retour {e.returncode}")
-        print(f"Erreur (stderr) :\n{e.stderr}")
+# =============================================================================
+# repondre_en_flux
+# =============================================================================
+def repondre_en_flux(qa_chain, llm, documents, question_en, traduire, latences, assembleur=None):
+    """
+    Affiche la réponse anglaise token par token ; chaque phrase terminée est traduite en français en
+    arrière-plan (traduire) pendant la suite de la génération. Les durées sont ajoutées à latences.
+    Retourne (réponse anglaise, réponse française ou None sans traduire).
+    """
+    phrases = PhrasesEnFlux()
+    traductions = []
+    reponse = []
+    print("--- Réponse en Anglais / English Answer ---")
+    # un seul thread : les phrases sont traduites dans l'ordre, sans multiplier les appels au traducteur
+    with ThreadPoolExecutor(max_workers=1) as traducteur:
+        with latences.mesurer('génération'):
+            for morceau in llm.stream(messages_chaine(qa_chain, documents, question_en, assembleur)):
+                latences.marquer_premier_token()
+                print(morceau.content, end='', flush=True)
+                reponse.append(morceau.content)
+                if traduire is not None:
+                    traductions += [traducteur.submit(traduire, phrase)
+                                    for phrase in phrases.ajouter(morceau.content)]
+        if traduire is not None:
+            traductions += [traducteur.submit(traduire, phrase) for phrase in phrases.fin()]
+        print("\n------------------------------------------\n")
+        # traductions restantes après la fin de la génération
+        with latences.mesurer('traduction réponse'):
+            answer_fr = ' '.join(traduction.result() for traduction in traductions) if traduire is not None else None
+    return ''.join(reponse), answer_fr
 
-    except FileNotFoundError:
-        # Gère le cas où l'exécutable (ici 'ls') n'est pas trouvé
-        print(f"L'exécutable '{commande[0]}' n'a pas été trouvé.")
 
 # =============================================================================
 # usage
@@ -70,7 +196,20 @@ def usage():
           "    (--cfg=<filename>)\n"
           "    (--lf=<log file>)\n"
           "    (--ll=<log level:CRITICAL|ERROR|WARNING|INFO|DEBUG>)\n"
-          "    (-h : this help)\n")
+          "    (--section=<motif(s) de section séparés par des virgules : recherche restreinte à ces sections>)\n"
+          "    (--ef-search=<largeur de recherche d'un index hnsw, remplace faiss_hnsw_ef_search>)\n"
+          "    (--nprobe=<nombre de listes visitées d'un index ivf, remplace faiss_ivf_nprobe>)\n"
+          "    (--refresh-model : re-télécharger le modèle LLM (ollama pull) même s'il est installé)\n"
+          f"    (--translation=<{'|'.join(TRANSLATION_BACKENDS)}> : traduction des questions et réponses, "
+          "remplace translation_backend)\n"
+          "    (--serve : service HTTP local au lieu de la session interactive, voir rag_service.py)\n"
+          "    (--port=<port du service, remplace service_port>)\n"
+          "    (--batch=<fichier JSONL de questions> : mode lot, voir batch_queries.py)\n"
+          "    (--out=<fichier JSONL des réponses du mode lot, remplace output_file>)\n"
+          "    (-h : this help)\n"
+          "  pendant la session : '/sections' liste les chapitres, '/section <motifs>' restreint la recherche,\n"
+          "  '/section' seul la rétablit sur tout le document, '/faiss ef_search=<n> nprobe=<n>' règle la recherche,\n"
+          "  '/cache' affiche l'état du cache des réponses, '/cache vider' le vide\n")
 
 
 # =============================================================================
@@ -79,8 +218,57 @@ def usage():
 if __name__ == '__main__':
     language = None
     cfg_filename = None
+    sections = None
+    reglages_faiss = {}
+    refresh_model = False
+    translation_backend = None
+    serve = False
+    port = None
+    batch_file = None
+    out_file = None
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "h", ["cfg=", "ll=", "lf=", "section=", "ef-search=", "nprobe=",
+                                                      "refresh-model", "translation=", "serve", "port=",
+                                                      "batch=", "out="])
+    except getopt.GetoptError as err:
+        logger.error(err)
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            sys.exit()
+        elif opt == "--cfg":
+            cfg_filename = arg
+        elif opt == "--ll":
+            if arg in ["CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"]:
+                log_level = arg
+        elif opt == "--lf":
+            log_file = arg
+        elif opt == "--section":
+            sections = [m.strip() for m in arg.split(',') if m.strip()]
+        elif opt == "--ef-search":
+            reglages_faiss['ef_search'] = int(arg)
+        elif opt == "--nprobe":
+            reglages_faiss['nprobe'] = int(arg)
+        elif opt == "--refresh-model":
+            refresh_model = True
+        elif opt == "--translation":
+            if arg in TRANSLATION_BACKENDS:
+                translation_backend = arg
+        elif opt == "--serve":
+            serve = True
+        elif opt == "--port":
+            port = int(arg)
+        elif opt == "--batch":
+            batch_file = arg
+        elif opt == "--out":
+            out_file = arg
+
     # --- CONFIGURATION ---
-    app_config = load_config()
+    app_config = load_config(cfg_filename=cfg_filename)
+    if translation_backend is not None:
+        app_config['translation_backend'] = translation_backend
     data_dir = app_config['data_dir']
     language = app_config['language']
     rules_file = app_config['rules_' + language + '_file']
@@ -98,26 +286,59 @@ if __name__ == '__main__':
     logger.info(f"vector_store_path={bcolors.INPUT}{vector_store_path}{bcolors.ENDC}")
 
     logger.info("--- Initialisation du système expert Bolt Action avec OLLAMA...")
-    logger.info(f"-> Chargement du modèle '{llm_model_name}'...")
-    lancer_LLM(llm_model_name)
-
-    logger.info(f"-> Chargement du modèle d'embedding depuis '{embeddings_model_name}'...")
+    # Démarrage rapide (fast_start) : vérification du LLM, chargement du modèle d'embedding, de la base
+    # et imports de la chaîne en parallèle ; index FAISS projeté en mémoire en lecture seule.
+    # Sinon, les mêmes étapes sont exécutées l'une après l'autre.
+    fast_start = bool(app_config.get('fast_start', True))
     # old : embeddings = SentenceTransformerEmbeddings(model_name=embeddings_model_name)
-    embeddings = HuggingFaceEmbeddings(model_name=embeddings_model_name)
-
-    logger.info(f"-> Chargement de la base de données depuis '{vector_store_path}'...")
-    db = FAISS.load_local(vector_store_path, embeddings, allow_dangerous_deserialization=True)
-
+    # old : embeddings = HuggingFaceEmbeddings(model_name=embeddings_model_name)
+    # backend de la configuration (torch, onnx, onnx-int8) : celui qui a servi à construire l'index
+    embeddings = creer_moteur_embeddings(app_config, embeddings_model_name)
     # On initialise le LLM local avec Ollama
-    logger.info("-> Initialisation du LLM local (via Ollama)...")
     # Assurez-vous d'avoir fait "wh" dans votre terminal avant.
     # Vous pouvez remplacer "llama3" par "mistral" si vous préférez.
-    llm = ChatOllama(model=llm_model_name, temperature=llm_temperature)
+    # old : llm = ChatOllama(model=llm_model_name, temperature=llm_temperature)
+    # connexions HTTP persistantes, keep_alive du modèle, num_ctx d'après la longueur du prompt
+    # un modèle supprimé d'Ollama malgré le cache de présence est re-téléchargé à la première requête
+    llm = creer_chat_ollama(app_config, llm_model_name, llm_temperature,
+                            installer=lambda nom: lancer_LLM(nom, app_config, absent=True))
+    with ThreadPoolExecutor(max_workers=4 if fast_start else 1) as pool:
+        logger.info(f"-> Chargement du modèle '{llm_model_name}'...")
+        llm_pret = pool.submit(preparer_LLM, llm, app_config, refresh_model)
+        logger.info(f"-> Chargement du modèle d'embedding depuis '{embeddings_model_name}'...")
+        embeddings_pret = pool.submit(lambda: embeddings.modele)
+        logger.info(f"-> Chargement de la base de données depuis '{vector_store_path}'...")
+        # old : db = FAISS.load_local(vector_store_path, embeddings, allow_dangerous_deserialization=True)
+        # index FAISS + chunk store projeté en mémoire : seuls les morceaux trouvés sont lus
+        db_prete = pool.submit(charger_base, vector_store_path, embeddings, app_config, fast_start)
+        chaine_prete = pool.submit(importer_chaine)
+        RetrievalQA = chaine_prete.result()
+        db = db_prete.result()
+        embeddings_pret.result()
+        llm_pret.result()
+    regler_recherche(db.index, app_config, **reglages_faiss)
 
     # --- CRÉATION DE LA CHAÎNE RAG ---
 
-    retriever = db.as_retriever(search_kwargs={'k': 4})
-
+    # old : retriever = db.as_retriever(search_kwargs={'k': 4})
+    # retriever restreint si besoin à certaines sections (métadonnée 'section' des morceaux)
+    retriever = RetrieverSections(db=db, k=4)
+    # recherche hybride (retrieval_mode: hybrid) : classements vectoriel et BM25 fusionnés
+    if app_config.get('retrieval_mode', 'hybrid') == 'hybrid':
+        bm25 = charger_bm25(os.path.join(vector_store_path, CHUNKS_DIR))
+        if bm25 is None:
+            logger.warning("index BM25 absent (relancez E02 avec bm25_index: true) : recherche vectorielle seule")
+        else:
+            retriever = RetrieverSections(db=db, k=4, bm25=bm25,
+                                          k_candidats=int(app_config.get('hybrid_candidates', 20)),
+                                          rrf_k=int(app_config.get('hybrid_rrf_k', 60)))
+            logger.info(f"-> Recherche hybride vecteurs + BM25 ({len(bm25)} morceaux indexés)")
+    if sections:
+        nb_morceaux = retriever.restreindre(sections)
+        logger.info(f"-> Recherche restreinte aux sections {sections} : {nb_morceaux} morceaux")
+
+    # réponses en flux (llm_streaming) : sources affichées dès la recherche, tokens affichés à leur génération
+    streaming = bool(app_config.get('llm_streaming', True))
     qa_chain = RetrievalQA.from_chain_type(
         llm=llm,
         chain_type="stuff",
@@ -125,10 +346,56 @@ if __name__ == '__main__':
         return_source_documents=True
     )
 
+    # traducteur créé une fois (translation_backend) ; aucun pour l'index et le LLM multilingues (language: fr)
+    traducteur = creer_traducteur(app_config)
+    logger.info(f"-> Traduction : {'aucune' if traducteur is None else traducteur.nom}")
+    # modèle d'embedding multilingue : la recherche utilise la question française, en même temps que sa traduction
+    multilingue = est_multilingue(app_config, embeddings_model_name)
+    # contexte du LLM : morceaux voisins fusionnés, doublons supprimés, budget de tokens du modèle
+    assembleur = creer_assembleur(app_config, llm_model_name)
+    logger.info(f"-> Budget du contexte : {assembleur.budget_tokens or 'illimité'} tokens")
+
+    if batch_file:
+        # mode lot : questions du fichier JSONL, réponses, sources et durées dans un fichier JSONL
+        from batch_queries import executer_lot
+
+        out_file = out_file or app_config.get('output_file') or os.path.splitext(batch_file)[0] + '_reponses.jsonl'
+        nb_erreurs = executer_lot(batch_file, out_file, db, qa_chain, llm, traducteur, multilingue, sections,
+                                  nb_workers=int(app_config.get('batch_llm_workers', 2)), assembleur=assembleur)
+        if traducteur is not None:
+            traducteur.enregistrer()
+            traducteur.log_stats()
+        sys.exit(1 if nb_erreurs else 0)
+
+    if serve:
+        # service HTTP : questions de plusieurs clients, recherche par lots, file d'attente du LLM
+        from rag_service import ServiceRAG, servir
+
+        service = ServiceRAG(app_config, db, qa_chain, llm, traducteur, multilingue, sections, assembleur)
+        logger.info(f"   (démarrage en {time.perf_counter() - DEBUT_DEMARRAGE:.2f} s)")
+        servir(service, app_config.get('service_host', '127.0.0.1'), port or int(app_config.get('service_port', 8765)))
+        if traducteur is not None:
+            traducteur.enregistrer()
+            traducteur.log_stats()
+        sys.exit()
+
+    # cache des réponses (question identique, puis question voisine), vidé si l'index a été reconstruit
+    cache_reponses = creer_cache_reponses(app_config, empreinte_index(vector_store_path))
+    if cache_reponses is not None:
+        logger.info(f"-> Cache des réponses : {len(cache_reponses)} réponses")
+
+    def traduire_phrase(phrase):
+        try:
+            return traducteur.traduire(phrase, 'en', 'fr')
+        except Exception as e:
+            logger.warning(f"Erreur de traduction de la réponse : {e}")
+            return TRADUCTION_IMPOSSIBLE
+
     logger.info("\n✅ Système prêt ! Posez vos questions sur les règles de Bolt Action.")
+    logger.info(f"   (démarrage en {time.perf_counter() - DEBUT_DEMARRAGE:.2f} s jusqu'à la première question)")
     logger.info("   (Tapez 'quitter' ou 'exit' pour arrêter)\n")
 
-    # --- BOUCLE INTERACTIVE (inchangée) ---
+    # --- BOUCLE INTERACTIVE ---
 
     while True:
         user_question_fr = input("Votre question (en français) : ")
@@ -137,35 +404,128 @@ if __name__ == '__main__':
             break
         if not user_question_fr.strip():
             continue
+        if user_question_fr.strip() == "/sections":
+            # chapitres (premier niveau des chemins de section)
+            chapitres = dict.fromkeys(section.split(SEPARATEUR_SECTION)[0]
+                                      for section in sections_index(db.docstore.store))
+            print("\n".join(f"  - {chapitre}" for chapitre in chapitres) or "  (aucune section dans l'index)")
+            continue
+        if user_question_fr.strip().startswith("/faiss"):
+            # réglage de la recherche sans reconstruire l'index : /faiss ef_search=128 nprobe=16
+            try:
+                reglages = dict(r.split('=', 1) for r in user_question_fr.strip()[len("/faiss"):].split())
+                regler_recherche(db.index, **{nom: int(valeur) for nom, valeur in reglages.items()
+                                              if nom in ('ef_search', 'nprobe')})
+                print(f"-> Paramètres de recherche FAISS : {reglages}\n")
+            except ValueError as e:
+                print(f"Réglage invalide : {e}\n")
+            continue
+        if user_question_fr.strip().startswith("/cache"):
+            if cache_reponses is None:
+                print("-> Cache des réponses désactivé (answer_cache_size: 0)\n")
+            elif user_question_fr.strip()[len("/cache"):].strip() == "vider":
+                cache_reponses.vider()
+                print("-> Cache des réponses vidé\n")
+            else:
+                print(f"-> Cache des réponses : {len(cache_reponses)} réponses, seuil de similarité "
+                      f"{cache_reponses.seuil}\n")
+            continue
+        if user_question_fr.strip().startswith("/section"):
+            motifs = [m.strip() for m in user_question_fr.strip()[len("/section"):].split(',') if m.strip()]
+            nb_morceaux = retriever.restreindre(motifs)
+            if motifs:
+                print(f"-> Recherche restreinte aux sections {motifs} : {nb_morceaux} morceaux\n")
+            else:
+                print(f"-> Recherche sur tout le document : {nb_morceaux} morceaux\n")
+            continue
 
-        print("\n-> Traduction de la question en anglais...")
+        # durées des étapes, mesurées depuis la saisie de la question
+        latences = Latences()
+        if traducteur is not None:
+            print("\n-> Traduction de la question en anglais" + (" et recherche des sources..." if multilingue else "..."))
         try:
-            user_question_en = GoogleTranslator(source='auto', target='en').translate(user_question_fr)
-            print(f"   Question traduite : \"{user_question_en}\"")
+            # old : user_question_en = GoogleTranslator(source='auto', target='en').translate(user_question_fr)
+            # traduction de la question et recherche des sources (simultanées avec un modèle multilingue)
+            user_question_en, documents = preparer_question(user_question_fr, retriever, traducteur, multilingue,
+                                                            latences)
         except Exception as e:
-            print(f"Erreur de traduction de la question : {e}")
+            print(f"Erreur de traduction de la question ou de recherche : {e}")
             continue
+        if traducteur is not None:
+            print(f"   Question traduite : \"{user_question_en}\"")
 
         logger.info(f"\n--- lancemenent de la requete : {user_question_en.upper()} ---")
-        result = qa_chain.invoke({"query": user_question_en})
-        answer_en = result['result']
-
-        print("-> Traduction de la réponse en français...")
-        try:
-            answer_fr = GoogleTranslator(source='auto', target='fr').translate(answer_en)
-        except Exception as e:
-            print(f"Erreur de traduction de la réponse : {e}")
-            answer_fr = "Traduction impossible."
-
-        print("\n--- Réponse en Anglais / English Answer ---")
-        print(answer_en)
-        print("------------------------------------------\n")
-
-        print("--- Réponse en Français / French Answer ---")
-        print(answer_fr)
-        print("-----------------------------------------\n")
-
-        print("--- Sources utilisées (en anglais) ---")
-        for i, source in enumerate(result['source_documents']):
-            print(f"Source {i + 1}:\n\"{source.page_content[:300]}...\"\n")
-        print("------------------------------------\n")
+        entree = None
+        if cache_reponses is not None:
+            # même modèle, même température, mêmes morceaux et même question : même réponse
+            ids = [int(document.id) for document in documents]
+            cle = CacheReponses.cle(llm_model_name, llm_temperature, ids, user_question_en)
+            contexte = CacheReponses.contexte(llm_model_name, llm_temperature, retriever.sections)
+            with latences.mesurer('cache'):
+                entree = cache_reponses.chercher_exact(cle)
+                if entree is not None:
+                    print("-> Réponse en cache (question identique)")
+                else:
+                    vecteur = embeddings.embed_query(user_question_en)
+                    entree, similarite = cache_reponses.chercher_semantique(vecteur, contexte)
+                    if entree is not None:
+                        print(f"-> Réponse en cache (question voisine : \"{entree['question']}\", "
+                              f"similarité {similarite:.3f})")
+                        documents = [db.docstore.store.document(i) for i in entree['ids']]
+
+        if entree is not None:
+            answer_en, answer_fr = entree['answer_en'], entree['answer_fr']
+            if traducteur is None:
+                answer_fr = None
+            elif answer_fr is None:
+                with latences.mesurer('traduction réponse'):
+                    answer_fr = traduire_phrase(answer_en)
+            afficher_reponse(answer_en, answer_fr)
+            afficher_sources(documents)
+        # old : result = qa_chain.invoke({"query": user_question_en})
+        # sources déjà trouvées : le LLM reçoit le prompt de la chaîne avec ces documents
+        elif streaming:
+            afficher_sources(documents)
+            answer_en, answer_fr = repondre_en_flux(qa_chain, llm, documents, user_question_en,
+                                                    None if traducteur is None else traduire_phrase, latences,
+                                                    assembleur)
+            if answer_fr is not None:
+                print("--- Réponse en Français / French Answer ---")
+                print(answer_fr)
+                print("-----------------------------------------\n")
+        else:
+            with latences.mesurer('génération'):
+                answer_en = llm.invoke(messages_chaine(qa_chain, documents, user_question_en, assembleur)).content
+
+            answer_fr = None
+            if traducteur is not None:
+                print("-> Traduction de la réponse en français...")
+                try:
+                    # old : answer_fr = GoogleTranslator(source='auto', target='fr').translate(answer_en)
+                    with latences.mesurer('traduction réponse'):
+                        answer_fr = traducteur.traduire(answer_en, 'en', 'fr')
+                except Exception as e:
+                    print(f"Erreur de traduction de la réponse : {e}")
+                    answer_fr = TRADUCTION_IMPOSSIBLE
+
+            afficher_reponse(answer_en, answer_fr)
+            afficher_sources(documents)
+
+        if entree is None and cache_reponses is not None:
+            # traduction (d'une phrase au moins) en échec : pas de réponse française en cache, elle sera
+            # traduite de nouveau quand la question reviendra
+            if answer_fr is not None and TRADUCTION_IMPOSSIBLE in answer_fr:
+                answer_fr = None
+            cache_reponses.ajouter(cle, contexte, vecteur, user_question_en, ids, answer_en, answer_fr)
+        if latences.premier_token is not None:
+            logger.info(f"   (premier token en {latences.premier_token:.2f} s, réponse complète en "
+                        f"{latences.total():.2f} s)")
+        logger.info(f"   (durées : {latences.resume()})")
+        if traducteur is not None:
+            traducteur.enregistrer()
+
+    if traducteur is not None:
+        traducteur.enregistrer()
+        traducteur.log_stats()
+    if cache_reponses is not None:
+        cache_reponses.log_stats()
@@ -0,0 +1,190 @@
+# Fichier : answer_cache.py
+#
+# Cache des réponses de E04, à deux niveaux :
+#   - exact      : clé = (modèle LLM, température, numéros des morceaux trouvés, question posée au LLM) ;
+#                  même prompt, même réponse
+#   - sémantique : une question dont l'embedding est à une similarité cosinus d'au moins
+#                  answer_cache_semantic_threshold d'une question en cache (même modèle, même
+#                  température, mêmes sections) reçoit la réponse de celle-ci
+# Les entrées les moins récemment utilisées sont supprimées au-delà de answer_cache_size.
+# Le répertoire <data_dir>/answer_cache_<langue> contient :
+#   - meta.json     : empreinte de l'index FAISS ; si l'index a été reconstruit, le cache est vidé
+#   - entrees.json  : les entrées, de la moins à la plus récemment utilisée
+#   - vecteurs.npy  : les embeddings normalisés des questions, dans l'ordre des entrées
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+
+import numpy as np
+
+from config import logger
+
+
+# =============================================================================
+# _ecrire_atomique
+# =============================================================================
+def _ecrire_atomique(chemin, ecrire, mode='w'):
+    repertoire = os.path.dirname(chemin) or '.'
+    fd, chemin_tmp = tempfile.mkstemp(dir=repertoire, suffix='.tmp')
+    with os.fdopen(fd, mode, **({'encoding': 'utf-8'} if 'b' not in mode else {})) as f:
+        ecrire(f)
+    os.replace(chemin_tmp, chemin)
+
+
+# =============================================================================
+# _normaliser
+# =============================================================================
+def _normaliser(vecteur):
+    vecteur = np.asarray(vecteur, dtype=np.float32).reshape(-1)
+    norme = float(np.linalg.norm(vecteur))
+    return vecteur / norme if norme > 0 else vecteur
+
+
+# =============================================================================
+# CacheReponses
+# =============================================================================
+class CacheReponses:
+    """
+    Cache persistant des réponses (niveau exact et niveau sémantique).
+    """
+
+    def __init__(self, chemin, empreinte_index, taille=1000, seuil=0.95):
+        self.chemin = chemin
+        self.taille = max(1, int(taille))
+        self.seuil = float(seuil)
+        self.empreinte_index = empreinte_index
+        self.entrees = []
+        self.vecteurs = None
+        self.hits_exacts = 0
+        self.hits_semantiques = 0
+        self.misses = 0
+        os.makedirs(chemin, exist_ok=True)
+        self._ouvrir()
+
+    def _ouvrir(self):
+        try:
+            with open(os.path.join(self.chemin, 'meta.json'), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('index') != self.empreinte_index:
+                logger.info(f"cache des réponses '{self.chemin}' vidé : l'index a été reconstruit")
+                return
+            with open(os.path.join(self.chemin, 'entrees.json'), 'r', encoding='utf-8') as f:
+                entrees = json.load(f)
+            vecteurs = np.load(os.path.join(self.chemin, 'vecteurs.npy'))
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"cache des réponses '{self.chemin}' illisible : {e}")
+            return
+        if len(entrees) != len(vecteurs):
+            logger.warning(f"cache des réponses '{self.chemin}' incohérent : vidé")
+            return
+        self.entrees = entrees
+        self.vecteurs = vecteurs if len(vecteurs) else None
+
+    def __len__(self):
+        return len(self.entrees)
+
+    @staticmethod
+    def cle(modele, temperature, ids, question):
+        contenu = json.dumps([modele, temperature, [int(i) for i in ids], ' '.join(question.split())])
+        return hashlib.sha256(contenu.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def contexte(modele, temperature, sections=None):
+        """
+        Conditions à respecter pour réutiliser une réponse d'une question voisine.
+        """
+        return json.dumps([modele, temperature, sorted(sections) if sections else None])
+
+    def _utiliser(self, position):
+        # l'entrée devient la plus récemment utilisée
+        self.entrees.append(self.entrees.pop(position))
+        if self.vecteurs is not None:
+            ordre = list(range(len(self.vecteurs)))
+            ordre.append(ordre.pop(position))
+            self.vecteurs = self.vecteurs[ordre]
+        return self.entrees[-1]
+
+    def chercher_exact(self, cle):
+        for position, entree in enumerate(self.entrees):
+            if entree['cle'] == cle:
+                self.hits_exacts += 1
+                return self._utiliser(position)
+        return None
+
+    def chercher_semantique(self, vecteur, contexte):
+        """
+        Entrée de même contexte dont la question est la plus proche, si sa similarité atteint le seuil ;
+        retourne (entrée, similarité) ou (None, meilleure similarité).
+        """
+        if self.vecteurs is None:
+            self.misses += 1
+            return None, None
+        similarites = self.vecteurs @ _normaliser(vecteur)
+        candidates = [i for i, entree in enumerate(self.entrees) if entree['contexte'] == contexte]
+        if not candidates:
+            self.misses += 1
+            return None, None
+        meilleure = max(candidates, key=lambda i: similarites[i])
+        similarite = float(similarites[meilleure])
+        if similarite < self.seuil:
+            self.misses += 1
+            return None, similarite
+        self.hits_semantiques += 1
+        return self._utiliser(meilleure), similarite
+
+    def ajouter(self, cle, contexte, vecteur, question, ids, answer_en, answer_fr=None):
+        # une réponse régénérée remplace l'ancienne
+        garder = [i for i, entree in enumerate(self.entrees) if entree['cle'] != cle]
+        if len(garder) < len(self.entrees):
+            self.entrees = [self.entrees[i] for i in garder]
+            self.vecteurs = self.vecteurs[garder] if garder else None
+        self.entrees.append({'cle': cle, 'contexte': contexte, 'question': question, 'ids': [int(i) for i in ids],
+                             'answer_en': answer_en, 'answer_fr': answer_fr, 'date': time.time()})
+        vecteur = _normaliser(vecteur)[None, :]
+        self.vecteurs = vecteur if self.vecteurs is None else np.vstack([self.vecteurs, vecteur])
+        if len(self.entrees) > self.taille:
+            # les moins récemment utilisées sont en tête
+            excedent = len(self.entrees) - self.taille
+            self.entrees = self.entrees[excedent:]
+            self.vecteurs = self.vecteurs[excedent:]
+        self.enregistrer()
+
+    def enregistrer(self):
+        _ecrire_atomique(os.path.join(self.chemin, 'entrees.json'),
+                         lambda f: json.dump(self.entrees, f, ensure_ascii=False))
+        vecteurs = self.vecteurs if self.vecteurs is not None else np.empty((0, 0), dtype=np.float32)
+        _ecrire_atomique(os.path.join(self.chemin, 'vecteurs.npy'), lambda f: np.save(f, vecteurs), 'wb')
+        # meta.json en dernier : un cache interrompu pendant l'écriture reste cohérent ou est vidé
+        _ecrire_atomique(os.path.join(self.chemin, 'meta.json'),
+                         lambda f: json.dump({'index': self.empreinte_index}, f))
+
+    def vider(self):
+        self.entrees = []
+        self.vecteurs = None
+        self.enregistrer()
+
+    def log_stats(self):
+        total = self.hits_exacts + self.hits_semantiques + self.misses
+        if total:
+            logger.info(f"cache des réponses : {self.hits_exacts} réponses exactes, {self.hits_semantiques} "
+                        f"réponses de questions voisines, {self.misses} réponses générées "
+                        f"({100 * (self.hits_exacts + self.hits_semantiques) / total:.1f} % de hits)")
+
+
+# =============================================================================
+# creer_cache_reponses
+# =============================================================================
+def creer_cache_reponses(app_config, empreinte_index):
+    """
+    Cache des réponses de la configuration (answer_cache_size = 0 : pas de cache).
+    """
+    taille = int(app_config.get('answer_cache_size', 1000))
+    if taille <= 0:
+        return None
+    return CacheReponses(os.path.join(app_config['data_dir'], 'answer_cache_' + app_config['language']),
+                         empreinte_index, taille, float(app_config.get('answer_cache_semantic_threshold', 0.95)))
@@ -0,0 +1,165 @@
+# Fichier : batch_queries.py
+#
+# Mode lot de E04 (E04 --batch=<questions.jsonl>) : pour les campagnes de non-régression sur
+# quelques centaines de questions de règles.
+# Fichier d'entrée : une question par ligne, {"question": "...", "sections": [...] facultatif,
+# autres champs (id, réponse attendue, ...) recopiés tels quels dans la sortie}.
+# Traitement :
+#   - traduction des questions (si un traducteur est configuré)
+#   - embeddings de toutes les questions en un seul passage, une seule recherche FAISS multi-requêtes
+#     (une par restriction de sections différente)
+#   - requêtes au LLM en parallèle (batch_llm_workers) ; Ollama ne les traite simultanément que si
+#     OLLAMA_NUM_PARALLEL le permet
+#   - fichier de sortie JSONL : réponses, sources et durées par question, dans l'ordre des questions
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import bcolors, logger
+from query_pipeline import messages_chaine
+from vector_store import encoder_requetes, ids_sections, rechercher_vecteurs
+
+
+# =============================================================================
+# lire_questions
+# =============================================================================
+def lire_questions(chemin):
+    """
+    Questions du fichier JSONL (les lignes vides sont ignorées).
+    """
+    questions = []
+    with open(chemin, 'r', encoding='utf-8') as f:
+        for numero, ligne in enumerate(f, 1):
+            if not ligne.strip():
+                continue
+            try:
+                question = json.loads(ligne)
+                if isinstance(question, str):
+                    question = {'question': question}
+                if not str(question.get('question', '')).strip():
+                    raise ValueError("champ 'question' absent ou vide")
+                # même contrôle que le service HTTP : une chaîne serait restreinte à ses caractères
+                sections = question.get('sections')
+                if sections is not None and (not isinstance(sections, list)
+                                             or not all(isinstance(section, str) for section in sections)):
+                    raise ValueError("'sections' doit être une liste de chaînes")
+            except (ValueError, AttributeError) as e:
+                raise ValueError(f"'{chemin}' ligne {numero} : {e}") from e
+            questions.append(question)
+    return questions
+
+
+# =============================================================================
+# _traduire
+# =============================================================================
+def _traduire(traducteur, texte, source, cible):
+    debut = time.perf_counter()
+    try:
+        return traducteur.traduire(texte, source, cible), time.perf_counter() - debut, None
+    except Exception as e:
+        return None, time.perf_counter() - debut, f"traduction {source} -> {cible} : {e}"
+
+
+# =============================================================================
+# traiter_lot
+# =============================================================================
+def traiter_lot(questions, db, qa_chain, llm, traducteur=None, multilingue=False, sections=None, nb_workers=2,
+                assembleur=None):
+    """
+    Répond aux questions ; génère un résultat (dictionnaire) par question, dans l'ordre des questions.
+    Les sources sont choisies comme par le retriever de la chaîne (nombre, recherche hybride).
+    """
+    retriever = qa_chain.retriever
+    nb = len(questions)
+    textes = [question['question'].strip() for question in questions]
+    durees = [{} for _ in range(nb)]
+    erreurs = [None] * nb
+
+    with ThreadPoolExecutor(max_workers=max(1, nb_workers)) as pool:
+        # traduction des questions
+        if traducteur is None:
+            questions_en = list(textes)
+        else:
+            questions_en = []
+            for i, (traduction, duree, erreur) in enumerate(pool.map(lambda t: _traduire(traducteur, t, 'fr', 'en'),
+                                                                     textes)):
+                questions_en.append(traduction if traduction is not None else textes[i])
+                durees[i]['traduction question'] = duree
+                erreurs[i] = erreur
+
+        # un seul passage d'embeddings, une recherche FAISS par restriction de sections
+        debut = time.perf_counter()
+        requetes = textes if multilingue or traducteur is None else questions_en
+        vecteurs = encoder_requetes(db, requetes)
+        groupes = {}
+        for i, question in enumerate(questions):
+            motifs = question.get('sections') or sections
+            groupes.setdefault(tuple(sorted(motifs)) if motifs else None, []).append(i)
+        documents = [None] * nb
+        distances = [None] * nb
+        for cle, positions in groupes.items():
+            ids = ids_sections(db.docstore.store, cle) if cle is not None else None
+            for i, trouves in zip(positions, rechercher_vecteurs(db, vecteurs[positions], retriever.k_recherche, ids)):
+                # classement BM25 (index anglais) avec la question traduite, même si la recherche vectorielle
+                # utilise la question d'origine (modèle multilingue)
+                documents[i] = retriever.fusionner(questions_en[i], trouves, ids)
+                distances[i] = {document.id: distance for document, distance in trouves}
+        duree_recherche = time.perf_counter() - debut
+        logger.info(f"-> {nb} questions encodées et cherchées en {duree_recherche:.2f} s "
+                    f"({len(groupes)} recherche(s) FAISS)")
+
+        def generer(i):
+            debut_generation = time.perf_counter()
+            try:
+                messages = messages_chaine(qa_chain, documents[i], questions_en[i], assembleur)
+                answer_en = llm.invoke(messages).content
+            except Exception as e:
+                return None, time.perf_counter() - debut_generation, f"LLM : {e}"
+            return answer_en, time.perf_counter() - debut_generation, None
+
+        # requêtes au LLM en parallèle ; les résultats arrivent dans l'ordre des questions
+        for i, (answer_en, duree, erreur) in enumerate(pool.map(generer, range(nb))):
+            durees[i]['recherche (lot)'] = duree_recherche / nb
+            durees[i]['génération'] = duree
+            erreurs[i] = erreurs[i] or erreur
+            answer_fr = None
+            if traducteur is not None and answer_en is not None:
+                answer_fr, durees[i]['traduction réponse'], erreur = _traduire(traducteur, answer_en, 'en', 'fr')
+                erreurs[i] = erreurs[i] or erreur
+            resultat = {**questions[i], 'question_en': questions_en[i], 'answer_en': answer_en,
+                        'answer_fr': answer_fr,
+                        'sources': [{'id': document.id, 'section': document.metadata.get('section'),
+                                     'distance': round(distances[i][document.id], 4)
+                                     if document.id in distances[i] else None,
+                                     'texte': document.page_content[:300]}
+                                    for document in documents[i]],
+                        'durees': {nom: round(valeur, 4) for nom, valeur in durees[i].items()}}
+            resultat['durees']['total'] = round(sum(durees[i].values()), 4)
+            if erreurs[i]:
+                resultat['erreur'] = erreurs[i]
+            yield resultat
+
+
+# =============================================================================
+# executer_lot
+# =============================================================================
+def executer_lot(chemin_questions, chemin_reponses, db, qa_chain, llm, traducteur=None, multilingue=False,
+                 sections=None, nb_workers=2, assembleur=None):
+    """
+    Lit les questions, écrit les réponses au fur et à mesure ; retourne le nombre de questions en erreur.
+    """
+    debut = time.perf_counter()
+    questions = lire_questions(chemin_questions)
+    logger.info(f"-> {len(questions)} questions lues dans '{chemin_questions}'")
+    nb_erreurs = 0
+    with open(chemin_reponses, 'w', encoding='utf-8') as f:
+        for resultat in traiter_lot(questions, db, qa_chain, llm, traducteur, multilingue, sections, nb_workers,
+                                    assembleur):
+            f.write(json.dumps(resultat, ensure_ascii=False) + '\n')
+            f.flush()
+            nb_erreurs += 'erreur' in resultat
+    duree = time.perf_counter() - debut
+    logger.info(f"✅ {len(questions)} réponses écrites dans {bcolors.INPUT}{chemin_reponses}{bcolors.ENDC} "
+                f"en {duree:.1f} s ({nb_erreurs} en erreur)")
+    return nb_erreurs
@@ -0,0 +1,160 @@
+# Fichier : bm25_index.py
+#
+# Index inversé BM25 des morceaux, construit par E02 (et pipeline.py) à côté du chunk store,
+# pour la recherche hybride de E04 : les questions de Bolt Action contiennent des termes exacts
+# (noms d'unités et d'armes : "PIAT", "Panzerschreck" ; mots-clés de règles : "Pinned", "Ambush")
+# qu'un modèle d'embedding comme MiniLM ne retrouve pas toujours.
+# Le répertoire <chunk store>/bm25 contient :
+#   - meta.json        : version, paramètres k1 et b, nombre de morceaux, longueur moyenne
+#   - vocabulaire.json : les termes, triés
+#   - offsets.npy      : début des occurrences de chaque terme dans docs.npy / tf.npy, plus la fin
+#   - docs.npy         : numéros des morceaux contenant le terme (int32)
+#   - tf.npy           : nombre d'occurrences du terme dans le morceau (uint16)
+#   - longueurs.npy    : nombre de termes de chaque morceau (int32)
+# Les tableaux sont projetés en mémoire ; le numéro d'un morceau est celui du chunk store, donc
+# la position de son vecteur dans l'index FAISS.
+
+import os
+import re
+import json
+import math
+import shutil
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+from config import logger
+from chunk_store import ChunkStore
+
+BM25_DIR = 'bm25'
+FORMAT_VERSION = 1
+_RE_TERME = re.compile(r'[a-z0-9]+')
+
+
+# =============================================================================
+# termes
+# =============================================================================
+def termes(texte):
+    """
+    Termes d'un texte : minuscules, sans accents, suites de lettres et de chiffres.
+    """
+    texte = unicodedata.normalize('NFKD', texte.lower())
+    texte = ''.join(c for c in texte if not unicodedata.combining(c))
+    return _RE_TERME.findall(texte)
+
+
+# =============================================================================
+# construire_bm25
+# =============================================================================
+def construire_bm25(chemin_store, k1=1.2, b=0.75):
+    """
+    Construit l'index BM25 des morceaux du chunk store dans <chemin_store>/bm25 ; retourne le nombre de termes.
+    """
+    store = ChunkStore(chemin_store)
+    postings = {}
+    longueurs = np.zeros(len(store), dtype=np.int32)
+    for i, texte in enumerate(store.textes()):
+        compte = Counter(termes(texte))
+        longueurs[i] = sum(compte.values())
+        for terme, nombre in compte.items():
+            postings.setdefault(terme, []).append((i, nombre))
+    store.close()
+    vocabulaire = sorted(postings)
+    offsets = np.zeros(len(vocabulaire) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(postings[terme]) for terme in vocabulaire])
+    docs = np.fromiter((i for terme in vocabulaire for i, _ in postings[terme]), dtype=np.int32, count=offsets[-1])
+    tf = np.fromiter((min(n, 65535) for terme in vocabulaire for _, n in postings[terme]), dtype=np.uint16,
+                     count=offsets[-1])
+
+    chemin = os.path.join(chemin_store, BM25_DIR)
+    chemin_tmp = chemin + '.tmp'
+    if os.path.exists(chemin_tmp):
+        shutil.rmtree(chemin_tmp)
+    os.makedirs(chemin_tmp)
+    np.save(os.path.join(chemin_tmp, 'offsets.npy'), offsets)
+    np.save(os.path.join(chemin_tmp, 'docs.npy'), docs)
+    np.save(os.path.join(chemin_tmp, 'tf.npy'), tf)
+    np.save(os.path.join(chemin_tmp, 'longueurs.npy'), longueurs)
+    with open(os.path.join(chemin_tmp, 'vocabulaire.json'), 'w', encoding='utf-8') as f:
+        json.dump(vocabulaire, f, ensure_ascii=False)
+    with open(os.path.join(chemin_tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'version': FORMAT_VERSION, 'k1': k1, 'b': b, 'nombre': int(len(longueurs)),
+                   'longueur_moyenne': float(longueurs.mean()) if len(longueurs) else 0.0}, f)
+    if os.path.exists(chemin):
+        shutil.rmtree(chemin)
+    os.replace(chemin_tmp, chemin)
+    logger.info(f"index BM25 '{chemin}' : {len(vocabulaire)} termes, {offsets[-1]} occurrences")
+    return len(vocabulaire)
+
+
+# =============================================================================
+# IndexBM25
+# =============================================================================
+class IndexBM25:
+    """
+    Lecture de l'index BM25 d'un chunk store et recherche des morceaux d'une requête.
+    """
+
+    def __init__(self, chemin_store):
+        chemin = os.path.join(chemin_store, BM25_DIR)
+        with open(os.path.join(chemin, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != FORMAT_VERSION:
+            raise ValueError(f"index BM25 '{chemin}' : version {meta.get('version')} non supportée")
+        self.k1 = float(meta['k1'])
+        self.b = float(meta['b'])
+        self.nombre = int(meta['nombre'])
+        self.longueur_moyenne = float(meta['longueur_moyenne']) or 1.0
+        with open(os.path.join(chemin, 'vocabulaire.json'), 'r', encoding='utf-8') as f:
+            self.vocabulaire = {terme: j for j, terme in enumerate(json.load(f))}
+        self.offsets = np.load(os.path.join(chemin, 'offsets.npy'), mmap_mode='r')
+        self.docs = np.load(os.path.join(chemin, 'docs.npy'), mmap_mode='r')
+        self.tf = np.load(os.path.join(chemin, 'tf.npy'), mmap_mode='r')
+        self.longueurs = np.load(os.path.join(chemin, 'longueurs.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return self.nombre
+
+    def scores(self, requete):
+        """
+        Score BM25 de chaque morceau pour la requête.
+        """
+        scores = np.zeros(self.nombre, dtype=np.float32)
+        for terme in set(termes(requete)):
+            j = self.vocabulaire.get(terme)
+            if j is None:
+                continue
+            debut, fin = int(self.offsets[j]), int(self.offsets[j + 1])
+            docs = np.asarray(self.docs[debut:fin])
+            tf = np.asarray(self.tf[debut:fin], dtype=np.float32)
+            idf = math.log(1 + (self.nombre - len(docs) + 0.5) / (len(docs) + 0.5))
+            normalisation = self.k1 * (1 - self.b + self.b * self.longueurs[docs] / self.longueur_moyenne)
+            # un morceau n'apparaît qu'une fois par terme
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + normalisation)
+        return scores
+
+    def rechercher(self, requete, k=4, ids=None):
+        """
+        Les k morceaux de meilleur score (non nul), parmi les morceaux ids seulement si ids n'est pas None ;
+        retourne une liste de (numéro, score).
+        """
+        scores = self.scores(requete)
+        candidats = np.flatnonzero(scores) if ids is None else \
+            np.asarray(ids, dtype=np.int64)[scores[np.asarray(ids, dtype=np.int64)] > 0]
+        if len(candidats) > k:
+            candidats = candidats[np.argpartition(-scores[candidats], k - 1)[:k]]
+        candidats = candidats[np.argsort(-scores[candidats], kind='stable')]
+        return [(int(i), float(scores[i])) for i in candidats]
+
+
+# =============================================================================
+# charger_bm25
+# =============================================================================
+def charger_bm25(chemin_store):
+    """
+    Index BM25 du chunk store, ou None s'il n'a pas été construit (E02 avec bm25_index: false, ou ancien index).
+    """
+    if not os.path.exists(os.path.join(chemin_store, BM25_DIR, 'meta.json')):
+        return None
+    return IndexBM25(chemin_store)
@@ -0,0 +1,313 @@
+# Fichier : build.py
+#
+# Reconstruction incrémentale des artefacts de data_dir (texte, morceaux, index FAISS).
+# Un manifeste (<data_dir>/build_manifest.json) enregistre pour chaque étape l'empreinte
+# de ses entrées et de ses sorties ainsi que ses paramètres : une étape dont rien n'a
+# changé n'est pas relancée, et une étape relancée invalide les suivantes puisque ses
+# sorties sont leurs entrées.
+#
+# Les paramètres d'une étape comprennent aussi l'empreinte de son code (scripts, moteur de
+# nettoyage, découpeur...) et la version des bibliothèques qui déterminent ses sorties :
+# une mise à jour du code ou d'une bibliothèque relance l'étape.
+#
+# Utilisation : python build.py (--cfg=<filename>) (--force)
+# Chaque script E0x consulte aussi le manifeste quand il est lancé seul.
+
+import os
+import sys
+import json
+import getopt
+import hashlib
+import subprocess
+import importlib.metadata
+import tempfile
+import time
+
+from config import load_config, bcolors, logger
+
+# ordre des étapes et script de chacune
+ETAPES = ['extraction', 'decoupage', 'vectorisation']
+SCRIPTS = {
+    'extraction': 'E01_pdf_to_text.py',
+    'decoupage': 'E02_Chunking.py',
+    'vectorisation': 'E03_Embeddings.py',
+}
+MANIFEST_FILE = 'build_manifest.json'
+# code source de chaque étape
+SOURCES = {
+    'extraction': ['E01_pdf_to_text.py', 'nettoyage.py', 'page_cache.py'],
+    'decoupage': ['E02_Chunking.py', 'text_splitter.py', 'chunk_store.py', 'bm25_index.py'],
+    'vectorisation': ['E03_Embeddings.py', 'embedding_engine.py', 'embedding_cache.py', 'vector_store.py',
+                      'near_duplicates.py', 'chunk_store.py', 'bm25_index.py'],
+}
+SOURCES['pipeline'] = ['pipeline.py'] + list(dict.fromkeys(s for etape in ETAPES for s in SOURCES[etape]))
+# bibliothèques dont la version peut changer les sorties de chaque étape
+PAQUETS = {
+    'extraction': ['pypdf', 'unstructured'],
+    'decoupage': [],
+    'vectorisation': ['sentence-transformers', 'transformers', 'torch', 'onnxruntime', 'faiss-cpu'],
+}
+PAQUETS['pipeline'] = [p for etape in ETAPES for p in PAQUETS[etape]]
+
+
+# =============================================================================
+# ManifesteBuild
+# =============================================================================
+class ManifesteBuild:
+    """
+    Manifeste des étapes de construction. Les empreintes SHA-256 des fichiers sont
+    mémorisées avec leur taille et leur date de modification : un fichier dont la
+    taille et la date n'ont pas changé n'est pas relu, ce qui rend une reconstruction
+    sans changement quasi instantanée.
+    """
+
+    def __init__(self, data_dir):
+        self.chemin = os.path.join(data_dir, MANIFEST_FILE)
+        self.fichiers = {}
+        self.etapes = {}
+        if os.path.exists(self.chemin):
+            try:
+                with open(self.chemin, 'r', encoding='utf-8') as f:
+                    contenu = json.load(f)
+                self.fichiers = contenu.get('fichiers', {})
+                self.etapes = contenu.get('etapes', {})
+            except (OSError, ValueError) as e:
+                logger.warning(f"manifeste '{self.chemin}' illisible, il sera reconstruit : {e}")
+
+    def sauvegarder(self):
+        os.makedirs(os.path.dirname(self.chemin) or '.', exist_ok=True)
+        fd, chemin_tmp = tempfile.mkstemp(dir=os.path.dirname(self.chemin) or '.', suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'fichiers': self.fichiers, 'etapes': self.etapes}, f, indent=2, sort_keys=True)
+        os.replace(chemin_tmp, self.chemin)
+
+    # -------------------------------------------------------------------------
+    def _empreinte_fichier(self, chemin):
+        stat = os.stat(chemin)
+        connu = self.fichiers.get(chemin)
+        if connu is not None and connu['taille'] == stat.st_size and connu['mtime_ns'] == stat.st_mtime_ns:
+            return connu['sha256']
+        h = hashlib.sha256()
+        with open(chemin, 'rb') as f:
+            for bloc in iter(lambda: f.read(1 << 20), b''):
+                h.update(bloc)
+        self.fichiers[chemin] = {'taille': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': h.hexdigest()}
+        return h.hexdigest()
+
+    def empreinte(self, chemin):
+        """
+        Empreinte d'un fichier, ou d'un répertoire (index FAISS) à partir de celles de ses fichiers ;
+        None si le chemin n'existe pas.
+        """
+        chemin = os.path.normpath(chemin)
+        if os.path.isfile(chemin):
+            return self._empreinte_fichier(chemin)
+        if os.path.isdir(chemin):
+            h = hashlib.sha256()
+            for racine, _, noms in sorted(os.walk(chemin)):
+                for nom in sorted(noms):
+                    fichier = os.path.join(racine, nom)
+                    h.update(os.path.relpath(fichier, chemin).encode('utf-8'))
+                    h.update(self._empreinte_fichier(fichier).encode())
+            return h.hexdigest()
+        return None
+
+    # -------------------------------------------------------------------------
+    def est_a_jour(self, etape, entrees, parametres, sorties):
+        enregistrement = self.etapes.get(etape)
+        if enregistrement is None:
+            return False
+        if enregistrement['parametres'] != json.loads(json.dumps(parametres)):
+            logger.info(f"étape '{etape}' : paramètres modifiés")
+            return False
+        for famille, chemins in (('entrees', entrees), ('sorties', sorties)):
+            if sorted(enregistrement[famille]) != sorted(os.path.normpath(c) for c in chemins):
+                return False
+            for chemin in chemins:
+                empreinte = self.empreinte(chemin)
+                if empreinte is None or empreinte != enregistrement[famille][os.path.normpath(chemin)]:
+                    logger.info(f"étape '{etape}' : '{chemin}' absent ou modifié")
+                    return False
+        return True
+
+    def oublier(self, etape):
+        self.etapes.pop(etape, None)
+
+    def enregistrer(self, etape, entrees, parametres, sorties):
+        self.etapes[etape] = {
+            'entrees': {os.path.normpath(c): self.empreinte(c) for c in entrees},
+            'parametres': parametres,
+            'sorties': {os.path.normpath(c): self.empreinte(c) for c in sorties},
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+
+
+# =============================================================================
+# version_code
+# =============================================================================
+def version_code(etape):
+    """
+    Empreinte du code source de l'étape et versions des bibliothèques installées (None : absente).
+    """
+    h = hashlib.sha256()
+    repertoire = os.path.dirname(os.path.abspath(__file__))
+    for nom in SOURCES[etape]:
+        h.update(nom.encode('utf-8'))
+        with open(os.path.join(repertoire, nom), 'rb') as f:
+            h.update(f.read())
+    versions = {}
+    for paquet in PAQUETS[etape]:
+        try:
+            versions[paquet] = importlib.metadata.version(paquet)
+        except importlib.metadata.PackageNotFoundError:
+            versions[paquet] = None
+    return {'sources': h.hexdigest(), 'bibliotheques': versions}
+
+
+# =============================================================================
+# definir_etape
+# =============================================================================
+def definir_etape(app_config, etape):
+    """
+    Retourne (entrées, paramètres, sorties) d'une étape selon la configuration.
+    """
+    from nettoyage import PACKS_PAR_DEFAUT, RULES_DIR
+
+    data_dir = app_config['data_dir']
+    language = app_config['language']
+    rules_file = app_config['rules_' + language + '_file']
+    pdf_file = os.path.join(data_dir, rules_file)
+    clean_txt_file = os.path.join(data_dir, rules_file.replace('.pdf', '.txt'))
+    chunks_path = os.path.join(data_dir, rules_file.replace('.pdf', '_chunks'))
+    vector_store_path = os.path.join(data_dir, "faiss_index_" + language)
+    packs = app_config.get('rule_packs_' + language) or PACKS_PAR_DEFAUT
+    fichiers_packs = [p if p.endswith('.yaml') else os.path.join(RULES_DIR, p + '.yaml') for p in packs]
+    parametres_extraction = {'pdf_reader': app_config['pdf_reader'], 'rule_packs': packs}
+    parametres_decoupage = {'chunk_size': int(app_config.get('chunk_size', 1000)),
+                            'chunk_overlap': int(app_config.get('chunk_overlap', 150)),
+                            'chunk_by_section': bool(app_config.get('chunk_by_section', True)),
+                            'bm25': {cle: app_config.get(cle) for cle in ('bm25_index', 'bm25_k1', 'bm25_b')}}
+    parametres_vectorisation = {'embeddings_model_name': app_config['embeddings_' + language + '_model_name'],
+                                'embedding_backend': app_config.get('embedding_backend', 'torch'),
+                                'embedding_quantization': app_config.get('embedding_quantization', 'auto'),
+                                'embedding_backend_min_overlap': float(
+                                    app_config.get('embedding_backend_min_overlap', 0.9)),
+                                'faiss_index': {cle: app_config.get(cle) for cle in (
+                                    'faiss_index_type', 'faiss_hnsw_m', 'faiss_hnsw_ef_construction',
+                                    'faiss_ivf_nlist', 'faiss_pq_m', 'faiss_pq_nbits')},
+                                'dedup': {cle: app_config.get(cle) for cle in (
+                                    'dedup_chunks', 'dedup_threshold', 'dedup_shingle_size')}}
+
+    if etape == 'extraction':
+        return ([pdf_file] + fichiers_packs, {**parametres_extraction, 'code': version_code(etape)},
+                [os.path.join(data_dir, rules_file.replace('.pdf', '_raw.txt')), clean_txt_file])
+    if etape == 'decoupage':
+        return [clean_txt_file], {**parametres_decoupage, 'code': version_code(etape)}, [chunks_path]
+    if etape == 'vectorisation':
+        return [chunks_path], {**parametres_vectorisation, 'code': version_code(etape)}, [vector_store_path]
+    if etape == 'pipeline':
+        return ([pdf_file] + fichiers_packs,
+                {**parametres_extraction, **parametres_decoupage, **parametres_vectorisation,
+                 'code': version_code(etape)},
+                [vector_store_path])
+    raise ValueError(f"étape inconnue : '{etape}'")
+
+
+# =============================================================================
+# etape_a_jour
+# =============================================================================
+def etape_a_jour(app_config, etape, manifeste=None):
+    if manifeste is None:
+        manifeste = ManifesteBuild(app_config['data_dir'])
+    entrees, parametres, sorties = definir_etape(app_config, etape)
+    a_jour = manifeste.est_a_jour(etape, entrees, parametres, sorties)
+    # les empreintes recalculées (fichiers touchés mais identiques) sont mémorisées
+    manifeste.sauvegarder()
+    if a_jour:
+        logger.info(f"✅ étape '{bcolors.INPUT}{etape}{bcolors.ENDC}' à jour : rien à faire (--force pour la relancer)")
+    return a_jour
+
+
+# =============================================================================
+# enregistrer_etape
+# =============================================================================
+def enregistrer_etape(app_config, etape, manifeste=None):
+    """
+    Enregistre l'étape dans le manifeste si toutes ses sorties ont été produites.
+    """
+    if manifeste is None:
+        manifeste = ManifesteBuild(app_config['data_dir'])
+    entrees, parametres, sorties = definir_etape(app_config, etape)
+    manquantes = [s for s in sorties + entrees if not os.path.exists(s)]
+    if manquantes:
+        logger.warning(f"étape '{etape}' non enregistrée dans le manifeste, fichiers absents : {manquantes}")
+        return False
+    manifeste.enregistrer(etape, entrees, parametres, sorties)
+    manifeste.sauvegarder()
+    return True
+
+
+# =============================================================================
+# usage
+# =============================================================================
+def usage():
+    """
+    afficher le message d'aide
+
+    :return:
+    """
+    script_name = os.path.basename(__file__)
+    print(f"{script_name}  : () facultative item, <> : mandatory item\n"
+          "    (--cfg=<filename>)\n"
+          "    (--ll=<log level:CRITICAL|ERROR|WARNING|INFO|DEBUG>)\n"
+          "    (--force : relancer toutes les étapes)\n"
+          "    (-h : this help)\n")
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+if __name__ == '__main__':
+    cfg_filename = None
+    force = False
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "h", ["cfg=", "ll=", "force"])
+    except getopt.GetoptError as err:
+        logger.error(err)
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            sys.exit()
+        elif opt == "--cfg":
+            cfg_filename = arg
+        elif opt == "--ll":
+            if arg in ["CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"]:
+                log_level = arg
+        elif opt == "--force":
+            force = True
+
+    debut = time.perf_counter()
+    app_config = load_config(cfg_filename=cfg_filename)
+    manifeste = ManifesteBuild(app_config['data_dir'])
+    for etape in ETAPES:
+        if not force and etape_a_jour(app_config, etape, manifeste):
+            continue
+        logger.info(f"-> étape '{bcolors.INPUT}{etape}{bcolors.ENDC}' : lancement de {SCRIPTS[etape]}...")
+        # l'enregistrement d'une exécution précédente ne doit pas masquer un échec de celle-ci
+        manifeste.oublier(etape)
+        manifeste.sauvegarder()
+        commande = [sys.executable, SCRIPTS[etape], "--force"]
+        if cfg_filename is not None:
+            commande.append(f"--cfg={cfg_filename}")
+        resultat = subprocess.run(commande)
+        if resultat.returncode != 0:
+            logger.error(f"❌ l'étape '{etape}' a échoué (code {resultat.returncode})")
+            sys.exit(resultat.returncode)
+        # le script a mis le manifeste à jour
+        manifeste = ManifesteBuild(app_config['data_dir'])
+        if etape not in manifeste.etapes:
+            logger.error(f"❌ l'étape '{etape}' n'a pas produit toutes ses sorties")
+            sys.exit(1)
+    logger.info(f"✅ Construction terminée en {time.perf_counter() - debut:.2f} s")
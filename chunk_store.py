@@ -0,0 +1,237 @@
+# Fichier : chunk_store.py
+#
+# Stockage compact des morceaux (chunks) produits par E02, à la place du pickle de
+# Documents LangChain. Un chunk store est un répertoire contenant :
+#   - texte.bin   : les textes de tous les morceaux, concaténés en UTF-8
+#   - offsets.npy : position (en octets) du début de chaque morceau dans texte.bin, plus la fin
+#   - meta.json   : description des colonnes de métadonnées (nom, type, dictionnaire des chaînes)
+#   - col_<k>.npy : une colonne de métadonnées (entiers, réels, ou codes des chaînes)
+# Tous les fichiers sont projetés en mémoire (mmap) en lecture : un lecteur ne décode que
+# les morceaux qu'il demande (par exemple les k résultats d'une recherche), et le chargement
+# ne nécessite aucune désérialisation d'objets Python.
+
+import os
+import json
+import mmap
+import shutil
+
+import numpy as np
+
+from config import logger
+
+FORMAT_VERSION = 1
+# valeurs "absentes" dans les colonnes
+_ENTIER_ABSENT = np.iinfo(np.int64).min
+_CODE_ABSENT = -1
+
+
+# =============================================================================
+# _type_colonne
+# =============================================================================
+def _type_colonne(valeurs):
+    types = {type(v) for v in valeurs if v is not None}
+    if types and types <= {int}:
+        return 'int'
+    if types and types <= {int, float}:
+        return 'float'
+    if types and types <= {str}:
+        return 'str'
+    return 'json'
+
+
+# =============================================================================
+# EcrivainChunkStore
+# =============================================================================
+class EcrivainChunkStore:
+    """
+    Écrit un chunk store au fil de l'eau : les textes vont directement dans texte.bin,
+    seuls les offsets et les métadonnées (petites) sont gardés en mémoire jusqu'à la fin.
+    """
+
+    def __init__(self, chemin):
+        self.chemin = chemin
+        self.chemin_tmp = chemin + '.tmp'
+        if os.path.exists(self.chemin_tmp):
+            shutil.rmtree(self.chemin_tmp)
+        os.makedirs(self.chemin_tmp)
+        self.f_texte = open(os.path.join(self.chemin_tmp, 'texte.bin'), 'wb')
+        self.offsets = [0]
+        self.metadatas = []
+
+    def ajouter(self, texte, metadata=None):
+        donnees = texte.encode('utf-8')
+        self.f_texte.write(donnees)
+        self.offsets.append(self.offsets[-1] + len(donnees))
+        # le dictionnaire est gardé tel quel : il peut encore être complété avant fermer() (alias des quasi-doublons)
+        self.metadatas.append(metadata if metadata is not None else {})
+
+    def ajouter_document(self, doc):
+        self.ajouter(doc.page_content, doc.metadata)
+
+    def __len__(self):
+        return len(self.metadatas)
+
+    def fermer(self):
+        self.f_texte.close()
+        np.save(os.path.join(self.chemin_tmp, 'offsets.npy'), np.asarray(self.offsets, dtype=np.int64))
+        noms = sorted({nom for metadata in self.metadatas for nom in metadata})
+        colonnes = []
+        for k, nom in enumerate(noms):
+            valeurs = [metadata.get(nom) for metadata in self.metadatas]
+            type_colonne = _type_colonne(valeurs)
+            colonne = {'nom': nom, 'type': type_colonne}
+            if type_colonne == 'int':
+                tableau = np.array([_ENTIER_ABSENT if v is None else v for v in valeurs], dtype=np.int64)
+            elif type_colonne == 'float':
+                tableau = np.array([np.nan if v is None else v for v in valeurs], dtype=np.float64)
+            else:
+                # chaînes (ou valeurs JSON) codées par un dictionnaire : les sections, sources...
+                # se répètent d'un morceau à l'autre
+                if type_colonne == 'json':
+                    valeurs = [None if v is None else json.dumps(v, ensure_ascii=False) for v in valeurs]
+                dictionnaire = {}
+                codes = [_CODE_ABSENT if v is None else dictionnaire.setdefault(v, len(dictionnaire)) for v in valeurs]
+                tableau = np.array(codes, dtype=np.int32)
+                colonne['valeurs'] = list(dictionnaire)
+            np.save(os.path.join(self.chemin_tmp, f'col_{k}.npy'), tableau)
+            colonnes.append(colonne)
+        with open(os.path.join(self.chemin_tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'version': FORMAT_VERSION, 'nombre': len(self.metadatas), 'colonnes': colonnes},
+                      f, ensure_ascii=False)
+        # remplacement du store précédent seulement une fois le nouveau complet
+        if os.path.exists(self.chemin):
+            shutil.rmtree(self.chemin)
+        os.replace(self.chemin_tmp, self.chemin)
+        logger.debug(f"chunk store '{self.chemin}' écrit : {len(self.metadatas)} morceaux")
+
+    def abandonner(self):
+        """
+        Abandonne l'écriture (erreur, chaîne interrompue) : le store temporaire est supprimé, le store
+        précédent est gardé. Sans effet après fermer().
+        """
+        self.f_texte.close()
+        if os.path.exists(self.chemin_tmp):
+            shutil.rmtree(self.chemin_tmp)
+
+
+# =============================================================================
+# ecrire_chunk_store
+# =============================================================================
+def ecrire_chunk_store(chemin, docs):
+    """
+    Écrit une liste (ou un flux) de Documents LangChain dans un chunk store ; retourne le nombre de morceaux.
+    """
+    ecrivain = EcrivainChunkStore(chemin)
+    for doc in docs:
+        ecrivain.ajouter_document(doc)
+    ecrivain.fermer()
+    return len(ecrivain)
+
+
+# =============================================================================
+# ChunkStore
+# =============================================================================
+class ChunkStore:
+    """
+    Lecture d'un chunk store projeté en mémoire.
+    """
+
+    def __init__(self, chemin):
+        self.chemin = chemin
+        with open(os.path.join(chemin, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != FORMAT_VERSION:
+            raise ValueError(f"chunk store '{chemin}' : version de format {meta.get('version')} non supportée")
+        self.nombre = meta['nombre']
+        self.offsets = np.load(os.path.join(chemin, 'offsets.npy'), mmap_mode='r')
+        self.colonnes = []
+        for k, colonne in enumerate(meta['colonnes']):
+            tableau = np.load(os.path.join(chemin, f'col_{k}.npy'), mmap_mode='r')
+            self.colonnes.append((colonne['nom'], colonne['type'], tableau, colonne.get('valeurs')))
+        self._f_texte = open(os.path.join(chemin, 'texte.bin'), 'rb')
+        taille = os.fstat(self._f_texte.fileno()).st_size
+        # mmap refuse un fichier vide
+        self._texte = mmap.mmap(self._f_texte.fileno(), 0, access=mmap.ACCESS_READ) if taille else b''
+
+    def __len__(self):
+        return self.nombre
+
+    def texte(self, i):
+        debut, fin = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self._texte[debut:fin].decode('utf-8')
+
+    def textes(self, indices=None):
+        for i in (range(self.nombre) if indices is None else indices):
+            yield self.texte(i)
+
+    def valeur(self, i, nom):
+        for nom_colonne, type_colonne, tableau, valeurs in self.colonnes:
+            if nom_colonne == nom:
+                return self._decoder(type_colonne, tableau[i], valeurs)
+        return None
+
+    def colonne(self, nom):
+        """
+        Valeurs décodées d'une colonne de métadonnées pour tous les morceaux.
+        """
+        for nom_colonne, type_colonne, tableau, valeurs in self.colonnes:
+            if nom_colonne == nom:
+                return [self._decoder(type_colonne, v, valeurs) for v in tableau]
+        return [None] * self.nombre
+
+    def indices(self, nom, predicat):
+        """
+        Numéros des morceaux dont la métadonnée 'nom' vérifie le prédicat ; pour une colonne de chaînes
+        le prédicat n'est évalué qu'une fois par valeur distincte.
+        """
+        for nom_colonne, type_colonne, tableau, valeurs in self.colonnes:
+            if nom_colonne == nom:
+                if type_colonne in ('str', 'json'):
+                    codes = [code for code, valeur in enumerate(valeurs)
+                             if predicat(json.loads(valeur) if type_colonne == 'json' else valeur)]
+                    return np.flatnonzero(np.isin(tableau, codes)).astype(np.int64)
+                return np.array([i for i, valeur in enumerate(tableau)
+                                 if predicat(self._decoder(type_colonne, valeur, valeurs))], dtype=np.int64)
+        return np.empty(0, dtype=np.int64)
+
+    def valeurs_distinctes(self, nom):
+        """
+        Valeurs distinctes d'une colonne de chaînes, dans l'ordre de première apparition.
+        """
+        for nom_colonne, type_colonne, _, valeurs in self.colonnes:
+            if nom_colonne == nom and type_colonne == 'str':
+                return list(valeurs)
+        return []
+
+    @staticmethod
+    def _decoder(type_colonne, valeur, valeurs):
+        if type_colonne == 'int':
+            return None if valeur == _ENTIER_ABSENT else int(valeur)
+        if type_colonne == 'float':
+            return None if np.isnan(valeur) else float(valeur)
+        if valeur == _CODE_ABSENT:
+            return None
+        valeur = valeurs[int(valeur)]
+        return json.loads(valeur) if type_colonne == 'json' else valeur
+
+    def metadata(self, i):
+        metadata = {}
+        for nom, type_colonne, tableau, valeurs in self.colonnes:
+            valeur = self._decoder(type_colonne, tableau[i], valeurs)
+            if valeur is not None:
+                metadata[nom] = valeur
+        return metadata
+
+    def document(self, i):
+        from langchain_core.documents import Document
+        # identifiant du document : numéro du morceau (position de son vecteur dans l'index)
+        return Document(id=str(i), page_content=self.texte(i), metadata=self.metadata(i))
+
+    def documents(self, indices=None):
+        for i in (range(self.nombre) if indices is None else indices):
+            yield self.document(i)
+
+    def close(self):
+        if isinstance(self._texte, mmap.mmap):
+            self._texte.close()
+        self._f_texte.close()
@@ -0,0 +1,167 @@
+# Fichier : context_budget.py
+#
+# Assemblage du contexte envoyé au LLM, entre la recherche et le prompt de la chaîne "stuff".
+# Les morceaux de E02 se chevauchent (chunk_overlap) : deux morceaux voisins trouvés ensemble
+# répètent jusqu'à chunk_overlap caractères. L'assembleur :
+#   - supprime les morceaux en double (même texte)
+#   - fusionne les morceaux consécutifs d'une même section (numéros qui se suivent dans le chunk
+#     store de E02 : métadonnée 'morceau' si les quasi-doublons ont été retirés, voir
+#     near_duplicates.py) en un seul passage, sans répéter leur chevauchement
+#   - garde les passages dans l'ordre de pertinence du meilleur de leurs morceaux, jusqu'au
+#     budget de tokens du modèle (llm_context_budget) ; le dernier passage est tronqué si besoin
+# Sur CPU, les tokens du prompt sont l'essentiel du coût d'une réponse.
+
+from config import logger
+from ollama_client import CARACTERES_PAR_TOKEN
+
+# un passage tronqué garde au moins ce nombre de caractères, sinon il est abandonné
+MIN_CARACTERES_PASSAGE = 200
+# chevauchement minimal reconnu entre deux morceaux consécutifs (en dessous : coïncidence)
+MIN_CHEVAUCHEMENT = 10
+
+
+# =============================================================================
+# _chevauchement
+# =============================================================================
+def _chevauchement(precedent, suivant):
+    """
+    Longueur du plus long suffixe de precedent qui est aussi un préfixe de suivant (0 si moins de
+    MIN_CHEVAUCHEMENT caractères).
+    """
+    for longueur in range(min(len(precedent), len(suivant)), MIN_CHEVAUCHEMENT - 1, -1):
+        if precedent.endswith(suivant[:longueur]):
+            return longueur
+    return 0
+
+
+# =============================================================================
+# _numero
+# =============================================================================
+def _numero(document):
+    try:
+        return int(document.id)
+    except (TypeError, ValueError):
+        return None
+
+
+# =============================================================================
+# _position
+# =============================================================================
+def _position(document):
+    """
+    Position du morceau dans le texte : son numéro dans le chunk store de E02 (les morceaux gardés par
+    le retrait des quasi-doublons sont renumérotés), sinon son numéro dans l'index.
+    """
+    position = document.metadata.get('morceau')
+    return int(position) if position is not None else _numero(document)
+
+
+# =============================================================================
+# _tronquer
+# =============================================================================
+def _tronquer(texte, nb_caracteres):
+    """
+    Début du texte d'au plus nb_caracteres, coupé si possible à la fin d'une phrase ou d'un mot.
+    """
+    if len(texte) <= nb_caracteres:
+        return texte
+    debut = texte[:nb_caracteres]
+    for separateurs in ('.!?\n', ' '):
+        coupure = max(debut.rfind(s) for s in separateurs)
+        if coupure >= nb_caracteres // 2:
+            return debut[:coupure + 1].rstrip()
+    return debut
+
+
+# =============================================================================
+# AssembleurContexte
+# =============================================================================
+class AssembleurContexte:
+    """
+    Passages de contexte à partir des morceaux trouvés, dans la limite d'un budget de tokens (0 : sans limite).
+    """
+
+    def __init__(self, budget_tokens=0, fusion=True):
+        self.budget_tokens = max(0, int(budget_tokens))
+        self.fusion = fusion
+
+    def assembler(self, documents):
+        """
+        Documents LangChain des passages (métadonnée 'morceaux' : numéros des morceaux de chaque passage).
+        """
+        from langchain_core.documents import Document
+
+        # morceaux en double : le premier (le plus pertinent) est gardé
+        vus = set()
+        morceaux = []
+        for rang, document in enumerate(documents):
+            cle = ' '.join(document.page_content.split())
+            if cle and cle not in vus:
+                vus.add(cle)
+                morceaux.append((rang, document))
+
+        # passages : morceaux voisins dans le texte d'une même section, dans l'ordre du texte
+        passages = []
+        for rang, document in sorted(morceaux, key=lambda m: (_position(m[1]) is None, _position(m[1]) or 0, m[0])):
+            numero = _numero(document)
+            position = _position(document)
+            dernier = passages[-1] if passages else None
+            if (self.fusion and dernier is not None and position is not None and dernier['fin'] is not None
+                    and position == dernier['fin'] + 1
+                    and document.metadata.get('section') == dernier['metadata'].get('section')):
+                texte = document.page_content
+                recouvrement = _chevauchement(dernier['texte'], texte)
+                dernier['texte'] += texte[recouvrement:] if recouvrement else '\n' + texte
+                dernier['fin'] = position
+                dernier['rang'] = min(dernier['rang'], rang)
+                if numero is not None:
+                    dernier['morceaux'].append(numero)
+            else:
+                passages.append({'texte': document.page_content, 'fin': position, 'rang': rang,
+                                 'metadata': dict(document.metadata),
+                                 'morceaux': [numero] if numero is not None else []})
+        passages.sort(key=lambda p: p['rang'])
+
+        # budget de tokens : passages les plus pertinents d'abord
+        reste = self.budget_tokens * CARACTERES_PAR_TOKEN if self.budget_tokens else None
+        resultat = []
+        for passage in passages:
+            texte = passage['texte']
+            if reste is not None:
+                if len(texte) > reste:
+                    if reste < MIN_CARACTERES_PASSAGE:
+                        break
+                    texte = _tronquer(texte, reste)
+                reste -= len(texte)
+            resultat.append(Document(id=str(passage['morceaux'][0]) if passage['morceaux'] else None,
+                                     page_content=texte,
+                                     metadata={**passage['metadata'], 'morceaux': passage['morceaux']}))
+        logger.debug(f"contexte : {len(documents)} morceaux -> {len(resultat)} passages, "
+                     f"{sum(len(d.page_content) for d in documents)} -> "
+                     f"{sum(len(d.page_content) for d in resultat)} caractères")
+        return resultat
+
+
+# =============================================================================
+# budget_modele
+# =============================================================================
+def budget_modele(app_config, model_name):
+    """
+    Budget de tokens du contexte pour le modèle (llm_context_budget : par nom de modèle, avec ou sans tag,
+    sinon 'default').
+    """
+    budgets = app_config.get('llm_context_budget') or {}
+    if not isinstance(budgets, dict):
+        return int(budgets)
+    for nom in (model_name, model_name.split(':')[0]):
+        if nom in budgets:
+            return int(budgets[nom])
+    return int(budgets.get('default', 0))
+
+
+# =============================================================================
+# creer_assembleur
+# =============================================================================
+def creer_assembleur(app_config, model_name):
+    return AssembleurContexte(budget_modele(app_config, model_name),
+                              fusion=bool(app_config.get('context_merge', True)))
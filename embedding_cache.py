@@ -0,0 +1,145 @@
+# Fichier : embedding_cache.py
+#
+# Cache persistant des embeddings des morceaux (chunks).
+# La clé d'un morceau est l'empreinte SHA-256 du nom du modèle et de son texte normalisé
+# (Unicode NFC, blancs consécutifs réduits à un espace) : après une petite modification des
+# règles de nettoyage, seuls les morceaux nouveaux ou modifiés sont ré-encodés.
+# Un répertoire par modèle dans <data_dir>/embedding_cache contient :
+#   - meta.json    : nom du modèle et dimension des vecteurs
+#   - cles.bin     : les clés (32 octets chacune), dans l'ordre des vecteurs
+#   - vecteurs.f32 : les vecteurs float32 à la suite, projetés en mémoire (numpy.memmap)
+# Les deux fichiers ne font que grandir (ajout en fin de fichier).
+
+import os
+import re
+import json
+import hashlib
+import unicodedata
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from config import logger
+
+TAILLE_CLE = 32
+
+
+# =============================================================================
+# normaliser_texte
+# =============================================================================
+def normaliser_texte(texte):
+    return unicodedata.normalize('NFC', ' '.join(texte.split()))
+
+
+# =============================================================================
+# CacheEmbeddings
+# =============================================================================
+class CacheEmbeddings:
+    """
+    Cache disque des vecteurs d'un modèle d'embedding.
+    """
+
+    def __init__(self, cache_dir, model_name):
+        self.model_name = model_name
+        nom = re.sub(r'[^A-Za-z0-9._-]+', '_', model_name)
+        self.chemin = os.path.join(cache_dir, f"{nom}-{hashlib.sha256(model_name.encode('utf-8')).hexdigest()[:8]}")
+        self.chemin_cles = os.path.join(self.chemin, 'cles.bin')
+        self.chemin_vecteurs = os.path.join(self.chemin, 'vecteurs.f32')
+        self.hits = 0
+        self.misses = 0
+        self.dim = None
+        self.index = {}
+        self.vecteurs = None
+        os.makedirs(self.chemin, exist_ok=True)
+        self._ouvrir()
+
+    def _ouvrir(self):
+        chemin_meta = os.path.join(self.chemin, 'meta.json')
+        if os.path.exists(chemin_meta):
+            with open(chemin_meta, 'r', encoding='utf-8') as f:
+                self.dim = json.load(f)['dim']
+        if self.dim is None or not os.path.exists(self.chemin_cles) or not os.path.exists(self.chemin_vecteurs):
+            self.index = {}
+            self.vecteurs = None
+            return
+        with open(self.chemin_cles, 'rb') as f:
+            cles = f.read()
+        nombre = min(len(cles) // TAILLE_CLE, os.path.getsize(self.chemin_vecteurs) // (4 * self.dim))
+        # un ajout interrompu peut laisser un fichier plus long que l'autre : on revient au dernier état cohérent
+        if os.path.getsize(self.chemin_cles) != nombre * TAILLE_CLE:
+            os.truncate(self.chemin_cles, nombre * TAILLE_CLE)
+        if os.path.getsize(self.chemin_vecteurs) != nombre * 4 * self.dim:
+            os.truncate(self.chemin_vecteurs, nombre * 4 * self.dim)
+        self.index = {cles[i * TAILLE_CLE:(i + 1) * TAILLE_CLE]: i for i in range(nombre)}
+        self.vecteurs = np.memmap(self.chemin_vecteurs, dtype=np.float32, mode='r',
+                                  shape=(nombre, self.dim)) if nombre else None
+
+    def __len__(self):
+        return len(self.index)
+
+    def cle(self, texte):
+        h = hashlib.sha256(self.model_name.encode('utf-8'))
+        h.update(b'\0')
+        h.update(normaliser_texte(texte).encode('utf-8'))
+        return h.digest()
+
+    def ajouter(self, cles, vecteurs):
+        vecteurs = np.ascontiguousarray(vecteurs, dtype=np.float32)
+        if self.dim is None:
+            self.dim = int(vecteurs.shape[1])
+            with open(os.path.join(self.chemin, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump({'model_name': self.model_name, 'dim': self.dim}, f)
+        elif vecteurs.shape[1] != self.dim:
+            raise ValueError(f"cache d'embeddings '{self.chemin}' : dimension {vecteurs.shape[1]} au lieu de {self.dim}")
+        # vecteurs d'abord, clés ensuite : une clé n'existe jamais sans son vecteur
+        with open(self.chemin_vecteurs, 'ab') as f:
+            f.write(vecteurs.tobytes())
+        with open(self.chemin_cles, 'ab') as f:
+            f.write(b''.join(cles))
+        self._ouvrir()
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        taux = f" ({100 * self.hits / total:.1f} % de hits)" if total else ""
+        logger.info(f"cache des embeddings : {self.hits} morceaux servis depuis le cache, "
+                    f"{self.misses} morceaux encodés{taux}")
+
+
+# =============================================================================
+# EmbeddingsEnCache
+# =============================================================================
+class EmbeddingsEnCache(Embeddings):
+    """
+    Embeddings LangChain qui ne délèguent au modèle que les textes absents du cache.
+    Les requêtes (embed_query) ne sont pas mises en cache.
+    """
+
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_array(self, texts):
+        """
+        Vecteurs float32 (len(texts) x dim) dans l'ordre des textes.
+        """
+        cles = [self.cache.cle(texte) for texte in texts]
+        manquants = {}
+        for cle, texte in zip(cles, texts):
+            if cle in self.cache.index:
+                self.cache.hits += 1
+            else:
+                self.cache.misses += 1
+                manquants.setdefault(cle, texte)
+        if manquants:
+            # moteur d'embeddings (embed_array) ou modèle LangChain quelconque
+            encoder = getattr(self.embeddings, 'embed_array', None) or self.embeddings.embed_documents
+            self.cache.ajouter(list(manquants), np.asarray(encoder(list(manquants.values())), dtype=np.float32))
+        if not cles:
+            return np.empty((0, self.cache.dim or 0), dtype=np.float32)
+        return np.asarray(self.cache.vecteurs[[self.cache.index[cle] for cle in cles]])
+
+    def embed_documents(self, texts):
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
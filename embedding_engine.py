@@ -0,0 +1,281 @@
+# Fichier : embedding_engine.py
+#
+# Moteur d'embeddings pour la vectorisation en masse (E03, pipeline.py).
+# Les textes sont triés par longueur puis regroupés en lots de embedding_batch_size :
+# les textes d'un même lot ont des longueurs voisines, ce qui limite le remplissage
+# (padding) des séquences courtes. Les lots peuvent être répartis sur un pool de
+# processus, chacun chargeant une fois le modèle sentence-transformers et utilisant sa
+# part des coeurs. Le débit (morceaux/s) est mesuré sur l'ensemble de la session.
+# Les vecteurs sont ceux de HuggingFaceEmbeddings (mêmes textes, mêmes options d'encodage).
+#
+# Backends (embedding_backend dans cfg.yaml) :
+#   - torch     : modèle PyTorch fp32 (comme HuggingFaceEmbeddings)
+#   - onnx      : modèle exporté pour ONNX Runtime
+#   - onnx-int8 : modèle ONNX quantifié dynamiquement en int8 (poids), pour les CPU
+# Les backends onnx utilisent optimum[onnxruntime] (extra onnx de sentence-transformers, déclaré
+# dans pyproject.toml). Les exports sont faits une fois et gardés dans <data_dir>/onnx_models. verifier_backend
+# mesure le recouvrement des k premiers résultats de recherche par rapport au modèle fp32.
+
+import os
+import re
+import time
+import random
+import platform
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from config import logger
+
+BACKENDS = ['torch', 'onnx', 'onnx-int8']
+# modèle chargé dans chaque processus du pool
+_MODELE = None
+
+
+# =============================================================================
+# _quantification_cpu
+# =============================================================================
+def _quantification_cpu():
+    """
+    Configuration de quantification ONNX adaptée au processeur (jeu d'instructions disponible).
+    """
+    if platform.machine().lower() in ('arm64', 'aarch64'):
+        return 'arm64'
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            drapeaux = f.read()
+    except OSError:
+        return 'avx2'
+    if 'avx512_vnni' in drapeaux:
+        return 'avx512_vnni'
+    if 'avx512f' in drapeaux:
+        return 'avx512'
+    return 'avx2'
+
+
+# =============================================================================
+# preparer_modele
+# =============================================================================
+def preparer_modele(model_name, backend='torch', export_dir=None, quantification='auto'):
+    """
+    Retourne (nom ou chemin du modèle, arguments de SentenceTransformer) pour le backend ;
+    exporte le modèle ONNX (et sa version int8) dans export_dir s'il n'y est pas encore.
+    """
+    if backend == 'torch':
+        return model_name, {}
+    if backend not in BACKENDS:
+        raise ValueError(f"embedding_backend inconnu : '{backend}' (valeurs possibles : {BACKENDS})")
+    if export_dir is None:
+        raise ValueError(f"backend '{backend}' : répertoire des exports ONNX non défini")
+    chemin = os.path.join(export_dir, re.sub(r'[^A-Za-z0-9._-]+', '_', model_name))
+    if backend == 'onnx':
+        fichier = 'onnx/model.onnx'
+    else:
+        if quantification in (None, 'auto'):
+            quantification = _quantification_cpu()
+        fichier = f'onnx/model_qint8_{quantification}.onnx'
+    if not os.path.exists(os.path.join(chemin, fichier)):
+        from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+        logger.info(f"Export ONNX du modèle '{model_name}' dans '{chemin}'...")
+        modele = SentenceTransformer(model_name, backend='onnx')
+        modele.save_pretrained(chemin)
+        if backend == 'onnx-int8':
+            logger.info(f"Quantification int8 ({quantification}) du modèle '{model_name}'...")
+            export_dynamic_quantized_onnx_model(modele, quantification, chemin)
+    return chemin, {'backend': 'onnx', 'model_kwargs': {'file_name': fichier}}
+
+
+# =============================================================================
+# _charger_modele
+# =============================================================================
+def _charger_modele(model_name, model_kwargs=None):
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(model_name, **(model_kwargs or {}))
+
+
+# =============================================================================
+# _initialiser_worker
+# =============================================================================
+def _initialiser_worker(model_name, model_kwargs, nb_threads):
+    global _MODELE
+    import torch
+
+    # chaque processus n'utilise que sa part des coeurs
+    torch.set_num_threads(nb_threads)
+    _MODELE = _charger_modele(model_name, model_kwargs)
+
+
+# =============================================================================
+# _encoder_lot
+# =============================================================================
+def _encoder_lot(modele, textes, normalize=False):
+    return modele.encode(textes, batch_size=len(textes), convert_to_numpy=True,
+                         normalize_embeddings=normalize, show_progress_bar=False).astype(np.float32, copy=False)
+
+
+def _encoder_lot_worker(textes, normalize):
+    return _encoder_lot(_MODELE, textes, normalize)
+
+
+# =============================================================================
+# MoteurEmbeddings
+# =============================================================================
+class MoteurEmbeddings(Embeddings):
+    """
+    Embeddings LangChain (sentence-transformers) avec lots triés par longueur et pool de processus optionnel.
+    """
+
+    def __init__(self, model_name, batch_size=64, nb_workers=1, model_kwargs=None, normalize=False,
+                 backend='torch', export_dir=None, quantification='auto'):
+        self.model_name = model_name
+        self.backend = backend
+        self.export_dir = export_dir
+        self.quantification = quantification
+        # identifiant des vecteurs produits (cache des embeddings) : un backend quantifié donne d'autres vecteurs
+        self.identifiant = model_name if backend == 'torch' else f"{model_name}@{backend}"
+        self.chemin_modele = None
+        self.batch_size = max(1, int(batch_size))
+        self.nb_workers = nb_workers if nb_workers and nb_workers > 0 else (os.cpu_count() or 1)
+        self.model_kwargs = model_kwargs or {}
+        self.normalize = normalize
+        self._modele = None
+        self._pool = None
+        self.nb_textes = 0
+        self.duree = 0.0
+
+    def _preparer(self):
+        if self.chemin_modele is None:
+            self.chemin_modele, kwargs = preparer_modele(self.model_name, self.backend, self.export_dir,
+                                                         self.quantification)
+            self.model_kwargs = {**kwargs, **self.model_kwargs}
+        return self.chemin_modele
+
+    @property
+    def modele(self):
+        if self._modele is None:
+            self._modele = _charger_modele(self._preparer(), self.model_kwargs)
+        return self._modele
+
+    def _pool_workers(self):
+        if self._pool is None:
+            self._preparer()
+            nb_threads = max(1, (os.cpu_count() or 1) // self.nb_workers)
+            logger.info(f"Embeddings sur {self.nb_workers} processus ({nb_threads} threads chacun)...")
+            # 'spawn' : pas de fork d'un processus où torch a déjà démarré ses threads
+            self._pool = ProcessPoolExecutor(max_workers=self.nb_workers,
+                                             mp_context=multiprocessing.get_context('spawn'),
+                                             initializer=_initialiser_worker,
+                                             initargs=(self.chemin_modele, self.model_kwargs, nb_threads))
+        return self._pool
+
+    def lots(self, textes):
+        """
+        Lots d'indices des textes, triés par longueur décroissante.
+        """
+        ordre = sorted(range(len(textes)), key=lambda i: len(textes[i]), reverse=True)
+        return [ordre[i:i + self.batch_size] for i in range(0, len(ordre), self.batch_size)]
+
+    def embed_array(self, textes):
+        """
+        Vecteurs float32 (len(textes) x dim) dans l'ordre des textes.
+        """
+        debut = time.perf_counter()
+        # comme HuggingFaceEmbeddings
+        textes = [texte.replace("\n", " ") for texte in textes]
+        lots = self.lots(textes)
+        if not lots:
+            return np.empty((0, 0), dtype=np.float32)
+        if self.nb_workers > 1 and len(lots) > 1:
+            pool = self._pool_workers()
+            resultats = pool.map(_encoder_lot_worker, [[textes[i] for i in lot] for lot in lots],
+                                 [self.normalize] * len(lots))
+        else:
+            resultats = (_encoder_lot(self.modele, [textes[i] for i in lot], self.normalize) for lot in lots)
+        vecteurs = None
+        for lot, resultat in zip(lots, resultats):
+            if vecteurs is None:
+                vecteurs = np.empty((len(textes), resultat.shape[1]), dtype=np.float32)
+            vecteurs[lot] = resultat
+        self.nb_textes += len(textes)
+        self.duree += time.perf_counter() - debut
+        return vecteurs
+
+    def embed_documents(self, texts):
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text):
+        return _encoder_lot(self.modele, [text.replace("\n", " ")], self.normalize)[0].tolist()
+
+    def log_stats(self):
+        if self.nb_textes:
+            logger.info(f"embeddings : {self.nb_textes} morceaux encodés en {self.duree:.1f} s "
+                        f"({self.nb_textes / max(self.duree, 1e-9):.1f} morceaux/s, backend {self.backend}, "
+                        f"lots de {self.batch_size}, {self.nb_workers} processus)")
+
+    def fermer(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+# =============================================================================
+# creer_moteur_embeddings
+# =============================================================================
+def creer_moteur_embeddings(app_config, model_name=None, backend=None):
+    """
+    Moteur d'embeddings de la configuration (modèle de la langue, backend, taille des lots, nombre de processus).
+    """
+    if model_name is None:
+        model_name = app_config['embeddings_' + app_config['language'] + '_model_name']
+    return MoteurEmbeddings(model_name,
+                            batch_size=int(app_config.get('embedding_batch_size', 64)),
+                            nb_workers=int(app_config.get('embedding_workers', 1)),
+                            backend=backend or app_config.get('embedding_backend', 'torch'),
+                            export_dir=os.path.join(app_config['data_dir'], 'onnx_models'),
+                            quantification=app_config.get('embedding_quantization', 'auto'))
+
+
+# =============================================================================
+# recouvrement_top_k
+# =============================================================================
+def recouvrement_top_k(corpus_ref, requetes_ref, corpus, requetes, k=4):
+    """
+    Proportion moyenne des k premiers résultats de référence retrouvés parmi les k premiers résultats
+    de l'autre modèle (recherche exacte L2, comme l'index FAISS à plat).
+    """
+    import faiss
+
+    resultats = []
+    for vecteurs, questions in ((corpus_ref, requetes_ref), (corpus, requetes)):
+        index = faiss.IndexFlatL2(vecteurs.shape[1])
+        index.add(np.ascontiguousarray(vecteurs, dtype=np.float32))
+        resultats.append(index.search(np.ascontiguousarray(questions, dtype=np.float32), k)[1])
+    communs = [len(set(ref) & set(autre)) / k for ref, autre in zip(*resultats)]
+    return float(np.mean(communs)) if communs else 1.0
+
+
+# =============================================================================
+# verifier_backend
+# =============================================================================
+def verifier_backend(app_config, moteur, textes, vecteurs, k=4, nb_requetes=50, cache_dir=None):
+    """
+    Compare la recherche avec le backend du moteur à celle du modèle fp32 (torch) sur le corpus :
+    les requêtes sont les débuts de morceaux tirés au hasard. Retourne (recouvrement, seuil, conforme).
+    """
+    seuil = float(app_config.get('embedding_backend_min_overlap', 0.9))
+    reference = creer_moteur_embeddings(app_config, moteur.model_name, backend='torch')
+    corpus_ref = reference
+    if cache_dir is not None:
+        from embedding_cache import CacheEmbeddings, EmbeddingsEnCache
+        corpus_ref = EmbeddingsEnCache(reference, CacheEmbeddings(cache_dir, reference.identifiant))
+    vecteurs_ref = corpus_ref.embed_array(textes)
+    echantillon = random.Random(0).sample(range(len(textes)), min(nb_requetes, len(textes)))
+    questions = [textes[i][:200] for i in echantillon]
+    recouvrement = recouvrement_top_k(vecteurs_ref, [reference.embed_query(q) for q in questions],
+                                      vecteurs, [moteur.embed_query(q) for q in questions], k)
+    reference.fermer()
+    return recouvrement, seuil, recouvrement >= seuil
@@ -0,0 +1,146 @@
+# Fichier : near_duplicates.py
+#
+# Élimination des morceaux quasi identiques entre le découpage (E02) et les embeddings (E03) :
+# le livre de règles se répète (chapitre RULES SUMMARY, entrées d'unités communes aux listes
+# d'armée). Un seul morceau de chaque groupe, le premier rencontré, est vectorisé et indexé ;
+# les emplacements des copies sont gardés dans sa métadonnée 'alias' (liste de {'morceau' :
+# numéro dans le chunk store de E02, 'section', 'start_index'}).
+# Les morceaux gardés sont renumérotés : leur métadonnée 'morceau' est leur numéro d'origine
+# (deux morceaux gardés consécutifs ne sont voisins dans le texte que si ces numéros se suivent).
+# Détection :
+#   - ensemble des "shingles" de chaque morceau : suites de dedup_shingle_size termes (bm25_index.termes)
+#   - signature MinHash de NB_PERMUTATIONS valeurs, découpée en NB_BANDES bandes (LSH) : seuls les
+#     morceaux partageant une bande avec un représentant lui sont comparés
+#   - un candidat est une copie si la similarité de Jaccard exacte de leurs ensembles atteint dedup_threshold
+
+import zlib
+
+import numpy as np
+
+from config import logger
+from bm25_index import termes
+
+NB_PERMUTATIONS = 128
+NB_BANDES = 16
+# premier de Mersenne 2^61 - 1 : les permutations sont (a * x + b) mod PREMIER
+PREMIER = (1 << 61) - 1
+GRAINE = 20240601
+
+
+# =============================================================================
+# shingles
+# =============================================================================
+def shingles(texte, taille=5):
+    """
+    Empreintes (crc32) distinctes et triées des suites de taille termes du texte ; un texte plus court
+    donne une seule suite.
+    """
+    mots = termes(texte)
+    if not mots:
+        return np.empty(0, dtype=np.uint64)
+    suites = (' '.join(mots[i:i + taille]) for i in range(max(1, len(mots) - taille + 1)))
+    return np.unique(np.fromiter((zlib.crc32(s.encode('utf-8')) for s in suites), dtype=np.uint64))
+
+
+# =============================================================================
+# jaccard
+# =============================================================================
+def jaccard(a, b):
+    if not len(a) or not len(b):
+        return 0.0
+    commun = len(np.intersect1d(a, b, assume_unique=True))
+    return commun / (len(a) + len(b) - commun)
+
+
+# =============================================================================
+# DedoublonneurMorceaux
+# =============================================================================
+class DedoublonneurMorceaux:
+    """
+    Filtre un flux de morceaux : les quasi-doublons d'un morceau déjà rencontré sont retirés et
+    ajoutés aux alias du représentant.
+    """
+
+    def __init__(self, seuil=0.95, taille_shingle=5):
+        self.seuil = float(seuil)
+        self.taille_shingle = max(1, int(taille_shingle))
+        generateur = np.random.default_rng(GRAINE)
+        # a < 2^32 et x < 2^32 : a * x + b tient dans un uint64
+        self.a = generateur.integers(1, 1 << 32, NB_PERMUTATIONS, dtype=np.uint64)
+        self.b = generateur.integers(0, 1 << 32, NB_PERMUTATIONS, dtype=np.uint64)
+        self.bandes = {}
+        self.ensembles = []
+        self.nb_morceaux = 0
+        self.nb_doublons = 0
+
+    def signature(self, ensemble):
+        """
+        Signature MinHash d'un ensemble de shingles non vide.
+        """
+        return ((self.a[:, None] * ensemble[None, :] + self.b[:, None]) % PREMIER).min(axis=1)
+
+    def _cles(self, signature):
+        lignes = NB_PERMUTATIONS // NB_BANDES
+        return [(bande, signature[bande * lignes:(bande + 1) * lignes].tobytes()) for bande in range(NB_BANDES)]
+
+    def representant(self, texte):
+        """
+        Numéro du représentant dont le texte est un quasi-doublon, sinon None (le texte devient un représentant).
+        """
+        ensemble = shingles(texte, self.taille_shingle)
+        if not len(ensemble):
+            # morceau sans aucun terme : toujours gardé
+            self.ensembles.append(ensemble)
+            return None
+        cles = self._cles(self.signature(ensemble))
+        candidats = {numero for cle in cles for numero in self.bandes.get(cle, ())}
+        meilleur, similarite = None, self.seuil
+        for numero in sorted(candidats):
+            valeur = jaccard(ensemble, self.ensembles[numero])
+            if valeur >= similarite:
+                meilleur, similarite = numero, valeur
+        if meilleur is not None:
+            return meilleur
+        numero = len(self.ensembles)
+        self.ensembles.append(ensemble)
+        for cle in cles:
+            self.bandes.setdefault(cle, []).append(numero)
+        return None
+
+    def filtrer(self, docs):
+        """
+        Générateur des morceaux représentants (Documents LangChain). La métadonnée 'alias' d'un représentant
+        est complétée sur place quand ses copies arrivent : elle n'est complète qu'à la fin du flux
+        (EcrivainChunkStore n'écrit les métadonnées qu'à la fermeture).
+        """
+        representants = []
+        for numero, doc in enumerate(docs):
+            self.nb_morceaux += 1
+            original = self.representant(doc.page_content)
+            if original is None:
+                doc.metadata['morceau'] = numero
+                representants.append(doc)
+                yield doc
+                continue
+            self.nb_doublons += 1
+            alias = {'morceau': numero}
+            alias.update({cle: doc.metadata[cle] for cle in ('section', 'start_index') if cle in doc.metadata})
+            representants[original].metadata.setdefault('alias', []).append(alias)
+
+    def log_stats(self):
+        taux = self.nb_doublons / self.nb_morceaux if self.nb_morceaux else 0.0
+        logger.info(f"quasi-doublons : {self.nb_doublons} morceaux sur {self.nb_morceaux} ({taux:.1%}) "
+                    f"remplacés par un alias, {self.nb_morceaux - self.nb_doublons} morceaux à vectoriser")
+
+
+# =============================================================================
+# creer_dedoublonneur
+# =============================================================================
+def creer_dedoublonneur(app_config):
+    """
+    Dédoublonneur de la configuration, ou None si dedup_chunks est désactivé.
+    """
+    if not app_config.get('dedup_chunks', True):
+        return None
+    return DedoublonneurMorceaux(seuil=float(app_config.get('dedup_threshold', 0.95)),
+                                taille_shingle=int(app_config.get('dedup_shingle_size', 5)))
@@ -0,0 +1,483 @@
+# Fichier : nettoyage.py
+#
+# Moteurs de nettoyage du texte extrait des PDF.
+# Les règles (bruit, titres) sont lues depuis des packs YAML (config/rules, un pack par
+# livre ou par édition) et compilées une seule fois, et le texte est traité
+# en un seul passage, ligne par ligne, avec une mémoire bornée : le résultat est
+# identique octet pour octet à celui des anciennes fonctions format_text_to_markdown
+# et nettoyage_raw_text de E01, qui appliquaient chaque expression régulière au texte entier.
+# Chaque moteur compte les occurrences et le temps passé par règle.
+
+import io
+import os
+import re
+import time
+
+import yaml
+
+from config import bcolors, logger
+
+# Répertoire des packs de règles (un fichier YAML par livre de règles ou par édition)
+RULES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config', 'rules')
+# Packs utilisés quand aucun n'est précisé
+PACKS_PAR_DEFAUT = ['bolt_action_v3_layout', 'bolt_action_v3_en']
+
+# Suppression des identifiants de source
+MOTIF_IDENTIFIANT_SOURCE = r'\+\]'
+
+# Nettoyage final de format_text_to_markdown (espacement et cohérence), dans cet ordre
+MOTIFS_FINAUX = [
+    # Remplacement des espaces multiples par un seul
+    ('espaces', r'[ \t]+', ' '),
+    # Remplacement des espaces multiples autour des titres (s'assure qu'ils sont bien centrés/isolés)
+    ('avant_titre_2', r'\n\s*## ', '\n## '),
+    ('apres_titre_2', r' ##\s*\n', ' ##\n'),
+    ('avant_titre_3', r'\n\s*### ', '\n### '),
+    ('apres_titre_3', r' ###\s*\n', ' ###\n'),
+    # Nettoyage des lignes vides inutiles
+    ('lignes_vides', r'\n\n\n+', '\n\n'),
+]
+
+# Liste des ponctuations qui marquent une fin de phrase ou d'idée
+PONCTUATION_FIN_DE_LIGNE = ('.', '!', '?', ':', ')', ']', '"')
+
+_RE_CHIFFRE = re.compile(r'\d')
+
+# références arrière numérotées (\1, (?(1)...)) : décalées par les groupes de l'alternative
+_RE_REFERENCE_NUMEROTEE = re.compile(r'(?<!\\)(?:\\\\)*\\[1-9]|\(\?\(\d')
+
+
+# =============================================================================
+# PackRegles
+# =============================================================================
+class PackRegles:
+    """
+    Règles de nettoyage fusionnées depuis un ou plusieurs packs YAML (voir config/rules).
+    Les titres sont rangés dans une table de hachage titre -> ligne Markdown, et chaque
+    famille de motifs "par ligne" est compilée en une seule expression régulière :
+    le coût de la classification d'une ligne ne croît pas avec le nombre de livres chargés.
+    """
+
+    def __init__(self):
+        self.noms = []
+        self.bruit_texte = []  # [(nom, motif)], appliqués dans l'ordre
+        self.metadonnees = []  # [(nom, motif)]
+        self.lignes_bruit = set()
+        self.bruit_ligne = []  # [(nom, motif)]
+        self.titres_majeurs = {}
+        self.titres_armees = {}
+
+    def ajouter(self, pack):
+        nom_pack = pack.get('name', f'pack{len(self.noms)}')
+        self.noms.append(nom_pack)
+        for famille, regles in (('text_noise', self.bruit_texte), ('metadata_lines', self.metadonnees),
+                                ('line_noise', self.bruit_ligne)):
+            for regle in pack.get(famille) or []:
+                regles.append((f"{nom_pack}:{regle['name']}", regle['pattern']))
+        self.lignes_bruit.update(pack.get('noise_lines') or [])
+        for titre in pack.get('major_titles') or []:
+            self.titres_majeurs[titre] = f'\n## {titre}\n'
+        format_armee = pack.get('army_title_format', '{title}')
+        for titre in pack.get('army_titles') or []:
+            self.titres_armees[titre] = f'\n## {format_armee.format(title=titre)}\n'
+
+    def table_titres(self):
+        """
+        titre -> (ligne Markdown, règle) ; un titre majeur l'emporte sur un titre d'armée.
+        """
+        titres = {titre: (markdown, 'titre_armee') for titre, markdown in self.titres_armees.items()}
+        titres.update({titre: (markdown, 'titre_majeur') for titre, markdown in self.titres_majeurs.items()})
+        return titres
+
+
+# =============================================================================
+# charger_packs
+# =============================================================================
+def charger_packs(noms=None, rules_dir=None):
+    """
+    Charge et fusionne les packs de règles, dans l'ordre donné.
+    """
+    if noms is None:
+        noms = PACKS_PAR_DEFAUT
+    if rules_dir is None:
+        rules_dir = RULES_DIR
+    regles = PackRegles()
+    for nom in noms:
+        chemin = nom if nom.endswith('.yaml') else os.path.join(rules_dir, nom + '.yaml')
+        with open(chemin, 'r', encoding='utf-8') as f:
+            pack = yaml.safe_load(f)
+        if pack is None:
+            logger.warning(f"pack de règles vide : '{chemin}'")
+            continue
+        regles.ajouter(pack)
+    logger.debug(f"packs de règles chargés : {', '.join(regles.noms)}")
+    return regles
+
+
+# =============================================================================
+# _alternative
+# =============================================================================
+def _alternative(regles, flags=0):
+    """
+    Compile une liste [(nom, motif)] en une seule alternative à groupes nommés ;
+    retourne (expression compilée ou None, groupe -> nom de règle).
+    Chaque motif est entouré d'un groupe (?P<rN>...) : les références arrière numérotées
+    désigneraient un autre groupe et sont refusées (utiliser (?P<nom>...) et (?P=nom)).
+    """
+    if not regles:
+        return None, {}
+    for nom, motif in regles:
+        if _RE_REFERENCE_NUMEROTEE.search(motif):
+            raise ValueError(f"règle '{nom}' : référence arrière numérotée non supportée dans '{motif}', "
+                             f"utiliser un groupe nommé (?P<nom>...) et (?P=nom)")
+    groupes = {f'r{i}': nom for i, (nom, _) in enumerate(regles)}
+    motif = '|'.join(f'(?P<r{i}>{motif})' for i, (_, motif) in enumerate(regles))
+    return re.compile(motif, flags), groupes
+
+
+# =============================================================================
+# StatsRegles
+# =============================================================================
+class StatsRegles:
+    """
+    Nombre d'occurrences et temps cumulé par règle.
+    """
+
+    def __init__(self):
+        self.hits = {}
+        self.durees = {}
+
+    def ajouter(self, regle, hits, duree):
+        self.hits[regle] = self.hits.get(regle, 0) + hits
+        self.durees[regle] = self.durees.get(regle, 0.0) + duree
+
+    def log(self, titre):
+        logger.info(f"{titre} : statistiques par règle (triées par temps passé)")
+        for regle in sorted(self.durees, key=self.durees.get, reverse=True):
+            logger.info(f"  {regle:<25} {self.hits[regle]:>8} occurrences {self.durees[regle] * 1000:>10.2f} ms")
+
+
+# =============================================================================
+# _lignes
+# =============================================================================
+def _lignes(source):
+    """
+    Générateur des lignes (sans le '\n' final) d'un texte ou d'un fichier ouvert,
+    équivalent à texte.split('\n') mais sans charger tout le texte.
+    """
+    if isinstance(source, str):
+        source = io.StringIO(source)
+    ligne = ''
+    for ligne in source:
+        if ligne.endswith('\n'):
+            yield ligne[:-1]
+        else:
+            yield ligne
+            return
+    # le texte est vide ou se termine par '\n' : split() rend une dernière ligne vide
+    yield ''
+
+
+# =============================================================================
+# MoteurMarkdown
+# =============================================================================
+class MoteurMarkdown:
+    """
+    Nettoie le texte PDF, supprime le bruit et applique un formatage Markdown
+    (moteur de format_text_to_markdown).
+
+    Le texte est découpé en segments d'environ lignes_par_segment lignes. Un segment
+    n'est coupé que sur une ligne "frontière" : une ligne de texte ordinaire qu'aucune
+    règle ne peut modifier ni enjamber. Cette ligne est partagée par les deux segments
+    voisins, ce qui donne à chaque segment le même contexte que dans le texte entier :
+    le résultat de la concaténation est exactement celui du traitement en un bloc.
+    """
+
+    def __init__(self, regles=None, lignes_par_segment=1000):
+        if regles is None:
+            regles = charger_packs()
+        # lignes_par_segment = 0 : tout le texte en un seul segment
+        self.lignes_par_segment = lignes_par_segment or float('inf')
+        self.re_identifiant = re.compile(MOTIF_IDENTIFIANT_SOURCE)
+        self.regles_bruit = [(nom, re.compile(motif, re.MULTILINE | re.IGNORECASE))
+                             for nom, motif in regles.bruit_texte]
+        # sonde pour les lignes frontières : tous les motifs de bruit, et leurs mots d'au moins 3 lettres
+        self.re_bruit_sonde, _ = _alternative(regles.bruit_texte, re.MULTILINE | re.IGNORECASE)
+        mots = {mot.lower() for _, motif in regles.bruit_texte
+                for mot in re.findall(r'[^\W\d_]{3,}', re.sub(r'\\.', ' ', motif))}
+        self.re_mots_bruit = re.compile('|'.join(sorted(map(re.escape, mots))), re.IGNORECASE) if mots else None
+        # une seule table de hachage titre -> ligne Markdown, au lieu de parcourir les listes
+        self.titres = regles.table_titres()
+        self.re_sauts_de_ligne = re.compile(r'\n{2,}')
+        self.regles_finales = [(nom, re.compile(motif), remplacement) for nom, motif, remplacement in MOTIFS_FINAUX]
+        self.stats = StatsRegles()
+
+    # -------------------------------------------------------------------------
+    def _classer(self, line):
+        """
+        Détection et conversion d'une ligne en titre Markdown ; retourne (ligne, règle ou None).
+        """
+        stripped_line = line.strip()
+
+        if not stripped_line:
+            return line, None
+
+        # Titres de Niveau 1 ou 2 (Gros blocs)
+        titre = self.titres.get(stripped_line)
+        if titre is not None:
+            return titre
+
+        # Titres de Niveau 3 (Sous-sections, souvent Capitales au début de l'extrait)
+        # Ex: FALL WEISS – THE INVASION OF POLAND, SEPTEMBER 1939
+        if stripped_line.isupper() and len(stripped_line) < 70 and not stripped_line.isdigit():
+            # Vérifie si la ligne contient plus de 3 mots, sinon c'est potentiellement un bruit ou un titre très court
+            if len(stripped_line.split()) > 3:
+                return f'\n### {stripped_line}\n', 'titre_section'
+
+        # Lignes normales
+        return line, None
+
+    # -------------------------------------------------------------------------
+    def _est_frontiere(self, line):
+        """
+        Une ligne frontière commence par une lettre, ne contient aucun chiffre ni aucun mot des
+        motifs de bruit, ne se termine ni par un blanc ni par '#' et n'est pas un titre :
+        aucun motif de bruit ni de nettoyage final ne peut la toucher ni la franchir.
+        """
+        if not line or not line[0].isalpha():
+            return False
+        dernier = line[-1]
+        if dernier.isspace() or dernier == '#' or _RE_CHIFFRE.search(line):
+            return False
+        if self.re_mots_bruit is not None and self.re_mots_bruit.search(line):
+            return False
+        if self.re_bruit_sonde is not None and self.re_bruit_sonde.search('\n' + line + '\n'):
+            return False
+        return self._classer(line)[1] is None
+
+    # -------------------------------------------------------------------------
+    def _traiter_segment(self, lines):
+        stats = self.stats
+        text = '\n'.join(lines)
+
+        # 1. NETTOYAGE PRÉLIMINAIRE ET SUPPRESSION DU BRUIT CONNU
+        for nom, regle in self.regles_bruit:
+            debut = time.perf_counter()
+            text, hits = regle.subn('\n', text)
+            stats.ajouter(nom, hits, time.perf_counter() - debut)
+
+        # 2. RECONSTRUCTION DE LA STRUCTURE EN MARKDOWN (Titres)
+        debut = time.perf_counter()
+        markdown_lines = []
+        nb_titres = 0
+        for line in text.split('\n'):
+            line, regle = self._classer(line)
+            if regle is not None:
+                nb_titres += 1
+            markdown_lines.append(line)
+        text = '\n'.join(markdown_lines)
+        stats.ajouter('titres', nb_titres, time.perf_counter() - debut)
+
+        # 3. NETTOYAGE FINAL (Espacement et cohérence)
+        # Remplacement des sauts de ligne multiples (après application des titres)
+        # (strip() n'a d'effet qu'au début et à la fin du texte : un segment intermédiaire
+        # commence et se termine par une ligne frontière)
+        debut = time.perf_counter()
+        text, hits = self.re_sauts_de_ligne.subn('\n\n', text)
+        text = text.strip()
+        stats.ajouter('sauts_de_ligne', hits, time.perf_counter() - debut)
+        for nom, regle, remplacement in self.regles_finales:
+            debut = time.perf_counter()
+            text, hits = regle.subn(remplacement, text)
+            stats.ajouter(nom, hits, time.perf_counter() - debut)
+        return text
+
+    # -------------------------------------------------------------------------
+    def formater_lignes(self, source):
+        """
+        Générateur des morceaux du texte formaté, à partir d'un texte ou d'un fichier ouvert.
+        """
+        segment = []
+        prefixe = None  # sortie de la ligne frontière partagée avec le segment précédent
+        for line in _lignes(source):
+            # Suppression des identifiants de source (spécifiques à votre input)
+            debut = time.perf_counter()
+            line, hits = self.re_identifiant.subn('', line)
+            self.stats.ajouter('identifiant_source', hits, time.perf_counter() - debut)
+            if len(segment) >= self.lignes_par_segment and self._est_frontiere(line):
+                segment.append(line)
+                sortie = self._traiter_segment(segment)
+                yield sortie if prefixe is None else sortie[len(prefixe):]
+                prefixe = self.regles_finales[0][1].sub(' ', line)
+                segment = [line]
+            else:
+                segment.append(line)
+        sortie = self._traiter_segment(segment)
+        yield sortie if prefixe is None else sortie[len(prefixe):]
+
+    # -------------------------------------------------------------------------
+    def formater(self, raw_text):
+        return ''.join(self.formater_lignes(raw_text))
+
+
+# =============================================================================
+# MoteurNettoyage
+# =============================================================================
+class MoteurNettoyage:
+    """
+    Répare le texte brut ligne par ligne : césures, bruits, titres, paragraphes coupés
+    (moteur de nettoyage_raw_text).
+    """
+
+    def __init__(self, regles=None, taille_morceau=1 << 16):
+        if regles is None:
+            regles = charger_packs()
+        self.taille_morceau = taille_morceau
+        # une seule expression par famille de motifs : le groupe nommé indique la règle reconnue
+        self.re_metadonnees, self.noms_metadonnees = _alternative(regles.metadonnees, re.MULTILINE)
+        self.lignes_bruit = frozenset(regles.lignes_bruit)
+        self.re_bruit_ligne, self.noms_bruit_ligne = _alternative(regles.bruit_ligne)
+        self.re_lignes_vides = re.compile(r'\n\s*\n+')
+        self.stats = StatsRegles()
+
+    # -------------------------------------------------------------------------
+    def _supprimer_metadonnees(self, line):
+        if self.re_metadonnees is None:
+            return line
+        reconnues = []
+        debut = time.perf_counter()
+        line = self.re_metadonnees.sub(lambda m: reconnues.append(m.lastgroup) or '', line)
+        self.stats.ajouter('metadonnees', 0, time.perf_counter() - debut)
+        for groupe in reconnues:
+            self.stats.ajouter(self.noms_metadonnees[groupe], 1, 0.0)
+        return line
+
+    # -------------------------------------------------------------------------
+    def _lignes_logiques(self, source):
+        """
+        Applique les règles 1 et 2 : suppression des métadonnées InDesign, puis
+        recollage des mots coupés par une césure ('-' en fin de ligne).
+        """
+        stats = self.stats
+        cesure = []
+        lines = _lignes(source)
+        line = next(lines)
+        for line_suivante in lines:
+            # Règle 1 : Supprime les lignes de métadonnées d'exportation (InDesign)
+            line = self._supprimer_metadonnees(line)
+            # Règle 2 : Supprime les césures avec tiret pour recoller les mots
+            if line.endswith('-'):
+                stats.ajouter('cesure', 1, 0.0)
+                cesure.append(line[:-1])
+            else:
+                cesure.append(line)
+                yield ''.join(cesure)
+                cesure = []
+            line = line_suivante
+        # la dernière ligne n'est pas suivie d'un saut de ligne : pas de césure
+        cesure.append(self._supprimer_metadonnees(line))
+        yield ''.join(cesure)
+
+    # -------------------------------------------------------------------------
+    def _lignes_reparees(self, source):
+        """
+        Générateur des lignes réparées (règles 3 à 5) ; une ligne n'est rendue que lorsqu'elle
+        ne peut plus être complétée par la fusion d'une ligne suivante.
+        """
+        stats = self.stats
+        derniere = None
+        for line in self._lignes_logiques(source):
+            line = line.strip()
+            if not line:
+                continue
+
+            # Règle 3 : Supprime les bruits spécifiques restants sur chaque ligne
+            # (d'abord les lignes connues telles quelles, puis l'alternative de tous les motifs)
+            if line in self.lignes_bruit:
+                stats.ajouter('lignes_bruit', 1, 0.0)
+                continue
+            if self.re_bruit_ligne is not None:
+                debut = time.perf_counter()
+                bruit = self.re_bruit_ligne.match(line)
+                stats.ajouter('bruit_ligne', 0, time.perf_counter() - debut)
+                if bruit is not None:
+                    stats.ajouter(self.noms_bruit_ligne[bruit.lastgroup], 1, 0.0)
+                    continue
+
+            # Règle 4 : Formate les titres en majuscules
+            # Si une ligne est en majuscules et courte, on la traite comme un titre
+            if line.isupper() and len(line.split()) < 7 and not any(char.isdigit() for char in line):
+                stats.ajouter('titre', 1, 0.0)
+                if derniere is not None:
+                    yield derniere
+                derniere = f"\n## {line.title()}\n"
+                continue
+
+            # Règle 5 : Fusionne les lignes de paragraphes coupées (césures implicites)
+            if (derniere is not None and
+                    not derniere.strip().endswith(PONCTUATION_FIN_DE_LIGNE) and
+                    not derniere.strip().endswith('##') and
+                    line[0].islower()):
+                stats.ajouter('fusion', 1, 0.0)
+                derniere += ' ' + line
+            else:
+                if derniere is not None:
+                    yield derniere
+                derniere = line
+        if derniere is not None:
+            yield derniere
+
+    # -------------------------------------------------------------------------
+    def nettoyer_lignes(self, source):
+        """
+        Générateur des morceaux du texte nettoyé, à partir d'un texte ou d'un fichier ouvert.
+        """
+        # Règle 6 : Normalise les sauts de ligne pour une meilleure lisibilité.
+        # Le texte n'est coupé qu'après son dernier caractère non blanc : une suite de
+        # blancs n'est jamais partagée entre deux morceaux.
+        morceau = []
+        taille = 0
+        reste = ''
+        premiere = True
+        for line in self._lignes_reparees(source):
+            if not premiere:
+                morceau.append('\n')
+            premiere = False
+            morceau.append(line)
+            taille += len(line)
+            if taille >= self.taille_morceau:
+                texte = reste + ''.join(morceau)
+                fin = len(texte.rstrip())
+                yield self._normaliser_lignes_vides(texte[:fin])
+                reste = texte[fin:]
+                morceau = []
+                taille = 0
+        yield self._normaliser_lignes_vides(reste + ''.join(morceau))
+
+    def _normaliser_lignes_vides(self, texte):
+        debut = time.perf_counter()
+        texte, hits = self.re_lignes_vides.subn('\n\n', texte)
+        self.stats.ajouter('lignes_vides', hits, time.perf_counter() - debut)
+        return texte
+
+    # -------------------------------------------------------------------------
+    def nettoyer(self, texte):
+        return ''.join(self.nettoyer_lignes(texte))
+
+
+# =============================================================================
+# nettoyer_fichier
+# =============================================================================
+def nettoyer_fichier(moteur, input_txt_file, output_txt_file, encoding='utf-8'):
+    """
+    Nettoie un fichier texte en flux avec un moteur (MoteurMarkdown ou MoteurNettoyage)
+    et affiche les statistiques par règle.
+    """
+    traiter = moteur.formater_lignes if isinstance(moteur, MoteurMarkdown) else moteur.nettoyer_lignes
+    debut = time.perf_counter()
+    with open(input_txt_file, 'r', encoding=encoding) as f_in, open(output_txt_file, 'w', encoding=encoding) as f_out:
+        for morceau in traiter(f_in):
+            f_out.write(morceau)
+    logger.info(f"Nettoyage de '{bcolors.INPUT}{input_txt_file}{bcolors.ENDC}' "
+                f"en {time.perf_counter() - debut:.2f} s")
+    moteur.stats.log(type(moteur).__name__)
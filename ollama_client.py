@@ -0,0 +1,407 @@
+# Fichier : ollama_client.py
+#
+# Accès au serveur Ollama local.
+# Présence des modèles : au lieu d'un "ollama pull" à chaque lancement de E04 (bloquant,
+# et qui interroge le registre même quand le modèle est déjà installé), on consulte la
+# liste des modèles installés ("ollama list"). Le résultat positif est mémorisé dans
+# <data_dir>/ollama_models.json pendant ollama_presence_ttl secondes : dans ce délai,
+# aucun processus ollama n'est lancé. Le modèle n'est téléchargé que s'il est absent,
+# ou si le rafraîchissement est demandé (E04 --refresh-model). Un modèle supprimé d'Ollama
+# dans ce délai est signalé par l'API (HTTP 404, ModeleAbsent) : ChatOllamaPool appelle alors
+# son installer, qui efface l'entrée du cache et télécharge de nouveau le modèle, puis
+# renvoie la requête une fois.
+#
+# Client HTTP : ClientOllama garde un pool de connexions HTTP persistantes (keep-alive) vers
+# l'API Ollama, au lieu d'une nouvelle connexion par question. ChatOllamaPool est le modèle
+# de chat LangChain (utilisable par RetrievalQA) au-dessus de ce client :
+#   - keep_alive : durée pendant laquelle Ollama garde le modèle chargé après la dernière requête
+#   - rechauffer : requête sans prompt qui charge le modèle pendant le démarrage de E04, avec le
+#     palier de num_ctx d'un prompt du budget de contexte du modèle : la première question ne paie
+#     plus le chargement
+#   - num_ctx : fenêtre de contexte dimensionnée d'après la longueur du prompt, par paliers
+#     (num_ctx_min, 2 * num_ctx_min, ... num_ctx_max) : Ollama recharge le modèle quand num_ctx
+#     change, des paliers limitent ces rechargements.
+# En flux (llm.stream), les tokens sont transmis au fur et à mesure de leur génération.
+
+import os
+import json
+import time
+import queue
+import tempfile
+import subprocess
+import http.client
+from typing import Any, Optional, Union
+from urllib.parse import urlsplit
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from config import logger
+
+PRESENCE_FILE = 'ollama_models.json'
+# estimation du nombre de tokens d'un prompt : un token pour CARACTERES_PAR_TOKEN caractères (prudent)
+CARACTERES_PAR_TOKEN = 3
+# tokens réservés à la réponse dans la fenêtre de contexte quand num_predict n'est pas limité
+RESERVE_REPONSE = 512
+ROLES = {'human': 'user', 'ai': 'assistant', 'system': 'system', 'chat': 'user'}
+
+
+# =============================================================================
+# _nom_complet
+# =============================================================================
+def _nom_complet(nom_modele):
+    """
+    Nom du modèle avec son tag ('tinyllama' -> 'tinyllama:latest'), comme dans "ollama list".
+    """
+    return nom_modele if ':' in nom_modele else nom_modele + ':latest'
+
+
+# =============================================================================
+# modeles_installes
+# =============================================================================
+def modeles_installes(executable='ollama'):
+    """
+    Noms (avec tag) des modèles installés localement, d'après "ollama list".
+    """
+    resultat = subprocess.run([executable, "list"], capture_output=True, text=True, check=True)
+    lignes = resultat.stdout.splitlines()
+    # première ligne : en-tête NAME ID SIZE MODIFIED
+    return {_nom_complet(ligne.split()[0]) for ligne in lignes[1:] if ligne.strip()}
+
+
+# =============================================================================
+# CachePresenceModeles
+# =============================================================================
+class CachePresenceModeles:
+    """
+    Mémorisation, avec une durée de validité, des modèles dont la présence a été vérifiée.
+    """
+
+    def __init__(self, chemin, ttl=86400):
+        self.chemin = chemin
+        self.ttl = ttl
+        self.modeles = {}
+        if os.path.exists(chemin):
+            try:
+                with open(chemin, 'r', encoding='utf-8') as f:
+                    self.modeles = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"cache de présence des modèles '{chemin}' illisible : {e}")
+
+    def est_present(self, nom_modele):
+        date = self.modeles.get(_nom_complet(nom_modele))
+        return date is not None and time.time() - date < self.ttl
+
+    def enregistrer(self, nom_modele):
+        self.modeles[_nom_complet(nom_modele)] = time.time()
+        self._ecrire()
+
+    def oublier(self, nom_modele):
+        if self.modeles.pop(_nom_complet(nom_modele), None) is not None:
+            self._ecrire()
+
+    def _ecrire(self):
+        repertoire = os.path.dirname(self.chemin) or '.'
+        os.makedirs(repertoire, exist_ok=True)
+        fd, chemin_tmp = tempfile.mkstemp(dir=repertoire, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self.modeles, f, indent=2, sort_keys=True)
+        os.replace(chemin_tmp, self.chemin)
+
+
+# =============================================================================
+# assurer_modele
+# =============================================================================
+def assurer_modele(nom_modele, cache=None, refresh=False, executable='ollama'):
+    """
+    Vérifie que le modèle est installé dans Ollama et le télécharge s'il ne l'est pas
+    (ou si refresh est demandé) ; retourne True si le modèle est disponible.
+    """
+    if not refresh and cache is not None and cache.est_present(nom_modele):
+        logger.debug(f"modèle '{nom_modele}' présent (cache de présence)")
+        return True
+    try:
+        if not refresh and _nom_complet(nom_modele) in modeles_installes(executable):
+            logger.info(f"modèle '{nom_modele}' déjà installé dans Ollama")
+        else:
+            logger.info(f"téléchargement du modèle '{nom_modele}' (ollama pull)...")
+            debut = time.perf_counter()
+            subprocess.run([executable, "pull", nom_modele], capture_output=True, text=True, check=True)
+            logger.info(f"modèle '{nom_modele}' téléchargé en {time.perf_counter() - debut:.1f} s")
+    except subprocess.CalledProcessError as e:
+        # Gère le cas où la commande échoue (code de retour non nul)
+        logger.error(f"La commande '{' '.join(e.cmd)}' a échoué avec le code de retour {e.returncode}")
+        logger.error(f"Erreur (stderr) :\n{e.stderr}")
+        if cache is not None:
+            cache.oublier(nom_modele)
+        return False
+    except FileNotFoundError:
+        logger.error(f"L'exécutable '{executable}' n'a pas été trouvé.")
+        return False
+    if cache is not None:
+        cache.enregistrer(nom_modele)
+    return True
+
+
+# =============================================================================
+# ModeleAbsent
+# =============================================================================
+class ModeleAbsent(RuntimeError):
+    """
+    Modèle inconnu du serveur Ollama (HTTP 404 sur /api/chat ou /api/generate).
+    """
+
+
+# =============================================================================
+# ClientOllama
+# =============================================================================
+class ClientOllama:
+    """
+    Client de l'API HTTP d'Ollama avec un pool de connexions persistantes, utilisable par plusieurs threads.
+    """
+
+    def __init__(self, base_url='http://localhost:11434', taille_pool=4, timeout=300):
+        url = urlsplit(base_url)
+        self.classe = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self.hote = url.hostname or 'localhost'
+        self.port = url.port
+        self.timeout = timeout
+        self.connexions = queue.LifoQueue(maxsize=max(1, int(taille_pool)))
+
+    def _connexion(self):
+        try:
+            return self.connexions.get_nowait(), True
+        except queue.Empty:
+            return self.classe(self.hote, self.port, timeout=self.timeout), False
+
+    def _rendre(self, connexion):
+        try:
+            self.connexions.put_nowait(connexion)
+        except queue.Full:
+            connexion.close()
+
+    def _envoyer(self, chemin, corps):
+        """
+        Envoie la requête POST et retourne (connexion, réponse) ; une connexion du pool fermée entre-temps
+        par le serveur est remplacée par une nouvelle.
+        """
+        donnees = json.dumps(corps).encode('utf-8')
+        while True:
+            connexion, reutilisee = self._connexion()
+            try:
+                connexion.request('POST', chemin, body=donnees, headers={'Content-Type': 'application/json'})
+                reponse = connexion.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionError):
+                connexion.close()
+                if reutilisee:
+                    continue
+                raise
+            except Exception:
+                connexion.close()
+                raise
+            if reponse.status != 200:
+                message = reponse.read().decode('utf-8', errors='replace')
+                connexion.close()
+                classe = ModeleAbsent if reponse.status == 404 else RuntimeError
+                raise classe(f"Ollama {chemin} : HTTP {reponse.status} {message}")
+            return connexion, reponse
+
+    def requete(self, chemin, corps):
+        """
+        Requête POST JSON sur l'API (corps avec "stream": false) ; retourne la réponse décodée.
+        """
+        connexion, reponse = self._envoyer(chemin, corps)
+        try:
+            resultat = json.loads(reponse.read())
+        except Exception:
+            connexion.close()
+            raise
+        self._rendre(connexion)
+        return resultat
+
+    def flux(self, chemin, corps):
+        """
+        Requête POST JSON en flux (corps avec "stream": true) : génère les objets JSON reçus ligne à ligne.
+        """
+        connexion, reponse = self._envoyer(chemin, corps)
+        try:
+            for ligne in reponse:
+                if ligne.strip():
+                    yield json.loads(ligne)
+        except BaseException:
+            # flux interrompu (erreur, ou générateur abandonné) : la connexion n'est pas réutilisable
+            connexion.close()
+            raise
+        self._rendre(connexion)
+
+    def fermer(self):
+        while True:
+            try:
+                self.connexions.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+# =============================================================================
+# taille_contexte
+# =============================================================================
+def taille_contexte(nb_caracteres, num_predict=RESERVE_REPONSE, num_ctx_min=2048, num_ctx_max=8192):
+    """
+    Fenêtre de contexte (num_ctx) pour un prompt de nb_caracteres et une réponse de num_predict tokens :
+    le plus petit palier num_ctx_min * 2^i qui les contient, au plus num_ctx_max.
+    """
+    besoin = nb_caracteres // CARACTERES_PAR_TOKEN + 1 + num_predict
+    num_ctx = num_ctx_min
+    while num_ctx < besoin and num_ctx < num_ctx_max:
+        num_ctx *= 2
+    return min(num_ctx, num_ctx_max)
+
+
+# =============================================================================
+# valeur_keep_alive
+# =============================================================================
+def valeur_keep_alive(valeur):
+    """
+    keep_alive tel qu'attendu par l'API : un nombre (secondes, -1 = toujours) reste un nombre, même écrit
+    entre guillemets ; une durée ("30m", "1h") reste une chaîne.
+    """
+    if valeur is None or isinstance(valeur, (int, float)):
+        return valeur
+    texte = str(valeur).strip()
+    try:
+        return int(texte)
+    except ValueError:
+        pass
+    try:
+        return float(texte)
+    except ValueError:
+        return texte
+
+
+# =============================================================================
+# ChatOllamaPool
+# =============================================================================
+class ChatOllamaPool(BaseChatModel):
+    """
+    Modèle de chat LangChain sur l'API /api/chat d'Ollama, par le client à connexions persistantes.
+    """
+    client: Any
+    model: str
+    temperature: Optional[float] = None
+    keep_alive: Optional[Union[int, float, str]] = None
+    num_predict: int = -1
+    num_ctx_min: int = 2048
+    num_ctx_max: int = 8192
+    # installer(nom) -> bool : réinstallation d'un modèle signalé absent par Ollama (None : erreur levée)
+    installer: Any = None
+
+    @property
+    def _llm_type(self):
+        return 'ollama-pool'
+
+    def _num_ctx(self, nb_caracteres):
+        return taille_contexte(nb_caracteres, self.num_predict if self.num_predict > 0 else RESERVE_REPONSE,
+                               self.num_ctx_min, self.num_ctx_max)
+
+    def _corps(self, messages, stop=None):
+        messages = [{'role': ROLES.get(message.type, 'user'), 'content': message.content} for message in messages]
+        num_ctx = self._num_ctx(sum(len(message['content']) for message in messages))
+        options = {'num_ctx': num_ctx}
+        if self.num_predict > 0:
+            options['num_predict'] = self.num_predict
+        if self.temperature is not None:
+            options['temperature'] = self.temperature
+        if stop:
+            options['stop'] = stop
+        corps = {'model': self.model, 'messages': messages, 'options': options}
+        if self.keep_alive is not None:
+            corps['keep_alive'] = self.keep_alive
+        return corps
+
+    @staticmethod
+    def _log_resultat(corps, resultat):
+        if resultat.get('prompt_eval_count', 0) >= corps['options']['num_ctx']:
+            logger.warning(f"prompt tronqué par Ollama : {resultat['prompt_eval_count']} tokens pour "
+                           f"num_ctx={corps['options']['num_ctx']} (augmentez llm_num_ctx_max)")
+        logger.debug(f"Ollama : num_ctx={corps['options']['num_ctx']}, "
+                     f"{resultat.get('prompt_eval_count', '?')} tokens de prompt, "
+                     f"{resultat.get('eval_count', '?')} tokens générés, "
+                     f"chargement {resultat.get('load_duration', 0) / 1e9:.2f} s")
+
+    def _reinstaller(self, erreur):
+        if self.installer is None:
+            raise erreur
+        logger.warning(f"modèle '{self.model}' absent d'Ollama ({erreur}) : nouveau téléchargement")
+        if not self.installer(self.model):
+            raise erreur
+
+    def _requete(self, chemin, corps):
+        """
+        Requête sur l'API ; si le modèle est absent, il est réinstallé et la requête renvoyée une fois.
+        """
+        try:
+            return self.client.requete(chemin, corps)
+        except ModeleAbsent as e:
+            self._reinstaller(e)
+        return self.client.requete(chemin, corps)
+
+    def _flux(self, chemin, corps):
+        try:
+            # ModeleAbsent est levée avant le premier objet : rien n'a encore été transmis
+            yield from self.client.flux(chemin, corps)
+            return
+        except ModeleAbsent as e:
+            self._reinstaller(e)
+        yield from self.client.flux(chemin, corps)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        corps = self._corps(messages, stop)
+        resultat = self._requete('/api/chat', {**corps, 'stream': False})
+        self._log_resultat(corps, resultat)
+        message = AIMessage(content=resultat.get('message', {}).get('content', ''))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        corps = self._corps(messages, stop)
+        for resultat in self._flux('/api/chat', {**corps, 'stream': True}):
+            if resultat.get('done'):
+                self._log_resultat(corps, resultat)
+            texte = resultat.get('message', {}).get('content', '')
+            if texte:
+                if run_manager is not None:
+                    run_manager.on_llm_new_token(texte)
+                yield ChatGenerationChunk(message=AIMessageChunk(content=texte))
+
+    def rechauffer(self, budget_tokens=0):
+        """
+        Charge le modèle dans Ollama (requête sans prompt) avec la fenêtre de contexte d'un prompt de
+        budget_tokens tokens (0 : fenêtre minimale), pour que la première question ne paie pas ce
+        chargement ; retourne la durée en secondes.
+        """
+        debut = time.perf_counter()
+        num_ctx = self._num_ctx(budget_tokens * CARACTERES_PAR_TOKEN) if budget_tokens else self.num_ctx_min
+        corps = {'model': self.model, 'stream': False, 'options': {'num_ctx': num_ctx}}
+        if self.keep_alive is not None:
+            corps['keep_alive'] = self.keep_alive
+        self._requete('/api/generate', corps)
+        return time.perf_counter() - debut
+
+
+# =============================================================================
+# creer_chat_ollama
+# =============================================================================
+def creer_chat_ollama(app_config, model_name, temperature=None, installer=None):
+    """
+    Modèle de chat de la configuration (adresse d'Ollama, taille du pool, keep_alive, fenêtre de contexte) ;
+    installer(nom) réinstalle le modèle s'il est signalé absent.
+    """
+    client = ClientOllama(app_config.get('ollama_base_url', 'http://localhost:11434'),
+                          taille_pool=int(app_config.get('ollama_pool_size', 4)),
+                          timeout=float(app_config.get('ollama_timeout', 300)))
+    return ChatOllamaPool(client=client, model=model_name, temperature=temperature,
+                          keep_alive=valeur_keep_alive(app_config.get('ollama_keep_alive')),
+                          num_predict=int(app_config.get('llm_num_predict', -1)),
+                          num_ctx_min=int(app_config.get('llm_num_ctx_min', 2048)),
+                          num_ctx_max=int(app_config.get('llm_num_ctx_max', 8192)),
+                          installer=installer)
@@ -0,0 +1,132 @@
+# Fichier : page_cache.py
+#
+# Cache persistant du texte extrait de chaque page d'un PDF.
+# La clé d'une page est calculée à partir de son contenu (flux de contenu, polices,
+# XObjects) et de l'extracteur utilisé avec ses options : une page inchangée d'une
+# nouvelle version du PDF (errata) est servie depuis le cache, seules les pages
+# modifiées sont ré-extraites.
+
+import os
+import json
+import hashlib
+import tempfile
+
+from config import logger
+
+
+# =============================================================================
+# _donnees_flux
+# =============================================================================
+def _donnees_flux(flux):
+    try:
+        return flux.get_data()
+    except Exception:
+        # filtre non décodable par pypdf (image JPX, ...) : on se contente des données brutes
+        return getattr(flux, '_data', b'') or b''
+
+
+# =============================================================================
+# _empreinte_ressources
+# =============================================================================
+def _empreinte_ressources(h, ressources, deja_vus):
+    if ressources is None:
+        return
+    ressources = ressources.get_object()
+    # les polices déterminent le texte extrait (encodage, table ToUnicode)
+    polices = ressources.get('/Font')
+    if polices is not None:
+        polices = polices.get_object()
+        for nom in sorted(polices):
+            police = polices[nom].get_object()
+            h.update(str(nom).encode())
+            h.update(str(police.get('/BaseFont')).encode())
+            encodage = police.get('/Encoding')
+            if encodage is not None:
+                h.update(repr(encodage.get_object()).encode())
+            to_unicode = police.get('/ToUnicode')
+            if to_unicode is not None:
+                h.update(_donnees_flux(to_unicode.get_object()))
+    # les XObjects de type formulaire contiennent eux-mêmes du texte, les images peuvent être OCRisées
+    xobjects = ressources.get('/XObject')
+    if xobjects is not None:
+        xobjects = xobjects.get_object()
+        for nom in sorted(xobjects):
+            reference = xobjects[nom]
+            cle_objet = getattr(reference, 'idnum', None)
+            if cle_objet is not None:
+                if cle_objet in deja_vus:
+                    continue
+                deja_vus.add(cle_objet)
+            xobject = reference.get_object()
+            h.update(str(nom).encode())
+            h.update(_donnees_flux(xobject))
+            if xobject.get('/Subtype') == '/Form':
+                _empreinte_ressources(h, xobject.get('/Resources'), deja_vus)
+
+
+# =============================================================================
+# empreinte_page
+# =============================================================================
+def empreinte_page(page):
+    """
+    Empreinte SHA-256 du contenu d'une page pypdf (indépendante de sa position dans le document).
+    """
+    h = hashlib.sha256()
+    contenu = page.get_contents()
+    if contenu is not None:
+        h.update(contenu.get_data())
+    _empreinte_ressources(h, page.get('/Resources'), set())
+    h.update(repr([float(x) for x in page.mediabox]).encode())
+    h.update(str(page.get('/Rotate', 0)).encode())
+    return h.hexdigest()
+
+
+# =============================================================================
+# CachePages
+# =============================================================================
+class CachePages:
+    """
+    Cache disque des textes de pages : un fichier UTF-8 par clé, réparti dans des
+    sous-répertoires selon les deux premiers caractères de la clé.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def cle(empreinte, extracteur, options=None):
+        description = json.dumps([empreinte, extracteur, options or {}], sort_keys=True)
+        return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+    def _chemin(self, cle):
+        return os.path.join(self.cache_dir, cle[:2], cle + '.txt')
+
+    def contient(self, cle):
+        present = os.path.exists(self._chemin(cle))
+        if present:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return present
+
+    def lire(self, cle):
+        try:
+            with open(self._chemin(cle), 'r', encoding='utf-8', newline='') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def ecrire(self, cle, texte):
+        chemin = self._chemin(cle)
+        os.makedirs(os.path.dirname(chemin), exist_ok=True)
+        # écriture atomique : un fichier partiel ne doit jamais être lu comme une entrée valide
+        fd, chemin_tmp = tempfile.mkstemp(dir=os.path.dirname(chemin), suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            f.write(texte or '')
+        os.replace(chemin_tmp, chemin)
+
+    def log_stats(self):
+        logger.info(f"cache des pages : {self.hits} pages servies depuis le cache, {self.misses} pages extraites")
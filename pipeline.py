@@ -0,0 +1,372 @@
+# Fichier : pipeline.py
+#
+# Chaîne complète extraction -> nettoyage -> découpage -> embeddings en un seul processus.
+# Chaque étape est un générateur qui consomme la précédente : les morceaux (chunks) sont
+# vectorisés pendant que les pages suivantes sont encore extraites, sans relire d'artefact
+# intermédiaire sur le disque. Les fichiers intermédiaires (_raw.txt, .txt, chunk store _chunks)
+# ne sont écrits qu'avec l'option --debug.
+
+import io
+import os
+import sys
+import time
+import getopt
+import queue
+import shutil
+import threading
+
+from config import load_config, bcolors, logger
+from build import etape_a_jour, enregistrer_etape
+from page_cache import CachePages
+from chunk_store import EcrivainChunkStore
+from bm25_index import construire_bm25
+from near_duplicates import creer_dedoublonneur
+from embedding_cache import CacheEmbeddings, EmbeddingsEnCache
+from embedding_engine import creer_moteur_embeddings
+from vector_store import CHUNKS_DIR, base_provisoire, creer_index, index_a_entrainer, sauvegarder_index
+from nettoyage import MoteurMarkdown, MoteurNettoyage, charger_packs
+from E01_pdf_to_text import pages_pypdf, pages_unstructured
+from E02_Chunking import creer_text_splitter
+from text_splitter import DecoupeurSections
+
+
+# =============================================================================
+# morceaux_bruts
+# =============================================================================
+def morceaux_bruts(app_config, pdf_file_path, cache=None):
+    """
+    Générateur du texte brut page par page, tel qu'il serait écrit dans le fichier _raw.txt par E01.
+    """
+    if app_config['pdf_reader'] == 'pypdf':
+        for page_num, num_pages, texte in pages_pypdf(pdf_file_path,
+                                                      nb_workers=app_config.get('pdf_workers', 1),
+                                                      pages_par_tache=app_config.get('pdf_pages_per_task', 8),
+                                                      cache=cache):
+            if texte:
+                yield texte + "\n"
+    elif app_config['pdf_reader'] == 'unstructured':
+        for texte in pages_unstructured(pdf_file_path, cache,
+                                        pages_par_tache=app_config.get('pdf_pages_per_task', 8)):
+            if texte is not None:
+                yield texte + "\n\n"
+    else:
+        raise ValueError(f"pdf_reader inconnu : '{app_config['pdf_reader']}'")
+
+
+# =============================================================================
+# lignes_brutes
+# =============================================================================
+def lignes_brutes(morceaux):
+    """
+    Découpe le texte brut en lignes, comme la relecture du fichier _raw.txt en mode texte
+    (fins de ligne '\r\n' et '\r' converties en '\n'). Chaque morceau se termine par '\n' :
+    aucune ligne n'est à cheval sur deux morceaux.
+    """
+    for morceau in morceaux:
+        yield from io.StringIO(morceau, newline=None)
+
+
+# =============================================================================
+# texte_nettoye
+# =============================================================================
+def texte_nettoye(app_config, lignes, regles=None):
+    """
+    Générateur du texte nettoyé, avec le même moteur que E01 pour le lecteur PDF choisi.
+    """
+    if app_config['pdf_reader'] == 'pypdf':
+        moteur = MoteurNettoyage(regles)
+        yield from moteur.nettoyer_lignes(lignes)
+    else:
+        moteur = MoteurMarkdown(regles)
+        yield from moteur.formater_lignes(lignes)
+    moteur.stats.log(type(moteur).__name__)
+
+
+# =============================================================================
+# decouper_en_flux
+# =============================================================================
+def decouper_en_flux(morceaux, text_splitter, taille_fenetre=20000):
+    """
+    Générateur des morceaux (Documents LangChain) à partir du texte nettoyé qui arrive en flux.
+    Le texte est accumulé jusqu'à taille_fenetre caractères puis coupé au dernier paragraphe
+    ("\n\n") : la fin est gardée pour la fenêtre suivante. Seules les coupures entre deux
+    fenêtres peuvent différer d'un découpage du texte entier. Avec un DecoupeurSections, le chemin
+    de la section en cours passe d'une fenêtre à la suivante.
+    """
+    chemin = ()
+
+    def documents(texte):
+        nonlocal chemin
+        if isinstance(text_splitter, DecoupeurSections):
+            docs, chemin = text_splitter.documents(texte, chemin)
+            return docs
+        return text_splitter.create_documents([texte])
+
+    tampon = []
+    taille = 0
+    for morceau in morceaux:
+        tampon.append(morceau)
+        taille += len(morceau)
+        if taille < taille_fenetre:
+            continue
+        texte = ''.join(tampon)
+        coupure = texte.rfind('\n\n')
+        if coupure <= 0:
+            if taille < 4 * taille_fenetre:
+                continue
+            # pas de paragraphe dans une très grande fenêtre : on coupe à la dernière ligne
+            coupure = texte.rfind('\n')
+            if coupure <= 0:
+                coupure = len(texte)
+        yield from documents(texte[:coupure])
+        tampon = [texte[coupure:]]
+        taille = len(tampon[0])
+    texte = ''.join(tampon)
+    if texte:
+        yield from documents(texte)
+
+
+# =============================================================================
+# indexer_en_flux
+# =============================================================================
+def indexer_en_flux(docs, embeddings, ecrivain, taille_lot=64, app_config=None):
+    """
+    Vectorise les morceaux par lots au fil de leur arrivée et les ajoute à un index FAISS ;
+    les textes et métadonnées sont écrits dans le chunk store dans le même ordre.
+    embeddings fournit embed_array (MoteurEmbeddings, EmbeddingsEnCache).
+    Un index à entraîner (ivf, ivfpq) n'est créé qu'une fois tous les vecteurs calculés.
+    """
+    import numpy as np
+
+    app_config = app_config or {}
+    a_entrainer = index_a_entrainer(app_config)
+    index = None
+    en_attente = []
+    nb_docs = 0
+    lot = []
+
+    def ajouter_lot():
+        nonlocal index
+        vecteurs = embeddings.embed_array([doc.page_content for doc in lot])
+        if a_entrainer:
+            en_attente.append(vecteurs)
+        else:
+            if index is None:
+                index = creer_index(app_config, vecteurs.shape[1])
+            index.add(vecteurs)
+        for doc in lot:
+            ecrivain.ajouter_document(doc)
+
+    for doc in docs:
+        lot.append(doc)
+        if len(lot) >= taille_lot:
+            ajouter_lot()
+            nb_docs += len(lot)
+            lot = []
+            print(f"\r  - Vectorisation en cours... {nb_docs} morceaux", end="")
+    if lot:
+        ajouter_lot()
+        nb_docs += len(lot)
+    print(f"\r  - Vectorisation terminée : {nb_docs} morceaux")
+    if en_attente:
+        vecteurs = np.concatenate(en_attente)
+        index = creer_index(app_config, vecteurs.shape[1], vecteurs)
+        index.add(vecteurs)
+    return index
+
+
+# =============================================================================
+# en_arriere_plan
+# =============================================================================
+def en_arriere_plan(generateur, taille_file=256):
+    """
+    Exécute un générateur dans un thread et rend ses éléments au fil de l'eau :
+    l'extraction et le nettoyage continuent pendant que le thread principal calcule les embeddings.
+    """
+    file = queue.Queue(maxsize=taille_file)
+    fin = object()
+
+    def producteur():
+        try:
+            for element in generateur:
+                file.put(element)
+        except BaseException as e:
+            file.put(e)
+        else:
+            file.put(fin)
+
+    threading.Thread(target=producteur, daemon=True).start()
+    while True:
+        element = file.get()
+        if element is fin:
+            return
+        if isinstance(element, BaseException):
+            raise element
+        yield element
+
+
+# =============================================================================
+# ecrire_en_passant
+# =============================================================================
+def ecrire_en_passant(morceaux, output_file, encoding='utf-8'):
+    """
+    Recopie un flux de texte dans un fichier (mode --debug) sans l'interrompre.
+    """
+    with open(output_file, 'w', encoding=encoding) as f:
+        for morceau in morceaux:
+            f.write(morceau)
+            yield morceau
+    logger.info(f"fichier intermédiaire '{bcolors.OUTPUT}{output_file}{bcolors.ENDC}' écrit")
+
+
+# =============================================================================
+# lancer_pipeline
+# =============================================================================
+def lancer_pipeline(app_config, debug=False, use_cache=True, force=False):
+    data_dir = app_config['data_dir']
+    language = app_config['language']
+    rules_file = app_config['rules_' + language + '_file']
+    embeddings_model_name = app_config['embeddings_' + language + '_model_name']
+    pdf_file_path = os.path.join(data_dir, rules_file)
+    vector_store_path = os.path.join(data_dir, "faiss_index_" + language)
+    logger.info(f"pdf_file_path={bcolors.INPUT}{pdf_file_path}{bcolors.ENDC}")
+    logger.info(f"embeddings_model_name={bcolors.INPUT}{embeddings_model_name}{bcolors.ENDC}")
+    logger.info(f"vector_store_path={bcolors.OUTPUT}{vector_store_path}{bcolors.ENDC}")
+    if not os.path.exists(pdf_file_path):
+        logger.error(f"Erreur : Le fichier '{pdf_file_path}' n'a pas été trouvé.")
+        return None
+    # rien à faire si le PDF, les règles et les paramètres n'ont pas changé depuis la dernière exécution
+    # (avec --debug, la chaîne est relancée pour produire les fichiers intermédiaires)
+    if not force and not debug and etape_a_jour(app_config, 'pipeline'):
+        return None
+
+    debut = time.perf_counter()
+    page_cache = None
+    if use_cache and app_config.get('page_cache', True):
+        page_cache = CachePages(os.path.join(data_dir, 'page_cache'))
+    regles = charger_packs(app_config.get('rule_packs_' + language))
+
+    # --- chaînage des étapes (rien n'est exécuté avant la consommation par l'indexation)
+    brut = morceaux_bruts(app_config, pdf_file_path, page_cache)
+    if debug:
+        brut = ecrire_en_passant(brut, os.path.join(data_dir, rules_file.replace('.pdf', '_raw.txt')))
+    propre = texte_nettoye(app_config, lignes_brutes(brut), regles)
+    if debug:
+        propre = ecrire_en_passant(propre, os.path.join(data_dir, rules_file.replace('.pdf', '.txt')))
+    text_splitter = creer_text_splitter(app_config)
+    docs = decouper_en_flux(propre, text_splitter, taille_fenetre=20 * int(app_config.get('chunk_size', 1000)))
+    # quasi-doublons retirés avant les embeddings (alias dans les métadonnées du morceau gardé)
+    dedoublonneur = creer_dedoublonneur(app_config)
+    if dedoublonneur is not None:
+        docs = dedoublonneur.filtrer(docs)
+
+    logger.info(f"-> Chargement du modèle d'embedding : {bcolors.INPUT}{embeddings_model_name}{bcolors.ENDC}...")
+    # le modèle n'est chargé qu'au premier morceau absent du cache des embeddings
+    moteur = creer_moteur_embeddings(app_config, embeddings_model_name)
+    embeddings = moteur
+    embedding_cache = None
+    if use_cache and app_config.get('embedding_cache', True):
+        embedding_cache = CacheEmbeddings(os.path.join(data_dir, 'embedding_cache'), moteur.identifiant)
+        embeddings = EmbeddingsEnCache(moteur, embedding_cache)
+
+    # extraction, nettoyage et découpage dans un thread, embeddings dans le thread principal
+    # la nouvelle base (chunk store, BM25, index) est construite dans un répertoire provisoire, mis à la place
+    # de l'ancienne base par sauvegarder_index
+    provisoire = base_provisoire(vector_store_path)
+    if os.path.exists(provisoire):
+        shutil.rmtree(provisoire)
+    chunk_store_path = os.path.join(provisoire, CHUNKS_DIR)
+    os.makedirs(provisoire)
+    ecrivain = EcrivainChunkStore(chunk_store_path)
+    try:
+        try:
+            # un lot du flux occupe tous les processus du moteur d'embeddings
+            index = indexer_en_flux(en_arriere_plan(docs), embeddings, ecrivain, moteur.batch_size * moteur.nb_workers,
+                                    app_config)
+        finally:
+            moteur.fermer()
+        if index is None:
+            logger.error("❌ Aucun morceau n'a été produit.")
+            return None
+        ecrivain.fermer()
+        if dedoublonneur is not None:
+            dedoublonneur.log_stats()
+        if app_config.get('bm25_index', True):
+            construire_bm25(chunk_store_path, k1=float(app_config.get('bm25_k1', 1.2)),
+                            b=float(app_config.get('bm25_b', 0.75)))
+        moteur.log_stats()
+        if embedding_cache is not None:
+            embedding_cache.log_stats()
+        sauvegarder_index(index, vector_store_path, chunk_store_path)
+    finally:
+        # chaîne interrompue ou sans morceau : l'ancienne base reste en place, rien de partiel sur le disque
+        ecrivain.abandonner()
+        if os.path.exists(provisoire):
+            shutil.rmtree(provisoire)
+    if debug:
+        chunks_path = os.path.join(data_dir, rules_file.replace('.pdf', '_chunks'))
+        if os.path.exists(chunks_path):
+            shutil.rmtree(chunks_path)
+        shutil.copytree(os.path.join(vector_store_path, CHUNKS_DIR), chunks_path)
+        logger.info(f"chunk store intermédiaire '{bcolors.OUTPUT}{chunks_path}{bcolors.ENDC}' écrit")
+    enregistrer_etape(app_config, 'pipeline')
+    logger.info(f"✅ Base de données vectorielle sauvegardée dans '{vector_store_path}' "
+                f"({time.perf_counter() - debut:.1f} s)")
+    return index
+
+
+# =============================================================================
+# usage
+# =============================================================================
+def usage():
+    """
+    afficher le message d'aide
+
+    :return:
+    """
+    script_name = os.path.basename(__file__)
+    print(f"{script_name}  : () facultative item, <> : mandatory item\n"
+          "    (--cfg=<filename>)\n"
+          "    (--lf=<log file>)\n"
+          "    (--ll=<log level:CRITICAL|ERROR|WARNING|INFO|DEBUG>)\n"
+          "    (--debug : écrire les fichiers intermédiaires _raw.txt, .txt et le chunk store _chunks)\n"
+          "    (--no-cache : ré-extraire toutes les pages et ré-encoder tous les morceaux sans utiliser les caches)\n"
+          "    (--force : relancer la chaîne même si l'index est à jour dans le manifeste de build)\n"
+          "    (-h : this help)\n")
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+if __name__ == '__main__':
+    cfg_filename = None
+    debug = False
+    use_cache = True
+    force = False
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "h", ["cfg=", "ll=", "lf=", "debug", "no-cache", "force"])
+    except getopt.GetoptError as err:
+        logger.error(err)
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            sys.exit()
+        elif opt == "--cfg":
+            cfg_filename = arg
+        elif opt == "--ll":
+            if arg in ["CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"]:
+                log_level = arg
+        elif opt == "--lf":
+            log_file = arg
+        elif opt == "--debug":
+            debug = True
+        elif opt == "--no-cache":
+            use_cache = False
+        elif opt == "--force":
+            force = True
+
+    # --- CONFIGURATION (chargée une seule fois pour toutes les étapes)
+    app_config = load_config(cfg_filename=cfg_filename)
+    lancer_pipeline(app_config, debug=debug, use_cache=use_cache, force=force)
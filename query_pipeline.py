@@ -0,0 +1,139 @@
+# Fichier : query_pipeline.py
+#
+# Préparation d'une question de E04 : traduction de la question et recherche des sources.
+# Avec un modèle d'embedding multilingue (paraphrase-multilingual-MiniLM-L12-v2, ...), la
+# recherche n'a pas besoin de la traduction : la question française est encodée directement
+# et les deux étapes sont lancées en même temps (asyncio, chacune dans un thread) ; le
+# classement BM25 de la recherche hybride, dont l'index est anglais, utilise ensuite la
+# question traduite. Sinon la recherche attend la question traduite.
+# Chaque question a son détail des durées par étape (Latences) : le temps gagné par le
+# recouvrement est la différence entre la somme des étapes parallèles et leur durée réelle.
+# messages_chaine construit le prompt de la chaîne RetrievalQA pour des sources déjà trouvées
+# (assemblées par context_budget.AssembleurContexte : sans doublons, dans le budget de tokens).
+
+import time
+import asyncio
+from contextlib import contextmanager
+
+from config import logger
+
+
+# =============================================================================
+# Latences
+# =============================================================================
+class Latences:
+    """
+    Durées des étapes du traitement d'une question, mesurées depuis sa saisie.
+    """
+
+    def __init__(self):
+        self.debut = time.perf_counter()
+        self.etapes = {}
+        self.premier_token = None
+
+    def ajouter(self, nom, duree):
+        self.etapes[nom] = self.etapes.get(nom, 0.0) + duree
+
+    @contextmanager
+    def mesurer(self, nom):
+        debut = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.ajouter(nom, time.perf_counter() - debut)
+
+    def marquer_premier_token(self):
+        if self.premier_token is None:
+            self.premier_token = time.perf_counter() - self.debut
+
+    def total(self):
+        return time.perf_counter() - self.debut
+
+    def resume(self):
+        etapes = ' | '.join(f"{nom} {duree:.2f} s" for nom, duree in self.etapes.items())
+        premier_token = f" | premier token {self.premier_token:.2f} s" if self.premier_token is not None else ""
+        return f"{etapes}{premier_token} | total {self.total():.2f} s"
+
+
+# =============================================================================
+# est_multilingue
+# =============================================================================
+def est_multilingue(app_config, model_name):
+    """
+    Le modèle d'embedding encode-t-il une question française dans l'espace des morceaux anglais ?
+    (embeddings_multilingual : true, false ou auto = d'après le nom du modèle)
+    """
+    multilingue = app_config.get('embeddings_multilingual', 'auto')
+    if multilingue in (None, 'auto'):
+        return 'multilingual' in model_name.lower()
+    return bool(multilingue)
+
+
+# =============================================================================
+# _etape
+# =============================================================================
+async def _etape(latences, nom, fonction, *args):
+    """
+    Exécute fonction(*args) dans un thread en mesurant sa durée.
+    """
+    debut = time.perf_counter()
+    try:
+        return await asyncio.to_thread(fonction, *args)
+    finally:
+        latences.ajouter(nom, time.perf_counter() - debut)
+
+
+# =============================================================================
+# preparer_question_async
+# =============================================================================
+async def preparer_question_async(question, retriever, traducteur=None, multilingue=False, latences=None):
+    """
+    Traduit la question (si traducteur) et recherche ses sources ; retourne (question traduite, documents).
+    Recherche et traduction sont simultanées si multilingue : la recherche vectorielle utilise alors la question
+    d'origine, le classement BM25 (recherche hybride) la question traduite.
+    """
+    latences = latences if latences is not None else Latences()
+    if traducteur is None:
+        return question, await _etape(latences, 'recherche', retriever.invoke, question)
+    traduction = _etape(latences, 'traduction question', traducteur.traduire, question, 'fr', 'en')
+    if not multilingue:
+        question_en = await traduction
+        return question_en, await _etape(latences, 'recherche', retriever.invoke, question_en)
+    debut = time.perf_counter()
+    question_en, trouves = await asyncio.gather(traduction, _etape(latences, 'recherche',
+                                                                   retriever.recherche_vectorielle, question))
+    duree = time.perf_counter() - debut
+    gain = latences.etapes['traduction question'] + latences.etapes['recherche'] - duree
+    logger.debug(f"traduction et recherche simultanées : {duree:.2f} s ({gain:.2f} s gagnées)")
+    with latences.mesurer('recherche'):
+        documents = retriever.fusionner(question_en, trouves, retriever.ids)
+    return question_en, documents
+
+
+# =============================================================================
+# preparer_question
+# =============================================================================
+def preparer_question(question, retriever, traducteur=None, multilingue=False, latences=None):
+    """
+    Version synchrone de preparer_question_async (boucle interactive de E04).
+    """
+    return asyncio.run(preparer_question_async(question, retriever, traducteur, multilingue, latences))
+
+
+# =============================================================================
+# messages_chaine
+# =============================================================================
+def messages_chaine(qa_chain, documents, question, assembleur=None):
+    """
+    Messages envoyés au LLM par la chaîne RetrievalQA "stuff" pour ces documents et cette question ;
+    avec un assembleur, les documents sont d'abord fusionnés, dédoublonnés et limités à son budget.
+    """
+    from langchain_core.prompts import format_document
+
+    if assembleur is not None:
+        documents = assembleur.assembler(documents)
+    combinaison = qa_chain.combine_documents_chain
+    contexte = combinaison.document_separator.join(format_document(document, combinaison.document_prompt)
+                                                   for document in documents)
+    return combinaison.llm_chain.prompt.format_prompt(
+        **{combinaison.document_variable_name: contexte, 'question': question}).to_messages()
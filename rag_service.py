@@ -0,0 +1,285 @@
+# Fichier : rag_service.py
+#
+# Service HTTP local (asyncio) du système expert : plusieurs joueurs, ou un bot Discord, partagent
+# le modèle d'embedding, l'index FAISS et le LLM chargés une seule fois par E04 (E04 --serve).
+#   - POST /query  {"question": "...", "sections": ["..."]}  ->  réponse, sources et durées en JSON
+#   - GET  /health                                          ->  état du service
+# Les questions arrivées pendant service_batch_window_ms sont encodées en un seul lot d'embeddings
+# et cherchées par un seul appel FAISS (un par restriction de sections différente).
+# Les appels au LLM passent par une file de service_llm_concurrency appels simultanés au plus.
+
+import json
+import asyncio
+import traceback
+
+from config import bcolors, logger
+from query_pipeline import Latences, messages_chaine
+from vector_store import encoder_requetes, ids_sections, rechercher_vecteurs
+
+STATUTS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           500: 'Internal Server Error'}
+
+
+# =============================================================================
+# LotsRecherche
+# =============================================================================
+class LotsRecherche:
+    """
+    Regroupe les recherches simultanées en lots : un encodage et une recherche FAISS par lot.
+    """
+
+    def __init__(self, db, k=4, fenetre=0.01, taille_max=32):
+        self.db = db
+        self.k = k
+        self.fenetre = fenetre
+        self.taille_max = max(1, int(taille_max))
+        self.attente = []
+        self.minuteur = None
+        self.taches = set()
+        self.nb_lots = 0
+        self.nb_questions = 0
+
+    async def rechercher(self, question, cle=None, ids=None):
+        """
+        Documents trouvés pour la question, parmi les morceaux ids (cle : restriction de sections correspondante).
+        """
+        boucle = asyncio.get_running_loop()
+        futur = boucle.create_future()
+        self.attente.append((question, cle, ids, futur))
+        if len(self.attente) >= self.taille_max:
+            self._vider()
+        elif self.minuteur is None:
+            self.minuteur = boucle.call_later(self.fenetre, self._vider)
+        return await futur
+
+    def _vider(self):
+        if self.minuteur is not None:
+            self.minuteur.cancel()
+            self.minuteur = None
+        lot, self.attente = self.attente, []
+        if lot:
+            tache = asyncio.ensure_future(self._traiter(lot))
+            # la tâche doit rester référencée jusqu'à sa fin
+            self.taches.add(tache)
+            tache.add_done_callback(self.taches.discard)
+
+    async def _traiter(self, lot):
+        try:
+            resultats = await asyncio.to_thread(self._rechercher_lot, lot)
+        except Exception as e:
+            for _, _, _, futur in lot:
+                if not futur.done():
+                    futur.set_exception(e)
+            return
+        for (_, _, _, futur), documents in zip(lot, resultats):
+            if not futur.done():
+                futur.set_result(documents)
+
+    def _rechercher_lot(self, lot):
+        """
+        Résultats (Document, distance) de la recherche vectorielle de chaque question du lot.
+        """
+        vecteurs = encoder_requetes(self.db, [question for question, _, _, _ in lot])
+        groupes = {}
+        for position, (_, cle, ids, _) in enumerate(lot):
+            groupes.setdefault(cle, (ids, []))[1].append(position)
+        resultats = [None] * len(lot)
+        for ids, positions in groupes.values():
+            for position, trouves in zip(positions, rechercher_vecteurs(self.db, vecteurs[positions], self.k, ids)):
+                resultats[position] = trouves
+        self.nb_lots += 1
+        self.nb_questions += len(lot)
+        logger.debug(f"lot de recherche : {len(lot)} questions, {len(groupes)} appel(s) FAISS")
+        return resultats
+
+
+# =============================================================================
+# ServiceRAG
+# =============================================================================
+class ServiceRAG:
+    """
+    Traitement des questions du service : recherche par lots, LLM en file d'attente, traduction.
+    """
+
+    def __init__(self, app_config, db, qa_chain, llm, traducteur=None, multilingue=False, sections=None,
+                 assembleur=None):
+        self.db = db
+        self.qa_chain = qa_chain
+        self.llm = llm
+        self.traducteur = traducteur
+        self.multilingue = multilingue
+        self.sections = sections
+        self.assembleur = assembleur
+        # nombre de sources et recherche hybride : ceux du retriever de la chaîne
+        self.retriever = qa_chain.retriever
+        self.lots = LotsRecherche(db, k=self.retriever.k_recherche,
+                                  fenetre=float(app_config.get('service_batch_window_ms', 10)) / 1000,
+                                  taille_max=int(app_config.get('service_batch_max', 32)))
+        self.concurrence_llm = max(1, int(app_config.get('service_llm_concurrency', 1)))
+        self.file_llm = None
+        self.ids_par_sections = {}
+        self.nb_questions = 0
+
+    def _ids(self, sections):
+        cle = tuple(sorted(sections)) if sections else None
+        if cle is not None and cle not in self.ids_par_sections:
+            self.ids_par_sections[cle] = ids_sections(self.db.docstore.store, cle)
+        return cle, (self.ids_par_sections[cle] if cle is not None else None)
+
+    async def _rechercher(self, question, cle, ids):
+        trouves = await self.lots.rechercher(question, cle, ids)
+        return self.retriever.fusionner(question, trouves, ids)
+
+    async def _etape(self, latences, nom, attente):
+        with latences.mesurer(nom):
+            return await attente
+
+    async def repondre(self, question, sections=None):
+        """
+        Réponse à une question (dictionnaire sérialisable en JSON).
+        """
+        if self.file_llm is None:
+            self.file_llm = asyncio.Semaphore(self.concurrence_llm)
+        latences = Latences()
+        cle, ids = self._ids(sections or self.sections)
+        if self.traducteur is None:
+            question_en = question
+            documents = await self._etape(latences, 'recherche', self._rechercher(question, cle, ids))
+        else:
+            traduction = self._etape(latences, 'traduction question',
+                                     asyncio.to_thread(self.traducteur.traduire, question, 'fr', 'en'))
+            if self.multilingue:
+                # modèle multilingue : recherche vectorielle avec la question d'origine, pendant la traduction ;
+                # le classement BM25 (index anglais) utilise la question traduite
+                question_en, trouves = await asyncio.gather(
+                    traduction, self._etape(latences, 'recherche', self.lots.rechercher(question, cle, ids)))
+                with latences.mesurer('recherche'):
+                    documents = self.retriever.fusionner(question_en, trouves, ids)
+            else:
+                question_en = await traduction
+                documents = await self._etape(latences, 'recherche', self._rechercher(question_en, cle, ids))
+
+        messages = messages_chaine(self.qa_chain, documents, question_en, self.assembleur)
+        # file d'attente du LLM : au plus service_llm_concurrency générations simultanées
+        await self._etape(latences, 'file LLM', self.file_llm.acquire())
+        try:
+            answer_en = (await self._etape(latences, 'génération',
+                                           asyncio.to_thread(self.llm.invoke, messages))).content
+        finally:
+            self.file_llm.release()
+        answer_fr = None
+        if self.traducteur is not None:
+            answer_fr = await self._etape(latences, 'traduction réponse',
+                                          asyncio.to_thread(self.traducteur.traduire, answer_en, 'en', 'fr'))
+        self.nb_questions += 1
+        return {'question': question, 'question_en': question_en, 'answer_en': answer_en, 'answer_fr': answer_fr,
+                'sources': [{'id': document.id, 'section': document.metadata.get('section'),
+                             'texte': document.page_content} for document in documents],
+                'latences': {**{nom: round(duree, 4) for nom, duree in latences.etapes.items()},
+                             'total': round(latences.total(), 4)}}
+
+    def etat(self):
+        return {'status': 'ok', 'morceaux': self.db.index.ntotal, 'questions': self.nb_questions,
+                'lots_recherche': self.lots.nb_lots, 'questions_recherchees': self.lots.nb_questions}
+
+
+# =============================================================================
+# _reponse_http
+# =============================================================================
+def _reponse_http(statut, contenu, garder_connexion=True):
+    corps = json.dumps(contenu, ensure_ascii=False).encode('utf-8')
+    entetes = (f"HTTP/1.1 {statut} {STATUTS.get(statut, '')}\r\n"
+               f"Content-Type: application/json; charset=utf-8\r\n"
+               f"Content-Length: {len(corps)}\r\n"
+               f"Connection: {'keep-alive' if garder_connexion else 'close'}\r\n\r\n")
+    return entetes.encode('latin-1') + corps
+
+
+# =============================================================================
+# traiter_connexion
+# =============================================================================
+async def traiter_connexion(service, lecteur, ecrivain):
+    """
+    Requêtes HTTP/1.1 successives d'une connexion (keep-alive).
+    """
+    try:
+        while True:
+            ligne = await lecteur.readline()
+            if not ligne.strip():
+                break
+            try:
+                methode, chemin, version = ligne.decode('latin-1').split()
+            except ValueError:
+                ecrivain.write(_reponse_http(400, {'erreur': 'requête invalide'}, False))
+                break
+            entetes = {}
+            while True:
+                entete = await lecteur.readline()
+                if not entete.strip():
+                    break
+                nom, _, valeur = entete.decode('latin-1').partition(':')
+                entetes[nom.strip().lower()] = valeur.strip()
+            corps = await lecteur.readexactly(int(entetes.get('content-length', 0) or 0))
+            garder_connexion = entetes.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+            statut, contenu = await _router(service, methode, chemin.split('?')[0], corps)
+            ecrivain.write(_reponse_http(statut, contenu, garder_connexion))
+            await ecrivain.drain()
+            if not garder_connexion:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        ecrivain.close()
+
+
+# =============================================================================
+# _router
+# =============================================================================
+async def _router(service, methode, chemin, corps):
+    if chemin == '/health':
+        return 200, service.etat()
+    if chemin != '/query':
+        return 404, {'erreur': f"chemin inconnu : {chemin}"}
+    if methode != 'POST':
+        return 405, {'erreur': 'utilisez POST'}
+    try:
+        requete = json.loads(corps or b'{}')
+        question = requete['question'].strip()
+        sections = requete.get('sections')
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return 400, {'erreur': 'corps attendu : {"question": "...", "sections": [...] (facultatif)}'}
+    if not question:
+        return 400, {'erreur': 'question vide'}
+    if sections is not None and (not isinstance(sections, list)
+                                 or not all(isinstance(section, str) for section in sections)):
+        return 400, {'erreur': "'sections' doit être une liste de chaînes"}
+    try:
+        return 200, await service.repondre(question, sections)
+    except Exception as e:
+        logger.error(f"question '{question}' : {e}")
+        logger.debug(traceback.format_exc())
+        return 500, {'erreur': str(e)}
+
+
+# =============================================================================
+# servir_async
+# =============================================================================
+async def servir_async(service, host='127.0.0.1', port=8765, pret=None):
+    serveur = await asyncio.start_server(lambda l, e: traiter_connexion(service, l, e), host, port)
+    adresse = serveur.sockets[0].getsockname()
+    logger.info(f"✅ Service prêt sur {bcolors.INPUT}http://{adresse[0]}:{adresse[1]}{bcolors.ENDC} "
+                f"(POST /query, GET /health)")
+    if pret is not None:
+        pret(adresse)
+    async with serveur:
+        await serveur.serve_forever()
+
+
+# =============================================================================
+# servir
+# =============================================================================
+def servir(service, host='127.0.0.1', port=8765):
+    try:
+        asyncio.run(servir_async(service, host, port))
+    except KeyboardInterrupt:
+        logger.info("Arrêt du service.")
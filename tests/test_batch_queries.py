@@ -0,0 +1,37 @@
+# Fichier : tests/test_batch_queries.py
+#
+# Lecture du fichier de questions du mode lot (E04 --batch) : lignes invalides refusées avec leur numéro.
+
+import json
+
+import pytest
+
+from batch_queries import lire_questions
+
+
+def ecrire(tmp_path, lignes):
+    chemin = tmp_path / 'questions.jsonl'
+    chemin.write_text('\n'.join(ligne if isinstance(ligne, str) else json.dumps(ligne) for ligne in lignes),
+                      encoding='utf-8')
+    return str(chemin)
+
+
+def test_questions_valides(tmp_path):
+    chemin = ecrire(tmp_path, [{'id': 1, 'question': 'portée du PIAT ?', 'sections': ['Army Lists']},
+                               '', json.dumps("question seule"), {'question': 'ordre Down', 'sections': None}])
+    questions = lire_questions(chemin)
+    assert [question['question'] for question in questions] == ['portée du PIAT ?', 'question seule', 'ordre Down']
+    assert questions[0] == {'id': 1, 'question': 'portée du PIAT ?', 'sections': ['Army Lists']}
+
+
+@pytest.mark.parametrize('ligne, message', [
+    ('{pas du json', 'ligne 2'),
+    ({'question': '  '}, "champ 'question'"),
+    ({'question': 'ordre Down', 'sections': 'Rules'}, "'sections' doit être une liste de chaînes"),
+    ({'question': 'ordre Down', 'sections': ['Rules', 3]}, "'sections' doit être une liste de chaînes"),
+])
+def test_ligne_invalide(tmp_path, ligne, message):
+    chemin = ecrire(tmp_path, [{'question': 'portée du PIAT ?'}, ligne])
+    with pytest.raises(ValueError, match=message) as erreur:
+        lire_questions(chemin)
+    assert 'ligne 2' in str(erreur.value)
@@ -0,0 +1,49 @@
+# Fichier : tests/test_nettoyage.py
+#
+# Famille metadata_lines compilée en une seule alternative, et refus des références arrière numérotées.
+
+import pytest
+
+from nettoyage import MoteurNettoyage, PackRegles
+
+
+def regles(metadonnees=(), bruit_ligne=()):
+    pack = {'name': 'essai',
+            'metadata_lines': [{'name': nom, 'pattern': motif} for nom, motif in metadonnees],
+            'line_noise': [{'name': nom, 'pattern': motif} for nom, motif in bruit_ligne]}
+    regles = PackRegles()
+    regles.ajouter(pack)
+    return regles
+
+
+# =============================================================================
+# metadata_lines
+# =============================================================================
+def test_metadonnees_une_seule_expression():
+    moteur = MoteurNettoyage(regles(metadonnees=[('indd', r'^Layouts\.indd.*$'), ('page', r'\[p\d+\]')]))
+    assert moteur.re_metadonnees is not None
+    lignes = list(moteur._lignes_logiques('Layouts.indd 12\nTexte [p3] utile [p4]\nFin'))
+    assert lignes == ['', 'Texte  utile ', 'Fin']
+    assert moteur.stats.hits['essai:indd'] == 1
+    assert moteur.stats.hits['essai:page'] == 2
+
+
+def test_sans_metadonnees():
+    moteur = MoteurNettoyage(regles())
+    assert moteur.re_metadonnees is None
+    assert list(moteur._lignes_logiques('Texte\nFin')) == ['Texte', 'Fin']
+
+
+# =============================================================================
+# références arrière
+# =============================================================================
+@pytest.mark.parametrize('motif', [r'^(\w+) \1$', r'(a)?(?(1)b|c)'])
+def test_reference_numerotee_refusee(motif):
+    with pytest.raises(ValueError, match="essai:double"):
+        MoteurNettoyage(regles(bruit_ligne=[('double', motif)]))
+
+
+def test_reference_nommee_acceptee():
+    moteur = MoteurNettoyage(regles(bruit_ligne=[('double', r'^(?P<mot>\w+) (?P=mot)$'), ('barre', r'^\\1$')]))
+    assert moteur.re_bruit_ligne.match('bis bis').lastgroup == 'r0'
+    assert moteur.re_bruit_ligne.match('\\1').lastgroup == 'r1'
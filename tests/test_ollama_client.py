@@ -0,0 +1,278 @@
+# Fichier : tests/test_ollama_client.py
+#
+# Client Ollama contre un serveur HTTP local qui imite l'API (http.server, port 0) :
+# pool de connexions persistantes, requête de préchargement, paliers de num_ctx, modèle supprimé.
+# Présence des modèles avec un faux exécutable ollama (ollama_executable) qui note ses appels.
+
+import os
+import sys
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from ollama_client import (CachePresenceModeles, ChatOllamaPool, ClientOllama, ModeleAbsent, assurer_modele,
+                           taille_contexte)
+
+
+# =============================================================================
+# ServeurOllama
+# =============================================================================
+class ServeurOllama(ThreadingHTTPServer):
+    """
+    Imitation de l'API d'Ollama : enregistre les requêtes reçues et la connexion (port client) de chacune.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), GestionnaireOllama)
+        self.requetes = []
+        # nombre de réponses après lesquelles le serveur ferme la connexion sans prévenir
+        self.fermer_apres = None
+        # modèles inconnus du serveur : HTTP 404 comme Ollama
+        self.modeles_absents = set()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    @property
+    def connexions(self):
+        return {port for port, _, _ in self.requetes}
+
+
+class GestionnaireOllama(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        corps = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requetes.append((self.client_address[1], self.path, corps))
+        if corps.get('model') in self.server.modeles_absents:
+            donnees = json.dumps({'error': f"model '{corps['model']}' not found"}).encode('utf-8')
+            self.send_response(404)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(donnees)))
+            self.end_headers()
+            self.wfile.write(donnees)
+            return
+        if self.path == '/api/chat':
+            contenu = {'message': {'role': 'assistant', 'content': 'ok'}, 'done': True,
+                       'prompt_eval_count': 10, 'eval_count': 1}
+        else:
+            contenu = {'done': True}
+        donnees = json.dumps(contenu).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(donnees)))
+        self.end_headers()
+        self.wfile.write(donnees)
+        if self.server.fermer_apres is not None and len(self.server.requetes) >= self.server.fermer_apres:
+            # fermeture côté serveur, sans en-tête "Connection: close" (délai d'inactivité dépassé)
+            self.close_connection = True
+            self.server.fermer_apres = None
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def serveur():
+    serveur = ServeurOllama()
+    threading.Thread(target=serveur.serve_forever, args=(0.05,), daemon=True).start()
+    yield serveur
+    serveur.shutdown()
+    serveur.server_close()
+
+
+# =============================================================================
+# pool de connexions
+# =============================================================================
+def test_connexion_reutilisee(serveur):
+    client = ClientOllama(serveur.url, taille_pool=2)
+    for _ in range(5):
+        assert client.requete('/api/chat', {'model': 'm', 'messages': [], 'stream': False})['done']
+    client.fermer()
+    assert len(serveur.requetes) == 5
+    assert len(serveur.connexions) == 1
+
+
+def test_connexion_fermee_par_le_serveur_remplacee(serveur):
+    serveur.fermer_apres = 1
+    client = ClientOllama(serveur.url, taille_pool=2)
+    client.requete('/api/generate', {'model': 'm', 'stream': False})
+    # la connexion du pool a été fermée par le serveur : une nouvelle est ouverte, sans erreur
+    assert client.requete('/api/generate', {'model': 'm', 'stream': False}) == {'done': True}
+    assert client.requete('/api/generate', {'model': 'm', 'stream': False}) == {'done': True}
+    client.fermer()
+    assert len(serveur.requetes) == 3
+    assert len(serveur.connexions) == 2
+
+
+def test_chat_par_le_pool(serveur):
+    llm = ChatOllamaPool(client=ClientOllama(serveur.url), model='tinyllama', keep_alive='30m')
+    assert llm.invoke([HumanMessage(content='question')]).content == 'ok'
+    _, chemin, corps = serveur.requetes[0]
+    assert chemin == '/api/chat'
+    assert corps['messages'] == [{'role': 'user', 'content': 'question'}]
+    assert corps['options']['num_ctx'] == 2048
+    assert corps['keep_alive'] == '30m'
+
+
+# =============================================================================
+# préchargement
+# =============================================================================
+@pytest.mark.parametrize('budget, num_ctx', [(0, 2048), (1200, 2048), (3000, 4096), (20000, 8192)])
+def test_rechauffer(serveur, budget, num_ctx):
+    llm = ChatOllamaPool(client=ClientOllama(serveur.url), model='tinyllama', keep_alive=-1)
+    llm.rechauffer(budget)
+    assert serveur.requetes == [(serveur.requetes[0][0], '/api/generate',
+                                 {'model': 'tinyllama', 'stream': False, 'options': {'num_ctx': num_ctx},
+                                  'keep_alive': -1})]
+
+
+# =============================================================================
+# taille_contexte
+# =============================================================================
+@pytest.mark.parametrize('nb_caracteres, num_predict, attendu', [
+    (0, 512, 2048),
+    # 1536 tokens de prompt + 512 = 2048 : tient juste dans le premier palier
+    (1535 * 3, 512, 2048),
+    (1536 * 3, 512, 4096),
+    (9000, 512, 4096),
+    (9000, 2000, 8192),
+    # au plus num_ctx_max
+    (100000, 512, 8192),
+])
+def test_taille_contexte_paliers(nb_caracteres, num_predict, attendu):
+    assert taille_contexte(nb_caracteres, num_predict, 2048, 8192) == attendu
+
+
+def test_taille_contexte_bornes():
+    assert taille_contexte(0, 512, 1024, 4096) == 1024
+    assert taille_contexte(10 ** 6, 512, 1024, 4096) == 4096
+
+
+# =============================================================================
+# modèle supprimé d'Ollama
+# =============================================================================
+def test_modele_absent_reinstalle(serveur):
+    serveur.modeles_absents.add('tinyllama')
+    installes = []
+
+    def installer(nom):
+        installes.append(nom)
+        serveur.modeles_absents.discard(nom)
+        return True
+
+    llm = ChatOllamaPool(client=ClientOllama(serveur.url), model='tinyllama', installer=installer)
+    assert llm.invoke([HumanMessage(content='question')]).content == 'ok'
+    assert installes == ['tinyllama']
+    assert [chemin for _, chemin, _ in serveur.requetes] == ['/api/chat', '/api/chat']
+
+
+def test_modele_absent_en_flux_et_prechargement(serveur):
+    serveur.modeles_absents.add('tinyllama')
+    llm = ChatOllamaPool(client=ClientOllama(serveur.url), model='tinyllama',
+                         installer=lambda nom: serveur.modeles_absents.discard(nom) is None)
+    llm.rechauffer()
+    serveur.modeles_absents.add('tinyllama')
+    assert ''.join(morceau.content for morceau in llm.stream('question')) == 'ok'
+    assert [chemin for _, chemin, _ in serveur.requetes] == ['/api/generate'] * 2 + ['/api/chat'] * 2
+
+
+def test_modele_absent_sans_installer(serveur):
+    serveur.modeles_absents.add('tinyllama')
+    llm = ChatOllamaPool(client=ClientOllama(serveur.url), model='tinyllama')
+    with pytest.raises(ModeleAbsent, match='HTTP 404'):
+        llm.invoke('question')
+    # l'installation a échoué : l'erreur est levée sans nouvel essai
+    llm = ChatOllamaPool(client=ClientOllama(serveur.url), model='tinyllama', installer=lambda nom: False)
+    with pytest.raises(ModeleAbsent):
+        llm.rechauffer()
+    assert len(serveur.requetes) == 2
+
+
+# =============================================================================
+# présence des modèles (faux exécutable ollama)
+# =============================================================================
+@pytest.fixture
+def ollama(tmp_path):
+    """
+    Faux exécutable ollama : "list" affiche les modèles du fichier installes, "pull" y ajoute le modèle
+    (ou échoue si le fichier echec existe) ; chaque appel est noté dans le fichier appels.
+    """
+    script = tmp_path / 'ollama'
+    script.write_text(f"""#!{sys.executable}
+import os, sys
+repertoire = {str(tmp_path)!r}
+with open(os.path.join(repertoire, 'appels'), 'a') as f:
+    f.write(' '.join(sys.argv[1:]) + '\\n')
+installes = os.path.join(repertoire, 'installes')
+if sys.argv[1] == 'list':
+    print('NAME ID SIZE MODIFIED')
+    if os.path.exists(installes):
+        print(open(installes).read(), end='')
+elif sys.argv[1] == 'pull':
+    if os.path.exists(os.path.join(repertoire, 'echec')):
+        sys.exit("pull impossible")
+    with open(installes, 'a') as f:
+        f.write(sys.argv[2] + ':latest abc 1 GB now\\n')
+""")
+    script.chmod(0o755)
+
+    def appels():
+        chemin = tmp_path / 'appels'
+        return chemin.read_text().splitlines() if chemin.exists() else []
+
+    return str(script), appels
+
+
+def test_modele_installe_memorise(tmp_path, ollama):
+    executable, appels = ollama
+    (tmp_path / 'installes').write_text('tinyllama:latest abc 1 GB now\n')
+    chemin = str(tmp_path / 'data' / 'ollama_models.json')
+    assert assurer_modele('tinyllama', CachePresenceModeles(chemin), executable=executable)
+    assert appels() == ['list']
+    # présence relue depuis le fichier : aucun processus ollama
+    assert assurer_modele('tinyllama', CachePresenceModeles(chemin), executable=executable)
+    assert appels() == ['list']
+    # durée de validité dépassée : nouvelle vérification
+    assert assurer_modele('tinyllama', CachePresenceModeles(chemin, ttl=0), executable=executable)
+    assert appels() == ['list', 'list']
+
+
+def test_modele_absent_telecharge(tmp_path, ollama):
+    executable, appels = ollama
+    cache = CachePresenceModeles(str(tmp_path / 'ollama_models.json'))
+    assert assurer_modele('tinyllama', cache, executable=executable)
+    assert appels() == ['list', 'pull tinyllama']
+    assert cache.est_present('tinyllama:latest')
+    assert assurer_modele('tinyllama', cache, refresh=True, executable=executable)
+    assert appels() == ['list', 'pull tinyllama', 'pull tinyllama']
+
+
+def test_telechargement_en_echec(tmp_path, ollama):
+    executable, appels = ollama
+    chemin = str(tmp_path / 'ollama_models.json')
+    cache = CachePresenceModeles(chemin)
+    cache.enregistrer('tinyllama')
+    (tmp_path / 'echec').write_text('')
+    assert not assurer_modele('tinyllama', cache, refresh=True, executable=executable)
+    assert appels() == ['pull tinyllama']
+    # l'entrée effacée l'est aussi dans le fichier
+    assert not CachePresenceModeles(chemin).est_present('tinyllama')
+    assert not assurer_modele('tinyllama', cache, executable=str(tmp_path / 'introuvable'))
+
+
+def test_oublier_enregistre(tmp_path):
+    chemin = str(tmp_path / 'ollama_models.json')
+    cache = CachePresenceModeles(chemin)
+    cache.enregistrer('tinyllama')
+    cache.enregistrer('mistral:7b')
+    cache.oublier('tinyllama:latest')
+    relu = CachePresenceModeles(chemin)
+    assert not relu.est_present('tinyllama')
+    assert relu.est_present('mistral:7b')
+    assert os.listdir(tmp_path) == ['ollama_models.json']
@@ -0,0 +1,64 @@
+# Fichier : tests/test_pdf_extraction.py
+#
+# Extraction unstructured par tranches de pages (E01, pipeline.py) : les premières pages sont rendues
+# avant que les suivantes ne soient extraites, le cache des pages évite de ré-extraire une page.
+# unstructured est remplacé par un extracteur de test qui lit la largeur de chaque page.
+
+import pypdf
+import pytest
+
+import E01_pdf_to_text
+from E01_pdf_to_text import pages_unstructured
+from page_cache import CachePages
+
+NB_PAGES = 10
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    """
+    PDF de NB_PAGES pages vides, la page n ayant une largeur de 100 + n points (la page 7 est sans texte).
+    """
+    writer = pypdf.PdfWriter()
+    for page_num in range(NB_PAGES):
+        writer.add_blank_page(width=100 + page_num, height=100)
+    chemin = str(tmp_path / 'regles.pdf')
+    with open(chemin, 'wb') as f:
+        writer.write(f)
+    return chemin
+
+
+@pytest.fixture
+def extractions(monkeypatch):
+    """
+    Remplace le chargement unstructured ; retourne la liste des pages passées à chaque appel.
+    """
+    appels = []
+
+    def charger(pdf_file_path):
+        reader = pypdf.PdfReader(pdf_file_path)
+        pages = [int(page.mediabox.width) - 100 for page in reader.pages]
+        appels.append(pages)
+        return {page_tmp: f"page {page_num}" for page_tmp, page_num in enumerate(pages, start=1) if page_num != 7}
+
+    monkeypatch.setattr(E01_pdf_to_text, '_charger_unstructured', charger)
+    return appels
+
+
+def test_pages_rendues_par_tranches(pdf, extractions):
+    pages = pages_unstructured(pdf, pages_par_tache=4)
+    assert next(pages) == 'page 0'
+    # seule la première tranche est extraite quand la première page est rendue
+    assert extractions == [[0, 1, 2, 3]]
+    assert list(pages) == [f"page {n}" if n != 7 else None for n in range(1, NB_PAGES)]
+    assert extractions == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+
+
+def test_cache_des_pages(tmp_path, pdf, extractions):
+    cache = CachePages(str(tmp_path / 'page_cache'))
+    premiere = list(pages_unstructured(pdf, cache, pages_par_tache=3))
+    assert len(extractions) == 4
+    # deuxième passage : tout vient du cache, la page sans texte reste None
+    assert list(pages_unstructured(pdf, cache, pages_par_tache=3)) == premiere
+    assert len(extractions) == 4
+    assert premiere[7] is None
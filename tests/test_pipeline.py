@@ -0,0 +1,29 @@
+# Fichier : tests/test_pipeline.py
+#
+# Chaîne pipeline.py sans aucun morceau produit (PDF sans texte) : l'ancienne base reste en place
+# et aucun répertoire provisoire (base .tmp, chunk store chunks.tmp) ne reste sur le disque.
+# Le modèle d'embedding n'est chargé qu'au premier morceau : il ne l'est pas ici.
+
+import os
+
+import pypdf
+
+from pipeline import lancer_pipeline
+
+
+def test_aucun_morceau(tmp_path):
+    writer = pypdf.PdfWriter()
+    writer.add_blank_page(width=100, height=100)
+    with open(tmp_path / 'regles.pdf', 'wb') as f:
+        writer.write(f)
+    base = tmp_path / 'faiss_index_en'
+    base.mkdir()
+    (base / 'index.faiss').write_text('ancien index')
+    app_config = {'data_dir': str(tmp_path), 'language': 'en', 'rules_en_file': 'regles.pdf',
+                  'embeddings_en_model_name': 'sentence-transformers/all-MiniLM-L6-v2', 'pdf_reader': 'pypdf',
+                  'pdf_workers': 1}
+
+    assert lancer_pipeline(app_config, use_cache=False, force=True) is None
+    assert sorted(os.listdir(tmp_path)) == ['faiss_index_en', 'regles.pdf']
+    assert os.listdir(base) == ['index.faiss']
+    assert (base / 'index.faiss').read_text() == 'ancien index'
@@ -0,0 +1,240 @@
+# Fichier : tests/test_rag_service.py
+#
+# Service HTTP de E04 avec un LLM de test et des embeddings factices (index FAISS réel sur un petit
+# chunk store) : regroupement des recherches en lots, file d'attente du LLM, codes d'erreur HTTP.
+# Recherche hybride avec un modèle multilingue : le classement BM25 reçoit la question traduite
+# (service, mode lot et boucle interactive).
+
+import json
+import time
+import asyncio
+import threading
+import http.client
+from typing import Any
+
+import faiss
+import numpy as np
+import pytest
+from langchain.chains import RetrievalQA
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from batch_queries import traiter_lot
+from chunk_store import ecrire_chunk_store
+from query_pipeline import preparer_question
+from rag_service import ServiceRAG, servir_async
+from vector_store import RetrieverSections, charger_base, sauvegarder_index
+
+TEXTES = [("Pinned units take a morale check before acting.", 'Rules > Morale'),
+          ("A PIAT is an anti-tank weapon with a short range.", 'Army Lists > UK'),
+          ("Units in ambush fire at the end of the enemy move.", 'Rules > Orders'),
+          ("Artillery barrages add pins to every unit in the area.", 'Rules > Artillery'),
+          ("Summary: pinned units take a morale check.", 'RULES SUMMARY')]
+
+
+# =============================================================================
+# LLMTest
+# =============================================================================
+class LLMTest(BaseChatModel):
+    """
+    LLM de test : répond après duree secondes et compte les appels simultanés.
+    """
+    duree: float = 0.05
+    compteurs: Any = None
+
+    @property
+    def _llm_type(self):
+        return 'test'
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        compteurs = self.compteurs
+        with compteurs['verrou']:
+            compteurs['en_cours'] += 1
+            compteurs['max'] = max(compteurs['max'], compteurs['en_cours'])
+        time.sleep(self.duree)
+        with compteurs['verrou']:
+            compteurs['en_cours'] -= 1
+            compteurs['appels'] += 1
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content='réponse'))])
+
+
+@pytest.fixture
+def base(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    chemin_chunks = str(tmp_path / 'chunks_src')
+    ecrire_chunk_store(chemin_chunks, [Document(page_content=t, metadata={'section': s}) for t, s in TEXTES])
+    vecteurs = np.asarray(embeddings.embed_documents([t for t, _ in TEXTES]), dtype=np.float32)
+    index = faiss.IndexFlatL2(vecteurs.shape[1])
+    index.add(vecteurs)
+    sauvegarder_index(index, str(tmp_path / 'index'), chemin_chunks)
+    return charger_base(str(tmp_path / 'index'), embeddings)
+
+
+def creer_chaine(base, duree=0.05, bm25=None):
+    compteurs = {'verrou': threading.Lock(), 'en_cours': 0, 'max': 0, 'appels': 0}
+    llm = LLMTest(duree=duree, compteurs=compteurs)
+    qa_chain = RetrievalQA.from_chain_type(llm=llm, chain_type='stuff',
+                                           retriever=RetrieverSections(db=base, k=2, bm25=bm25, k_candidats=4),
+                                           return_source_documents=True)
+    return qa_chain, llm, compteurs
+
+
+def creer_service(base, concurrence=1, duree=0.05, bm25=None, **options):
+    qa_chain, llm, compteurs = creer_chaine(base, duree, bm25)
+    app_config = {'service_batch_window_ms': 20, 'service_batch_max': 32, 'service_llm_concurrency': concurrence}
+    return ServiceRAG(app_config, base, qa_chain, llm, **options), compteurs
+
+
+# =============================================================================
+# recherche par lots
+# =============================================================================
+def test_questions_simultanees_en_un_lot(base):
+    service, compteurs = creer_service(base, concurrence=4, duree=0.0)
+
+    async def poser():
+        return await asyncio.gather(*(service.repondre(f"question {i} about pinned units") for i in range(8)))
+
+    reponses = asyncio.run(poser())
+    assert [r['answer_en'] for r in reponses] == ['réponse'] * 8
+    assert all(len(r['sources']) == 2 for r in reponses)
+    assert service.lots.nb_lots == 1
+    assert service.lots.nb_questions == 8
+    assert compteurs['appels'] == 8
+
+
+def test_restriction_aux_sections(base):
+    service, _ = creer_service(base, duree=0.0)
+    reponse = asyncio.run(service.repondre("pinned", ['summary']))
+    assert [source['section'] for source in reponse['sources']] == ['RULES SUMMARY']
+
+
+# =============================================================================
+# file d'attente du LLM
+# =============================================================================
+@pytest.mark.parametrize('concurrence', [1, 2])
+def test_concurrence_llm_respectee(base, concurrence):
+    service, compteurs = creer_service(base, concurrence=concurrence, duree=0.05)
+
+    async def poser():
+        return await asyncio.gather(*(service.repondre(f"question {i}") for i in range(6)))
+
+    asyncio.run(poser())
+    assert compteurs['appels'] == 6
+    assert compteurs['max'] == concurrence
+
+
+# =============================================================================
+# HTTP
+# =============================================================================
+@pytest.fixture
+def adresse(base):
+    service, _ = creer_service(base, duree=0.0)
+    pret = threading.Event()
+    resultat = {}
+
+    def lancer():
+        boucle = asyncio.new_event_loop()
+        resultat['boucle'] = boucle
+
+        def signaler(adresse):
+            resultat['adresse'] = adresse
+            pret.set()
+
+        resultat['tache'] = boucle.create_task(servir_async(service, '127.0.0.1', 0, signaler))
+        try:
+            boucle.run_until_complete(resultat['tache'])
+        except asyncio.CancelledError:
+            pass
+
+    fil = threading.Thread(target=lancer, daemon=True)
+    fil.start()
+    assert pret.wait(5)
+    yield resultat['adresse']
+    resultat['boucle'].call_soon_threadsafe(resultat['tache'].cancel)
+    fil.join(5)
+
+
+def envoyer(adresse, methode, chemin, corps=None):
+    connexion = http.client.HTTPConnection(*adresse, timeout=5)
+    donnees = corps if isinstance(corps, bytes) or corps is None else json.dumps(corps).encode('utf-8')
+    connexion.request(methode, chemin, body=donnees, headers={'Content-Type': 'application/json'})
+    reponse = connexion.getresponse()
+    contenu = json.loads(reponse.read())
+    connexion.close()
+    return reponse.status, contenu
+
+
+def test_http_question(adresse):
+    statut, contenu = envoyer(adresse, 'POST', '/query', {'question': 'pinned units', 'sections': ['rules']})
+    assert statut == 200
+    assert contenu['answer_en'] == 'réponse'
+    statut, contenu = envoyer(adresse, 'GET', '/health')
+    assert statut == 200 and contenu['questions'] == 1
+
+
+@pytest.mark.parametrize('methode, chemin, corps, statut', [
+    ('POST', '/query', b'{pas du json', 400),
+    ('POST', '/query', {'sections': ['rules']}, 400),
+    ('POST', '/query', {'question': '   '}, 400),
+    ('POST', '/query', {'question': 'pinned', 'sections': 'summary'}, 400),
+    ('POST', '/query', {'question': 'pinned', 'sections': ['rules', 3]}, 400),
+    ('GET', '/query', None, 405),
+    ('POST', '/inconnu', {'question': 'pinned'}, 404),
+])
+def test_http_erreurs(adresse, methode, chemin, corps, statut):
+    assert envoyer(adresse, methode, chemin, corps)[0] == statut
+
+
+# =============================================================================
+# recherche hybride : BM25 sur la question traduite
+# =============================================================================
+class BM25Test:
+    """
+    Index BM25 de test : note les requêtes reçues, classe le morceau 1 en tête.
+    """
+
+    def __init__(self):
+        self.requetes = []
+
+    def rechercher(self, requete, k, ids=None):
+        self.requetes.append(requete)
+        return [(1, 1.0)]
+
+
+class TraducteurTest:
+    def traduire(self, texte, source, cible):
+        return f"[{cible}] {texte}"
+
+
+@pytest.mark.parametrize('multilingue', [True, False])
+def test_bm25_question_traduite_service(base, multilingue):
+    bm25 = BM25Test()
+    service, _ = creer_service(base, duree=0.0, bm25=bm25, traducteur=TraducteurTest(), multilingue=multilingue)
+    reponse = asyncio.run(service.repondre("portée d'un PIAT"))
+    assert bm25.requetes == ["[en] portée d'un PIAT"]
+    assert reponse['question_en'] == "[en] portée d'un PIAT"
+    assert len(reponse['sources']) == 2
+    assert '1' in [source['id'] for source in reponse['sources']]
+
+
+@pytest.mark.parametrize('multilingue', [True, False])
+def test_bm25_question_traduite_pipeline(base, multilingue):
+    bm25 = BM25Test()
+    qa_chain, _, _ = creer_chaine(base, bm25=bm25)
+    question_en, documents = preparer_question("portée d'un PIAT", qa_chain.retriever, TraducteurTest(), multilingue)
+    assert question_en == "[en] portée d'un PIAT"
+    assert bm25.requetes == [question_en]
+    assert '1' in [document.id for document in documents]
+
+
+@pytest.mark.parametrize('multilingue', [True, False])
+def test_bm25_question_traduite_lot(base, multilingue):
+    bm25 = BM25Test()
+    qa_chain, llm, _ = creer_chaine(base, duree=0.0, bm25=bm25)
+    questions = [{'question': "portée d'un PIAT"}, {'question': 'tir en embuscade'}]
+    resultats = list(traiter_lot(questions, base, qa_chain, llm, TraducteurTest(), multilingue))
+    assert sorted(bm25.requetes) == ["[en] portée d'un PIAT", '[en] tir en embuscade']
+    assert all(len(resultat['sources']) == 2 for resultat in resultats)
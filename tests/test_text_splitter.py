@@ -0,0 +1,75 @@
+# Fichier : tests/test_text_splitter.py
+#
+# Parité de DecoupeurTexte avec RecursiveCharacterTextSplitter de LangChain : textes aléatoires
+# (graines fixes, comme python text_splitter.py --fuzz) et extrait de texte de règles nettoyé.
+
+import os
+import random
+
+import pytest
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from text_splitter import DecoupeurSections, DecoupeurTexte, _texte_aleatoire, verifier_parite
+
+EXTRAIT = os.path.join(os.path.dirname(__file__), 'data', 'extrait_regles.txt')
+
+
+@pytest.fixture(scope='module')
+def extrait():
+    with open(EXTRAIT, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+# =============================================================================
+# textes aléatoires
+# =============================================================================
+@pytest.mark.parametrize('graine', range(10))
+def test_parite_textes_aleatoires(graine):
+    rng = random.Random(graine)
+    for _ in range(30):
+        taille = rng.choice([5, 20, 100, 1000])
+        texte = _texte_aleatoire(rng)
+        chevauchement = rng.randint(0, taille)
+        identiques, _, _ = verifier_parite(texte, taille, chevauchement)
+        assert identiques, f"graine {graine}, chunk_size={taille}, chunk_overlap={chevauchement}"
+
+
+# =============================================================================
+# texte de règles
+# =============================================================================
+@pytest.mark.parametrize('chunk_size, chunk_overlap', [(1000, 150), (500, 100), (200, 0), (120, 120), (50, 10)])
+def test_parite_texte_de_regles(extrait, chunk_size, chunk_overlap):
+    morceaux = DecoupeurTexte(chunk_size, chunk_overlap).split_text(extrait)
+    reference = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap).split_text(extrait)
+    assert morceaux == reference
+
+
+def test_start_index_comme_langchain(extrait):
+    documents = DecoupeurTexte(300, 50, add_start_index=True).create_documents([extrait])
+    reference = RecursiveCharacterTextSplitter(chunk_size=300, chunk_overlap=50,
+                                               add_start_index=True).create_documents([extrait])
+    assert [(d.page_content, d.metadata) for d in documents] == [(d.page_content, d.metadata) for d in reference]
+
+
+def test_pool_de_processus_identique(extrait):
+    textes = [extrait, extrait.upper(), extrait[:2000]]
+    sequentiel = DecoupeurTexte(400, 80, nb_workers=1).offsets_textes(textes)
+    assert DecoupeurTexte(400, 80, nb_workers=2).offsets_textes(textes) == sequentiel
+
+
+# =============================================================================
+# sections
+# =============================================================================
+def test_sections_ne_chevauchent_pas_les_titres(extrait):
+    documents = DecoupeurSections(DecoupeurTexte(400, 80)).create_documents([extrait])
+    sections = [document.metadata['section'] for document in documents]
+    assert 'SHOOTING > RANGE AND DICE' in sections
+    assert 'INTRODUCTION > ORDERS > ORDER TESTS' in sections
+    # un titre de chapitre suivi d'un sous-titre est rattaché à la section du sous-titre
+    assert 'SHOOTING' not in sections
+    for document in documents:
+        # aucun titre après le contenu d'un morceau : il appartiendrait à une autre section
+        lignes = [ligne for ligne in document.page_content.splitlines() if ligne.strip()]
+        while lignes and lignes[0].startswith('#'):
+            lignes.pop(0)
+        assert not any(ligne.startswith('#') for ligne in lignes), document.page_content
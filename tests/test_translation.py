@@ -0,0 +1,44 @@
+# Fichier : tests/test_translation.py
+#
+# Cache des traductions : le backend reçoit le texte d'origine (mise en forme conservée),
+# les espaces ne sont normalisés que pour la clé du cache.
+
+from translation import CacheTraductions, Traducteur, TraducteurEnCache
+
+
+# =============================================================================
+# TraducteurTest
+# =============================================================================
+class TraducteurTest(Traducteur):
+    """
+    Backend de test : enregistre les textes reçus et les renvoie préfixés de la langue cible.
+    """
+    nom = 'test'
+
+    def __init__(self):
+        self.textes = []
+
+    def traduire(self, texte, source, cible):
+        self.textes.append(texte)
+        return f"[{cible}] {texte}"
+
+
+def test_mise_en_forme_conservee(tmp_path):
+    backend = TraducteurTest()
+    traducteur = TraducteurEnCache(backend, CacheTraductions(str(tmp_path / 'cache.json')))
+    reponse = "Ordres possibles :\n\n- Feu\n- Avance\n"
+    assert traducteur.traduire(reponse, 'fr', 'en') == "[en] " + reponse
+    assert backend.textes == [reponse]
+
+
+def test_cle_normalisee(tmp_path):
+    backend = TraducteurTest()
+    cache = CacheTraductions(str(tmp_path / 'cache.json'))
+    traducteur = TraducteurEnCache(backend, cache)
+    traducteur.traduire("Quelle est la portée  d'un PIAT ?", 'fr', 'en')
+    traducteur.traduire(" Quelle est la portée\nd'un PIAT ? ", 'fr', 'en')
+    assert len(backend.textes) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    # texte sans contenu : ni backend ni cache
+    assert traducteur.traduire(" \n", 'fr', 'en') == " \n"
+    assert len(backend.textes) == 1
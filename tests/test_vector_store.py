@@ -0,0 +1,79 @@
+# Fichier : tests/test_vector_store.py
+#
+# Chargement de la base vectorielle avec l'index projeté en mémoire (démarrage rapide de E04) :
+# mêmes résultats que l'index lu en entier, pour chaque type d'index.
+# Remplacement d'une base : index et chunk store mis en place ensemble, rien de provisoire ne reste.
+
+import os
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from chunk_store import ChunkStore, EcrivainChunkStore, ecrire_chunk_store
+from vector_store import charger_base, creer_index, sauvegarder_index
+
+NB_MORCEAUX = 600
+
+
+def construire_base(tmp_path, textes, nom='index', app_config=None):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    chemin_chunks = str(tmp_path / f'chunks_{len(textes)}')
+    ecrire_chunk_store(chemin_chunks, [Document(page_content=texte) for texte in textes])
+    vecteurs = np.asarray(embeddings.embed_documents(textes), dtype=np.float32)
+    index = creer_index(app_config or {}, vecteurs.shape[1], vecteurs)
+    index.add(vecteurs)
+    sauvegarder_index(index, str(tmp_path / nom), chemin_chunks)
+    return embeddings, vecteurs
+
+
+@pytest.mark.parametrize('type_index', ['flat', 'hnsw', 'ivf', 'ivfpq'])
+def test_index_projete_en_memoire(tmp_path, type_index):
+    app_config = {'faiss_index_type': type_index, 'faiss_ivf_nlist': 8, 'faiss_ivf_nprobe': 8, 'faiss_pq_m': 4,
+                  'faiss_pq_nbits': 4}
+    embeddings, vecteurs = construire_base(tmp_path, [f"morceau {i}" for i in range(NB_MORCEAUX)],
+                                           app_config=app_config)
+
+    lue = charger_base(str(tmp_path / 'index'), embeddings, app_config)
+    projetee = charger_base(str(tmp_path / 'index'), embeddings, app_config, mmap=True)
+    assert projetee.index.ntotal == NB_MORCEAUX
+    requetes = vecteurs[:20]
+    assert np.array_equal(projetee.index.search(requetes, 5)[1], lue.index.search(requetes, 5)[1])
+    assert projetee.similarity_search("morceau 3", k=1)[0].page_content == "morceau 3"
+
+
+# =============================================================================
+# remplacement de la base
+# =============================================================================
+def test_base_remplacee_en_bloc(tmp_path):
+    embeddings, _ = construire_base(tmp_path, [f"ancien {i}" for i in range(50)])
+    # E04 en cours : l'ancienne base est projetée en mémoire
+    ancienne = charger_base(str(tmp_path / 'index'), embeddings, mmap=True)
+    (tmp_path / 'index' / 'index.pkl').write_bytes(b'ancien format')
+    construire_base(tmp_path, [f"nouveau {i}" for i in range(30)])
+
+    assert sorted(os.listdir(tmp_path)) == ['chunks_30', 'chunks_50', 'index']
+    assert sorted(os.listdir(tmp_path / 'index')) == ['chunks', 'index.faiss']
+    nouvelle = charger_base(str(tmp_path / 'index'), embeddings)
+    assert nouvelle.index.ntotal == 30
+    assert nouvelle.similarity_search("nouveau 4", k=1)[0].page_content == "nouveau 4"
+    # l'ancienne base reste lisible jusqu'à la fin de E04
+    assert ancienne.index.ntotal == 50
+    assert len(ancienne.index.search(np.zeros((1, 16), dtype=np.float32), 3)[1][0]) == 3
+
+
+def test_ecriture_abandonnee(tmp_path):
+    chemin = str(tmp_path / 'chunks')
+    ecrire_chunk_store(chemin, [Document(page_content='ancien')])
+    ecrivain = EcrivainChunkStore(chemin)
+    ecrivain.ajouter('nouveau')
+    ecrivain.abandonner()
+    assert os.listdir(tmp_path) == ['chunks']
+    assert list(ChunkStore(chemin).textes()) == ['ancien']
+    # après fermer(), abandonner() ne retire rien
+    ecrivain = EcrivainChunkStore(chemin)
+    ecrivain.ajouter('nouveau')
+    ecrivain.fermer()
+    ecrivain.abandonner()
+    assert list(ChunkStore(chemin).textes()) == ['nouveau']
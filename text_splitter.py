@@ -0,0 +1,387 @@
+# Fichier : text_splitter.py
+#
+# Découpeur de texte en morceaux (chunks) donnant exactement les mêmes morceaux que
+# RecursiveCharacterTextSplitter de LangChain (séparateurs conservés en début de morceau,
+# espaces retirés aux extrémités), mais calculé sur des positions (début, fin) dans le
+# texte source : aucune sous-chaîne intermédiaire n'est créée, seuls les morceaux finaux
+# sont extraits. Plusieurs textes indépendants (livres, sections) peuvent être découpés
+# dans un pool de processus.
+# DecoupeurSections découpe d'abord le texte Markdown selon ses titres (## / ###) : aucun
+# morceau n'est à cheval sur deux sections, et chaque morceau porte dans ses métadonnées
+# le chemin de sa section ('section' : "ARMIES OF GERMANY > INFANTRY SQUADS ...").
+#
+# Vérification de la parité avec LangChain : python text_splitter.py (--cfg=<filename>) (--fuzz=<n>)
+
+import os
+import re
+import sys
+import time
+import random
+import getopt
+from concurrent.futures import ProcessPoolExecutor
+
+from config import load_config, bcolors, logger
+
+# titre Markdown sur une ligne : niveau (nombre de '#') et texte
+_RE_TITRE = re.compile(r'^(#{1,6})[ \t]+(\S.*?)[ \t]*$', re.MULTILINE)
+_RE_CONTENU = re.compile(r'\S')
+SEPARATEUR_SECTION = ' > '
+
+
+# =============================================================================
+# DecoupeurTexte
+# =============================================================================
+class DecoupeurTexte:
+    """
+    Remplaçant de RecursiveCharacterTextSplitter (keep_separator=True, strip_whitespace=True,
+    séparateurs littéraux, longueur en caractères) travaillant sur des offsets.
+    """
+
+    def __init__(self, chunk_size=1000, chunk_overlap=150, separators=None, nb_workers=1, add_start_index=False):
+        if chunk_size <= 0:
+            raise ValueError(f"chunk_size doit être > 0 : {chunk_size}")
+        if not 0 <= chunk_overlap <= chunk_size:
+            raise ValueError(f"chunk_overlap doit être compris entre 0 et chunk_size : {chunk_overlap}")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = list(separators or ["\n\n", "\n", " ", ""])
+        self.nb_workers = nb_workers
+        self.add_start_index = add_start_index
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _morceaux_separes(texte, debut, fin, separateur):
+        """
+        Positions des morceaux de texte[debut:fin] coupés avant chaque occurrence du séparateur
+        (le séparateur reste au début du morceau suivant) ; les morceaux vides sont ignorés.
+        """
+        if not separateur:
+            return [(i, i + 1) for i in range(debut, fin)]
+        morceaux = []
+        precedent = debut
+        position = texte.find(separateur, debut, fin)
+        while position != -1:
+            if position > precedent:
+                morceaux.append((precedent, position))
+            precedent = position
+            position = texte.find(separateur, position + len(separateur), fin)
+        if fin > precedent:
+            morceaux.append((precedent, fin))
+        return morceaux
+
+    @staticmethod
+    def _sans_espaces(texte, debut, fin):
+        while debut < fin and texte[debut].isspace():
+            debut += 1
+        while fin > debut and texte[fin - 1].isspace():
+            fin -= 1
+        return debut, fin
+
+    def _fusionner(self, texte, morceaux, resultat):
+        """
+        Regroupe des morceaux contigus en blocs d'au plus chunk_size caractères avec chevauchement
+        (même algorithme que TextSplitter._merge_splits, séparateur de fusion vide).
+        """
+        premier = 0
+        total = 0
+        for k, (debut, fin) in enumerate(morceaux):
+            longueur = fin - debut
+            if total + longueur > self.chunk_size:
+                if k > premier:
+                    bloc = self._sans_espaces(texte, morceaux[premier][0], morceaux[k - 1][1])
+                    if bloc[1] > bloc[0]:
+                        resultat.append(bloc)
+                    while total > self.chunk_overlap or (total + longueur > self.chunk_size and total > 0):
+                        total -= morceaux[premier][1] - morceaux[premier][0]
+                        premier += 1
+            total += longueur
+        if len(morceaux) > premier:
+            bloc = self._sans_espaces(texte, morceaux[premier][0], morceaux[-1][1])
+            if bloc[1] > bloc[0]:
+                resultat.append(bloc)
+
+    def _decouper(self, texte, debut, fin, separators, resultat):
+        separateur = separators[-1]
+        suivants = []
+        for i, candidat in enumerate(separators):
+            if candidat == "":
+                separateur = candidat
+                break
+            if texte.find(candidat, debut, fin) != -1:
+                separateur = candidat
+                suivants = separators[i + 1:]
+                break
+
+        bons = []
+        for morceau in self._morceaux_separes(texte, debut, fin, separateur):
+            if morceau[1] - morceau[0] < self.chunk_size:
+                bons.append(morceau)
+                continue
+            if bons:
+                self._fusionner(texte, bons, resultat)
+                bons = []
+            if not suivants:
+                # morceau trop long sans séparateur plus fin : gardé tel quel (non nettoyé, comme LangChain)
+                resultat.append(morceau)
+            else:
+                self._decouper(texte, morceau[0], morceau[1], suivants, resultat)
+        if bons:
+            self._fusionner(texte, bons, resultat)
+
+    # -------------------------------------------------------------------------
+    def split_offsets(self, texte):
+        """
+        Positions (début, fin) des morceaux dans le texte.
+        """
+        resultat = []
+        self._decouper(texte, 0, len(texte), self.separators, resultat)
+        return resultat
+
+    def split_text(self, texte):
+        return [texte[debut:fin] for debut, fin in self.split_offsets(texte)]
+
+    def _nb_workers(self, nb_taches):
+        nb_workers = self.nb_workers
+        if nb_workers is None or nb_workers <= 0:
+            nb_workers = os.cpu_count() or 1
+        return min(nb_workers, nb_taches)
+
+    def _dans_pool(self, textes, nb_workers):
+        parametres = (self.chunk_size, self.chunk_overlap, self.separators)
+        with ProcessPoolExecutor(max_workers=nb_workers) as pool:
+            # seules les positions reviennent des workers, pas les textes des morceaux
+            return list(pool.map(_split_offsets, [parametres] * len(textes), textes,
+                                 chunksize=max(1, len(textes) // (4 * nb_workers))))
+
+    def offsets_textes(self, textes):
+        """
+        Positions des morceaux de chaque texte, dans un pool de processus s'il y a plusieurs textes
+        et plusieurs workers.
+        """
+        nb_workers = self._nb_workers(len(textes))
+        if nb_workers <= 1:
+            return [self.split_offsets(texte) for texte in textes]
+        return self._dans_pool(textes, nb_workers)
+
+    def offsets_plages(self, texte, plages):
+        """
+        Positions des morceaux de chaque plage (début, fin) du texte, découpée indépendamment des autres.
+        """
+        nb_workers = self._nb_workers(len(plages))
+        if nb_workers <= 1:
+            resultat = []
+            for debut, fin in plages:
+                offsets = []
+                self._decouper(texte, debut, fin, self.separators, offsets)
+                resultat.append(offsets)
+            return resultat
+        offsets_locaux = self._dans_pool([texte[debut:fin] for debut, fin in plages], nb_workers)
+        return [[(debut + a, debut + b) for a, b in offsets] for (debut, _), offsets in zip(plages, offsets_locaux)]
+
+    def create_documents(self, texts, metadatas=None):
+        from langchain_core.documents import Document
+
+        metadatas = metadatas or [{}] * len(texts)
+        documents = []
+        for texte, metadata, offsets in zip(texts, metadatas, self.offsets_textes(texts)):
+            for debut, fin in offsets:
+                metadata_morceau = dict(metadata)
+                if self.add_start_index:
+                    metadata_morceau['start_index'] = debut
+                documents.append(Document(page_content=texte[debut:fin], metadata=metadata_morceau))
+        return documents
+
+
+# =============================================================================
+# sections_markdown
+# =============================================================================
+def sections_markdown(texte, chemin=()):
+    """
+    Découpe un texte Markdown selon ses titres. Retourne la liste des sections (début, fin, chemin)
+    et le chemin en vigueur à la fin du texte (pour le texte suivant d'un flux). Le chemin est un
+    tuple de (niveau, titre) : un titre remplace ceux de niveau égal ou inférieur. Une section qui
+    ne contient que des titres est rattachée à la suivante (titre de chapitre suivi d'un sous-titre).
+    """
+    sections = []
+    debut_section = 0
+    fin_titre = 0
+    for titre in _RE_TITRE.finditer(texte):
+        if _RE_CONTENU.search(texte, fin_titre, titre.start()):
+            sections.append((debut_section, titre.start(), chemin))
+            debut_section = titre.start()
+        niveau = len(titre.group(1))
+        chemin = tuple(c for c in chemin if c[0] < niveau) + ((niveau, titre.group(2)),)
+        fin_titre = titre.end()
+    if _RE_CONTENU.search(texte, debut_section):
+        sections.append((debut_section, len(texte), chemin))
+    return sections, chemin
+
+
+# =============================================================================
+# nom_section
+# =============================================================================
+def nom_section(chemin):
+    return SEPARATEUR_SECTION.join(titre for _, titre in chemin)
+
+
+# =============================================================================
+# DecoupeurSections
+# =============================================================================
+class DecoupeurSections:
+    """
+    Découpage selon la hiérarchie des titres Markdown puis, dans chaque section, par le DecoupeurTexte ;
+    le chemin de la section est ajouté aux métadonnées de chaque morceau ('section').
+    """
+
+    def __init__(self, decoupeur):
+        self.decoupeur = decoupeur
+
+    def documents(self, texte, chemin=(), metadata=None):
+        """
+        Documents d'un texte dont la première section hérite du chemin donné ;
+        retourne (documents, chemin à la fin du texte).
+        """
+        from langchain_core.documents import Document
+
+        sections, chemin_final = sections_markdown(texte, chemin)
+        offsets_sections = self.decoupeur.offsets_plages(texte, [(debut, fin) for debut, fin, _ in sections])
+        documents = []
+        for (_, _, chemin_section), offsets in zip(sections, offsets_sections):
+            for debut, fin in offsets:
+                metadata_morceau = dict(metadata or {})
+                if chemin_section:
+                    metadata_morceau['section'] = nom_section(chemin_section)
+                if self.decoupeur.add_start_index:
+                    metadata_morceau['start_index'] = debut
+                documents.append(Document(page_content=texte[debut:fin], metadata=metadata_morceau))
+        return documents, chemin_final
+
+    def split_text(self, texte):
+        return [doc.page_content for doc in self.documents(texte)[0]]
+
+    def create_documents(self, texts, metadatas=None):
+        metadatas = metadatas or [{}] * len(texts)
+        documents = []
+        for texte, metadata in zip(texts, metadatas):
+            documents.extend(self.documents(texte, metadata=metadata)[0])
+        return documents
+
+
+# =============================================================================
+# _split_offsets
+# =============================================================================
+def _split_offsets(parametres, texte):
+    """
+    Tâche du pool : découpage d'un texte.
+    """
+    chunk_size, chunk_overlap, separators = parametres
+    return DecoupeurTexte(chunk_size, chunk_overlap, separators).split_offsets(texte)
+
+
+# =============================================================================
+# verifier_parite
+# =============================================================================
+def verifier_parite(texte, chunk_size=1000, chunk_overlap=150, separators=None):
+    """
+    Compare les morceaux de DecoupeurTexte et de RecursiveCharacterTextSplitter pour un texte ;
+    retourne (identiques, durée DecoupeurTexte, durée LangChain).
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    separators = separators or ["\n\n", "\n", " ", ""]
+    debut = time.perf_counter()
+    morceaux = DecoupeurTexte(chunk_size, chunk_overlap, separators).split_text(texte)
+    duree = time.perf_counter() - debut
+    debut = time.perf_counter()
+    reference = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                                               separators=separators).split_text(texte)
+    duree_reference = time.perf_counter() - debut
+    return morceaux == reference, duree, duree_reference
+
+
+# =============================================================================
+# _texte_aleatoire
+# =============================================================================
+def _texte_aleatoire(rng):
+    mots = ["a", "bb", "ccc", "tir", "mouvement", "  ", "\t", "x" * rng.randint(1, 40)]
+    separateurs = [" ", " ", " ", "\n", "\n\n", "\n\n\n", " \n", "\n \n"]
+    morceaux = []
+    for _ in range(rng.randint(0, 400)):
+        morceaux.append(rng.choice(mots))
+        morceaux.append(rng.choice(separateurs))
+    if rng.random() < 0.1:
+        # mot très long sans séparateur
+        morceaux.append("y" * rng.randint(1, 300))
+    return ''.join(morceaux)
+
+
+# =============================================================================
+# usage
+# =============================================================================
+def usage():
+    """
+    afficher le message d'aide
+
+    :return:
+    """
+    script_name = os.path.basename(__file__)
+    print(f"{script_name}  : () facultative item, <> : mandatory item\n"
+          "    (--cfg=<filename>)\n"
+          "    (--in=<fichier texte à découper, par défaut le .txt nettoyé de la configuration>)\n"
+          "    (--fuzz=<nombre de textes aléatoires à comparer en plus>)\n"
+          "    (-h : this help)\n")
+
+
+# =============================================================================
+# MAIN : vérification de la parité avec RecursiveCharacterTextSplitter
+# =============================================================================
+if __name__ == '__main__':
+    cfg_filename = None
+    input_txt_path = None
+    nb_fuzz = 0
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "h", ["cfg=", "in=", "fuzz="])
+    except getopt.GetoptError as err:
+        logger.error(err)
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            sys.exit()
+        elif opt == "--cfg":
+            cfg_filename = arg
+        elif opt == "--in":
+            input_txt_path = arg
+        elif opt == "--fuzz":
+            nb_fuzz = int(arg)
+
+    app_config = load_config(cfg_filename=cfg_filename)
+    chunk_size = int(app_config.get('chunk_size', 1000))
+    chunk_overlap = int(app_config.get('chunk_overlap', 150))
+    if input_txt_path is None:
+        rules_file = app_config['rules_' + app_config['language'] + '_file']
+        input_txt_path = os.path.join(app_config['data_dir'], rules_file.replace('.pdf', '.txt'))
+
+    echecs = 0
+    if os.path.exists(input_txt_path):
+        with open(input_txt_path, 'r', encoding='utf-8') as f:
+            texte = f.read()
+        identiques, duree, duree_reference = verifier_parite(texte, chunk_size, chunk_overlap)
+        logger.info(f"{bcolors.INPUT}{input_txt_path}{bcolors.ENDC} : "
+                    f"{'morceaux identiques' if identiques else 'MORCEAUX DIFFÉRENTS'} "
+                    f"(DecoupeurTexte {duree:.3f} s, RecursiveCharacterTextSplitter {duree_reference:.3f} s)")
+        echecs += not identiques
+    else:
+        logger.warning(f"fichier '{input_txt_path}' absent : seuls les textes aléatoires sont comparés")
+
+    rng = random.Random(0)
+    for n in range(nb_fuzz):
+        taille = rng.choice([5, 20, 100, chunk_size])
+        identiques, _, _ = verifier_parite(_texte_aleatoire(rng), taille, rng.randint(0, taille))
+        if not identiques:
+            logger.error(f"texte aléatoire n°{n} (chunk_size={taille}) : morceaux différents")
+            echecs += 1
+    if nb_fuzz:
+        logger.info(f"{nb_fuzz} textes aléatoires comparés, {echecs} différence(s)")
+    sys.exit(1 if echecs else 0)
@@ -0,0 +1,224 @@
+# Fichier : translation.py
+#
+# Traduction français <-> anglais des questions et des réponses de E04.
+# Backends (translation_backend dans cfg.yaml) :
+#   - google  : Google Translate (deep_translator), nécessite un accès réseau
+#   - offline : modèles MarianMT locaux (Helsinki-NLP/opus-mt-<source>-<cible>, transformers et sentencepiece),
+#               téléchargés une fois puis utilisables hors ligne
+#   - stub    : traduction factice "[<cible>] texte", pour les essais sans réseau ni modèle
+#   - none    : pas de traduction (index et LLM multilingues, language: fr)
+#   - auto    : none pour language: fr, google sinon
+# Les traducteurs sont créés une fois par sens de traduction et réutilisés.
+# Les segments traduits (questions, phrases des réponses) sont gardés dans un cache LRU
+# persistant (<data_dir>/translation_cache.json) : les termes de règles et les questions
+# courantes se répètent, leur traduction n'est demandée qu'une fois.
+
+import os
+import json
+import tempfile
+import threading
+from collections import OrderedDict
+
+from config import logger
+
+BACKENDS = ['auto', 'google', 'offline', 'stub', 'none']
+CACHE_FILE = 'translation_cache.json'
+
+
+# =============================================================================
+# Traducteur
+# =============================================================================
+class Traducteur:
+    """
+    Interface des backends de traduction.
+    """
+    nom = None
+
+    def traduire(self, texte, source, cible):
+        raise NotImplementedError
+
+    def enregistrer(self):
+        pass
+
+    def log_stats(self):
+        pass
+
+
+# =============================================================================
+# TraducteurGoogle
+# =============================================================================
+class TraducteurGoogle(Traducteur):
+    nom = 'google'
+
+    def __init__(self):
+        self.traducteurs = {}
+
+    def traduire(self, texte, source, cible):
+        traducteur = self.traducteurs.get((source, cible))
+        if traducteur is None:
+            from deep_translator import GoogleTranslator
+
+            # source 'auto' : la question peut être saisie dans une autre langue que le français
+            traducteur = self.traducteurs[(source, cible)] = GoogleTranslator(source='auto', target=cible)
+        return traducteur.translate(texte)
+
+
+# =============================================================================
+# TraducteurMarian
+# =============================================================================
+class TraducteurMarian(Traducteur):
+    nom = 'offline'
+
+    def __init__(self, modele='Helsinki-NLP/opus-mt-{source}-{cible}'):
+        self.modele = modele
+        self.pipelines = {}
+        self.verrou = threading.Lock()
+
+    def _pipeline(self, source, cible):
+        with self.verrou:
+            if (source, cible) not in self.pipelines:
+                from transformers import pipeline
+
+                nom = self.modele.format(source=source, cible=cible)
+                logger.info(f"Chargement du modèle de traduction '{nom}'...")
+                self.pipelines[(source, cible)] = pipeline('translation', model=nom)
+            return self.pipelines[(source, cible)]
+
+    def traduire(self, texte, source, cible):
+        return self._pipeline(source, cible)(texte)[0]['translation_text']
+
+
+# =============================================================================
+# TraducteurStub
+# =============================================================================
+class TraducteurStub(Traducteur):
+    nom = 'stub'
+
+    def traduire(self, texte, source, cible):
+        return f"[{cible}] {texte}"
+
+
+# =============================================================================
+# CacheTraductions
+# =============================================================================
+class CacheTraductions:
+    """
+    Cache LRU des segments traduits, enregistré dans un fichier JSON ; utilisable par plusieurs threads.
+    """
+
+    def __init__(self, chemin, taille=5000):
+        self.chemin = chemin
+        self.taille = max(1, int(taille))
+        self.entrees = OrderedDict()
+        self.verrou = threading.Lock()
+        self.modifie = False
+        self.hits = 0
+        self.misses = 0
+        if chemin and os.path.exists(chemin):
+            try:
+                with open(chemin, 'r', encoding='utf-8') as f:
+                    # du moins au plus récemment utilisé
+                    self.entrees = OrderedDict((tuple(cle), traduction) for cle, traduction in json.load(f))
+            except (OSError, ValueError, TypeError) as e:
+                logger.warning(f"cache des traductions '{chemin}' illisible : {e}")
+            while len(self.entrees) > self.taille:
+                self.entrees.popitem(last=False)
+
+    def lire(self, cle):
+        with self.verrou:
+            traduction = self.entrees.get(cle)
+            if traduction is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entrees.move_to_end(cle)
+            return traduction
+
+    def ajouter(self, cle, traduction):
+        with self.verrou:
+            self.entrees[cle] = traduction
+            self.entrees.move_to_end(cle)
+            while len(self.entrees) > self.taille:
+                self.entrees.popitem(last=False)
+            self.modifie = True
+
+    def enregistrer(self):
+        with self.verrou:
+            if not self.chemin or not self.modifie:
+                return
+            repertoire = os.path.dirname(self.chemin) or '.'
+            os.makedirs(repertoire, exist_ok=True)
+            fd, chemin_tmp = tempfile.mkstemp(dir=repertoire, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump([[list(cle), traduction] for cle, traduction in self.entrees.items()], f,
+                          ensure_ascii=False)
+            os.replace(chemin_tmp, self.chemin)
+            self.modifie = False
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        taux = f" ({100 * self.hits / total:.1f} % de hits)" if total else ""
+        logger.info(f"cache des traductions : {self.hits} segments servis depuis le cache, "
+                    f"{self.misses} segments traduits{taux}")
+
+
+# =============================================================================
+# TraducteurEnCache
+# =============================================================================
+class TraducteurEnCache(Traducteur):
+    """
+    Traducteur qui ne délègue au backend que les segments absents du cache.
+    """
+
+    def __init__(self, traducteur, cache):
+        self.traducteur = traducteur
+        self.cache = cache
+        self.nom = traducteur.nom
+
+    def traduire(self, texte, source, cible):
+        # espaces normalisés pour la clé seulement : le backend reçoit le texte d'origine, dont les
+        # sauts de ligne et les listes à puces doivent se retrouver dans la traduction
+        segment = ' '.join(texte.split())
+        if not segment:
+            return texte
+        cle = (self.nom, source, cible, segment)
+        traduction = self.cache.lire(cle)
+        if traduction is None:
+            traduction = self.traducteur.traduire(texte, source, cible)
+            self.cache.ajouter(cle, traduction)
+        return traduction
+
+    def enregistrer(self):
+        self.cache.enregistrer()
+
+    def log_stats(self):
+        self.cache.log_stats()
+
+
+# =============================================================================
+# creer_traducteur
+# =============================================================================
+def creer_traducteur(app_config):
+    """
+    Traducteur de la configuration (translation_backend), avec son cache si translation_cache_size > 0 ;
+    None si les questions et réponses ne doivent pas être traduites.
+    """
+    backend = app_config.get('translation_backend', 'auto')
+    if backend == 'auto':
+        # index et modèles multilingues : question et réponse restent en français
+        backend = 'none' if app_config.get('language') == 'fr' else 'google'
+    if backend == 'none':
+        return None
+    if backend == 'google':
+        traducteur = TraducteurGoogle()
+    elif backend == 'offline':
+        traducteur = TraducteurMarian(app_config.get('translation_offline_model',
+                                                     'Helsinki-NLP/opus-mt-{source}-{cible}'))
+    elif backend == 'stub':
+        traducteur = TraducteurStub()
+    else:
+        raise ValueError(f"translation_backend inconnu : '{backend}' (valeurs possibles : {BACKENDS})")
+    taille = int(app_config.get('translation_cache_size', 5000))
+    if taille <= 0:
+        return traducteur
+    return TraducteurEnCache(traducteur, CacheTraductions(os.path.join(app_config['data_dir'], CACHE_FILE), taille))
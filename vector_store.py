@@ -0,0 +1,396 @@
+# Fichier : vector_store.py
+#
+# Sauvegarde et chargement de la base vectorielle sans pickle.
+# Le répertoire faiss_index_<langue> contient :
+#   - index.faiss : l'index FAISS (faiss.write_index)
+#   - chunks/     : le chunk store des textes et métadonnées (voir chunk_store.py)
+# Une nouvelle base est construite dans faiss_index_<langue>.tmp puis mise en place d'un bloc
+# (sauvegarder_index) : l'index et le chunk store d'une même construction restent ensemble.
+# La position d'un vecteur dans l'index est le numéro de son morceau dans le chunk store :
+# le docstore LangChain lit à la demande, dans le chunk store projeté en mémoire,
+# les seuls morceaux retournés par une recherche.
+# RetrieverSections restreint la recherche aux morceaux de certaines sections (métadonnée
+# 'section' écrite par E02) : FAISS ne compare la question qu'à ces vecteurs.
+#
+# Type d'index (faiss_index_type dans cfg.yaml) :
+#   - flat  : recherche exacte, coût proportionnel au nombre de morceaux
+#   - hnsw  : graphe HNSW (faiss_hnsw_m voisins par noeud), pas d'entraînement
+#   - ivf   : partition en faiss_ivf_nlist listes (k-means entraîné par E03)
+#   - ivfpq : ivf + vecteurs compressés par quantification produit (faiss_pq_m octets par vecteur)
+# Les paramètres de recherche (faiss_hnsw_ef_search, faiss_ivf_nprobe) se règlent au chargement,
+# sans reconstruire l'index.
+# Recherche hybride : avec un index BM25 (bm25_index.py), RetrieverSections fusionne le classement
+# vectoriel et le classement BM25 des k_candidats premiers morceaux (Reciprocal Rank Fusion) et
+# garde les k premiers.
+# Quasi-doublons (near_duplicates.py) : un morceau représentant porte dans sa métadonnée 'alias' les
+# sections de ses copies retirées ; la restriction aux sections en tient compte.
+
+import os
+import shutil
+from typing import Any, Optional
+
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_core.retrievers import BaseRetriever
+
+from config import bcolors, logger
+from chunk_store import ChunkStore
+
+INDEX_FILE = 'index.faiss'
+CHUNKS_DIR = 'chunks'
+TYPES_INDEX = ['flat', 'hnsw', 'ivf', 'ivfpq']
+
+
+# =============================================================================
+# description_index
+# =============================================================================
+def description_index(app_config, nb_vecteurs=None):
+    """
+    Chaîne index_factory de FAISS pour le type d'index de la configuration.
+    """
+    type_index = app_config.get('faiss_index_type', 'flat')
+    if type_index == 'flat':
+        return 'Flat'
+    if type_index == 'hnsw':
+        return f"HNSW{int(app_config.get('faiss_hnsw_m', 32))}"
+    if type_index in ('ivf', 'ivfpq'):
+        nlist = int(app_config.get('faiss_ivf_nlist', 0))
+        if nlist <= 0:
+            # valeur usuelle : de l'ordre de 4 * racine(n) listes
+            nlist = max(1, int(4 * (nb_vecteurs or 1) ** 0.5))
+        if nb_vecteurs is not None:
+            # chaque liste doit recevoir des vecteurs d'entraînement
+            nlist = max(1, min(nlist, nb_vecteurs // 39))
+        if type_index == 'ivf':
+            return f"IVF{nlist},Flat"
+        return f"IVF{nlist},PQ{int(app_config.get('faiss_pq_m', 16))}x{int(app_config.get('faiss_pq_nbits', 8))}"
+    raise ValueError(f"faiss_index_type inconnu : '{type_index}' (valeurs possibles : {TYPES_INDEX})")
+
+
+# =============================================================================
+# index_a_entrainer
+# =============================================================================
+def index_a_entrainer(app_config):
+    return app_config.get('faiss_index_type', 'flat') in ('ivf', 'ivfpq')
+
+
+# =============================================================================
+# creer_index
+# =============================================================================
+def creer_index(app_config, dim, vecteurs=None):
+    """
+    Crée l'index FAISS de la configuration ; s'il doit être entraîné (ivf, ivfpq), il l'est sur les vecteurs.
+    """
+    import faiss
+
+    description = description_index(app_config, None if vecteurs is None else len(vecteurs))
+    index = faiss.index_factory(dim, description)
+    if hasattr(index, 'hnsw'):
+        index.hnsw.efConstruction = int(app_config.get('faiss_hnsw_ef_construction', 200))
+    if not index.is_trained:
+        if vecteurs is None:
+            raise ValueError(f"index '{description}' : des vecteurs sont nécessaires à l'entraînement")
+        nb_centroides_pq = 2 ** int(app_config.get('faiss_pq_nbits', 8))
+        if app_config.get('faiss_index_type') == 'ivfpq' and len(vecteurs) < nb_centroides_pq:
+            raise ValueError(f"index '{description}' : au moins {nb_centroides_pq} morceaux sont nécessaires à la "
+                             f"quantification produit ({len(vecteurs)} disponibles), utilisez faiss_index_type: ivf")
+        logger.info(f"Entraînement de l'index FAISS '{description}' sur {len(vecteurs)} vecteurs...")
+        index.train(np.ascontiguousarray(vecteurs, dtype=np.float32))
+    regler_recherche(index, app_config)
+    logger.info(f"Index FAISS : {bcolors.INPUT}{description}{bcolors.ENDC}")
+    return index
+
+
+# =============================================================================
+# regler_recherche
+# =============================================================================
+def regler_recherche(index, app_config=None, ef_search=None, nprobe=None):
+    """
+    Règle les paramètres de recherche de l'index (valeurs explicites, sinon celles de la configuration).
+    """
+    import faiss
+
+    app_config = app_config or {}
+    if hasattr(index, 'hnsw'):
+        ef_search = ef_search or app_config.get('faiss_hnsw_ef_search')
+        if ef_search:
+            index.hnsw.efSearch = int(ef_search)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        nprobe = nprobe or app_config.get('faiss_ivf_nprobe')
+        if nprobe:
+            ivf.nprobe = min(int(nprobe), ivf.nlist)
+
+
+# =============================================================================
+# _parametres_recherche
+# =============================================================================
+def _parametres_recherche(index, selecteur):
+    """
+    Paramètres de recherche avec sélecteur d'identifiants, du type attendu par l'index.
+    """
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selecteur, nprobe=ivf.nprobe)
+    if hasattr(index, 'hnsw'):
+        return faiss.SearchParametersHNSW(sel=selecteur, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selecteur)
+
+
+# =============================================================================
+# DocstoreChunkStore
+# =============================================================================
+class DocstoreChunkStore(Docstore):
+    """
+    Docstore LangChain en lecture seule au-dessus d'un chunk store : l'identifiant d'un document est
+    le numéro de son morceau.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def search(self, search):
+        try:
+            i = int(search)
+        except (TypeError, ValueError):
+            return f"ID {search} not found."
+        if not 0 <= i < len(self.store):
+            return f"ID {search} not found."
+        return self.store.document(i)
+
+
+# =============================================================================
+# sauvegarder_index
+# =============================================================================
+def sauvegarder_index(index, vector_store_path, chunk_store_path):
+    """
+    Écrit l'index FAISS et une copie du chunk store dans vector_store_path. La nouvelle base est construite
+    dans le répertoire provisoire (base_provisoire) puis mise à la place de l'ancienne en une fois : l'index
+    d'une base ne côtoie jamais le chunk store d'une autre, et un E04 qui a projeté l'ancien index en mémoire
+    continue de lire ses fichiers. Si le chunk store est déjà dans le répertoire provisoire (chaîne
+    pipeline.py), il n'est pas recopié.
+    """
+    import faiss
+
+    provisoire = base_provisoire(vector_store_path)
+    destination = os.path.join(provisoire, CHUNKS_DIR)
+    if os.path.normpath(chunk_store_path) != os.path.normpath(destination):
+        if os.path.exists(provisoire):
+            shutil.rmtree(provisoire)
+        os.makedirs(provisoire)
+        shutil.copytree(chunk_store_path, destination)
+    faiss.write_index(index, os.path.join(provisoire, INDEX_FILE))
+    # l'ancienne base (et l'ancien format FAISS.save_local, index.pkl) est retirée après la mise en place
+    ancienne = vector_store_path + '.old'
+    if os.path.exists(ancienne):
+        shutil.rmtree(ancienne)
+    if os.path.exists(vector_store_path):
+        os.replace(vector_store_path, ancienne)
+    os.replace(provisoire, vector_store_path)
+    if os.path.exists(ancienne):
+        shutil.rmtree(ancienne)
+
+
+# =============================================================================
+# base_provisoire
+# =============================================================================
+def base_provisoire(vector_store_path):
+    """
+    Répertoire où une nouvelle base est construite avant de remplacer celle de vector_store_path.
+    """
+    return vector_store_path + '.tmp'
+
+
+# =============================================================================
+# charger_base
+# =============================================================================
+def charger_base(vector_store_path, embeddings, app_config=None, mmap=False):
+    """
+    Charge la base vectorielle (FAISS LangChain) sans désérialisation d'objets Python.
+    Avec mmap, l'index est projeté en mémoire en lecture seule au lieu d'être lu en entier :
+    le chargement est immédiat et les pages sont lues à la demande. IO_FLAG_MMAP_IFC projette les
+    vecteurs de tous les types d'index (flat, stockage de hnsw, listes de ivf/ivfpq) ; IO_FLAG_MMAP
+    ne projetterait que les listes inversées des index ivf.
+    """
+    import faiss
+    from langchain_community.vectorstores import FAISS
+
+    chemin_index = os.path.join(vector_store_path, INDEX_FILE)
+    chemin_chunks = os.path.join(vector_store_path, CHUNKS_DIR)
+    if not os.path.exists(chemin_chunks):
+        raise FileNotFoundError(f"chunk store '{chemin_chunks}' absent : relancez E03_Embeddings.py "
+                                f"pour reconstruire l'index au nouveau format")
+    index = faiss.read_index(chemin_index, (faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY) if mmap else 0)
+    regler_recherche(index, app_config)
+    store = ChunkStore(chemin_chunks)
+    if index.ntotal != len(store):
+        raise ValueError(f"index '{chemin_index}' ({index.ntotal} vecteurs) et chunk store "
+                         f"'{chemin_chunks}' ({len(store)} morceaux) incohérents")
+    logger.debug(f"base vectorielle '{vector_store_path}' : {index.ntotal} vecteurs")
+    return FAISS(embedding_function=embeddings, index=index, docstore=DocstoreChunkStore(store),
+                 index_to_docstore_id={i: str(i) for i in range(index.ntotal)})
+
+
+# =============================================================================
+# empreinte_index
+# =============================================================================
+def empreinte_index(vector_store_path):
+    """
+    Empreinte de la base vectorielle (taille et date des fichiers) : elle change à chaque reconstruction.
+    """
+    empreinte = []
+    for nom in (INDEX_FILE, os.path.join(CHUNKS_DIR, 'meta.json')):
+        etat = os.stat(os.path.join(vector_store_path, nom))
+        empreinte.append(f"{nom}:{etat.st_size}:{etat.st_mtime_ns}")
+    return '|'.join(empreinte)
+
+
+# =============================================================================
+# ids_sections
+# =============================================================================
+def ids_sections(store, motifs):
+    """
+    Numéros des morceaux dont le chemin de section, ou celui de l'un de leurs alias, contient l'un des motifs
+    (sans tenir compte de la casse).
+    """
+    motifs = [m.lower() for m in motifs]
+
+    def correspond(section):
+        return any(m in section.lower() for m in motifs)
+
+    ids = store.indices('section', correspond)
+    alias = store.indices('alias', lambda liste: any(correspond(a.get('section', '')) for a in liste))
+    return np.union1d(ids, alias) if len(alias) else ids
+
+
+# =============================================================================
+# sections_index
+# =============================================================================
+def sections_index(store):
+    """
+    Chemins de section distincts des morceaux et de leurs alias, dans l'ordre de première apparition.
+    """
+    sections = dict.fromkeys(store.valeurs_distinctes('section'))
+    for liste in store.colonne('alias'):
+        sections.update(dict.fromkeys(a['section'] for a in liste or () if a.get('section')))
+    return list(sections)
+
+
+# =============================================================================
+# rechercher_vecteurs
+# =============================================================================
+def rechercher_vecteurs(db, vecteurs, k=4, ids=None):
+    """
+    Les k morceaux les plus proches de chaque vecteur (une seule recherche FAISS pour tous les vecteurs),
+    parmi les morceaux ids seulement si ids n'est pas None ; retourne une liste de (Document, distance)
+    par vecteur.
+    """
+    import faiss
+
+    vecteurs = np.ascontiguousarray(vecteurs, dtype=np.float32)
+    if ids is None:
+        distances, indices = db.index.search(vecteurs, k)
+    else:
+        if len(ids) == 0:
+            return [[] for _ in range(len(vecteurs))]
+        # le sélecteur doit rester référencé pendant la recherche
+        selecteur = faiss.IDSelectorBatch(np.asarray(ids, dtype=np.int64))
+        parametres = _parametres_recherche(db.index, selecteur)
+        distances, indices = db.index.search(vecteurs, k, params=parametres)
+    return [[(db.docstore.search(db.index_to_docstore_id[int(i)]), float(d)) for d, i in zip(ligne_d, ligne_i)
+             if i != -1] for ligne_d, ligne_i in zip(distances, indices)]
+
+
+# =============================================================================
+# encoder_requetes
+# =============================================================================
+def encoder_requetes(db, requetes):
+    """
+    Embeddings de plusieurs requêtes en un seul lot.
+    """
+    embeddings = db.embeddings
+    if hasattr(embeddings, 'embed_array'):
+        return embeddings.embed_array(requetes)
+    return np.asarray(embeddings.embed_documents(requetes), dtype=np.float32)
+
+
+# =============================================================================
+# rechercher
+# =============================================================================
+def rechercher(db, requete, k=4, ids=None):
+    """
+    Les k morceaux les plus proches de la requête, parmi les morceaux ids seulement si ids n'est pas None ;
+    retourne une liste de (Document, distance).
+    """
+    vecteur = np.asarray([db.embeddings.embed_query(requete)], dtype=np.float32)
+    return rechercher_vecteurs(db, vecteur, k, ids)[0]
+
+
+# =============================================================================
+# fusion_rrf
+# =============================================================================
+def fusion_rrf(classements, k=4, rrf_k=60):
+    """
+    Reciprocal Rank Fusion : les k numéros de meilleur score, somme de 1 / (rrf_k + rang) sur les classements.
+    """
+    scores = {}
+    for classement in classements:
+        for rang, i in enumerate(classement, 1):
+            scores[i] = scores.get(i, 0.0) + 1.0 / (rrf_k + rang)
+    return sorted(scores, key=lambda i: -scores[i])[:k]
+
+
+# =============================================================================
+# RetrieverSections
+# =============================================================================
+class RetrieverSections(BaseRetriever):
+    """
+    Retriever LangChain sur la base chargée par charger_base, éventuellement restreint à des sections ;
+    recherche hybride (vecteurs et BM25) si bm25 est un index BM25.
+    """
+    db: Any
+    k: int = 4
+    sections: Optional[list] = None
+    ids: Optional[Any] = None
+    bm25: Optional[Any] = None
+    k_candidats: int = 20
+    rrf_k: int = 60
+
+    @property
+    def k_recherche(self):
+        """
+        Nombre de résultats demandés à la recherche vectorielle.
+        """
+        return self.k if self.bm25 is None else max(self.k, self.k_candidats)
+
+    def restreindre(self, motifs=None):
+        """
+        Restreint la recherche aux sections contenant l'un des motifs (aucun motif : pas de restriction) ;
+        retourne le nombre de morceaux concernés.
+        """
+        self.sections = list(motifs) if motifs else None
+        self.ids = ids_sections(self.db.docstore.store, self.sections) if self.sections else None
+        return self.db.index.ntotal if self.ids is None else len(self.ids)
+
+    def recherche_vectorielle(self, requete):
+        """
+        Résultats (Document, distance) de la recherche vectorielle de la requête, avant la fusion avec BM25.
+        """
+        return rechercher(self.db, requete, self.k_recherche, self.ids)
+
+    def fusionner(self, requete, trouves, ids=None):
+        """
+        Documents retenus parmi les résultats (Document, distance) de la recherche vectorielle de la requête
+        (restreinte aux morceaux ids) : les k premiers, ou les k premiers de la fusion avec le classement BM25.
+        """
+        if self.bm25 is None:
+            return [doc for doc, _ in trouves[:self.k]]
+        classement_bm25 = [i for i, _ in self.bm25.rechercher(requete, self.k_candidats, ids)]
+        documents = {int(doc.id): doc for doc, _ in trouves}
+        return [documents[i] if i in documents else self.db.docstore.store.document(i)
+                for i in fusion_rrf([list(documents), classement_bm25], self.k, self.rrf_k)]
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return self.fusionner(query, self.recherche_vectorielle(query), self.ids)